@@ -0,0 +1,70 @@
+"""
+Measure chunking time per MB of text for every chunking mode.
+
+    python benchmark_chunking.py docs/manual.pdf docs/report.docx --modes semantic windowed sampled
+"""
+import argparse
+import time
+
+from llama_index.core import Document
+from llama_index.embeddings.huggingface import HuggingFaceEmbedding
+
+from const import ChunkingMode, ContextualRAGConfig
+from src.agentic.splitter import ContextualSemanticSplitter
+from utils.text_extractor import iter_sections
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("files", nargs="+", help="documents to chunk")
+    parser.add_argument(
+        "--modes",
+        nargs="+",
+        default=[str(mode) for mode in ChunkingMode],
+        choices=[str(mode) for mode in ChunkingMode],
+    )
+    parser.add_argument("--repeat", type=int, default=1, help="runs per mode and file")
+    args = parser.parse_args()
+
+    config = ContextualRAGConfig()
+    embedder = HuggingFaceEmbedding(
+        config.embedder_model,
+        embed_batch_size=config.embed_batch_size,
+    )
+
+    documents = [
+        (file_path, Document(text="\n".join(iter_sections(file_path))))
+        for file_path in args.files
+    ]
+
+    print(f"{'file':<40} {'mode':<10} {'MB':>8} {'chunks':>8} {'avg chars':>10} {'s/MB':>10}")
+    for mode in args.modes:
+        splitter = ContextualSemanticSplitter(
+            embed_model=embedder,
+            buffer_size=config.buffer_size,
+            breakpoint_percentile_threshold=config.breakpoint_percentile_threshold,
+            # apply the mode to every document regardless of its size
+            large_document_chars=0,
+            large_document_mode=ChunkingMode(mode),
+            target_chunk_chars=config.chunking_target_chars,
+            refine_sentences=config.chunking_refine_sentences,
+            sample_rate=config.chunking_sample_rate,
+        )
+        for file_path, document in documents:
+            size_mb = len(document.text.encode("utf-8")) / (1024 * 1024)
+            elapsed = 0.0
+            for _ in range(args.repeat):
+                start = time.perf_counter()
+                nodes = splitter.get_nodes_from_documents([document])
+                elapsed += time.perf_counter() - start
+            elapsed /= args.repeat
+
+            average = sum(len(node.text) for node in nodes) / max(1, len(nodes))
+            print(
+                f"{file_path[-40:]:<40} {mode:<10} {size_mb:>8.2f} {len(nodes):>8} "
+                f"{average:>10.0f} {elapsed / max(size_mb, 1e-9):>10.2f}"
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -2,6 +2,8 @@ from services.cloud import CloudService
 from services.agent import AgentService
 from services.auth import AuthService
 from services.knowledge import KnowledgeService
+from services.ingestion import IngestionService
+from services.extraction import ExtractionService
 from src import AgenticRAG
 from repository.database import SQLiteDatabaseRepository
 from utils.logger import get_logger
@@ -30,9 +32,17 @@ DATABASE = SQLiteDatabaseRepository(
     config.get("SQLITE_REINIT_DB") == "true" else False,
 )
 
+EXTRACTION_SERVICE = ExtractionService(
+    processes=int(config.get("EXTRACTION_WORKERS", 0)),
+    timeout=float(config.get("EXTRACTION_TIMEOUT", 300)),
+    max_jobs_per_worker=int(config.get("EXTRACTION_MAX_JOBS_PER_WORKER", 50)),
+    section_chars=int(config.get("STREAM_SECTION_CHARS", 20000)),
+)
+
 AGENTIC_SERVICE = AgentService(
     config=config,
     database_instance=DATABASE,
+    extraction_service=EXTRACTION_SERVICE,
 )
 
 AUTH_SERVICE = AuthService(
@@ -44,4 +54,14 @@ AUTH_SERVICE = AuthService(
 
 KNOWLEDGE_SERVICE = KnowledgeService(
     database_instance=DATABASE,
-)
\ No newline at end of file
+    answer_cache=AGENTIC_SERVICE.answer_cache,
+)
+
+INGESTION_SERVICE = IngestionService(
+    database_instance=DATABASE,
+    agent_service=AGENTIC_SERVICE,
+    cloud_service=CLOUD_SERVICE,
+    max_workers=int(config.get("INGESTION_WORKERS", 2)),
+    max_pending=int(config.get("INGESTION_MAX_PENDING", 32)),
+    max_entry_bytes=int(config.get("BULK_MAX_ENTRY_BYTES", 100 * 1024 * 1024)),
+)
@@ -8,12 +8,47 @@ PROMPT_DOC = """<document>
 </document>
 """
 
+# bump when PROMPT_DOC, PROMPT_CHUNK or PROMPT_CHUNKS change, cached contexts are keyed by it
+PROMPT_CONTEXTUAL_VERSION = "1"
+
 PROMPT_CHUNK = """Here is the chunk we want to situate within the whole document
 
 {CHUNK_CONTENT}
 
 Please give a short succinct context to situate this chunk within the overall document for the purposes of improving search retrieval of the chunk. Answer only with the succinct context and nothing else."""
 
+PROMPT_CHUNKS = """Here are the chunks we want to situate within the whole document
+
+{CHUNKS_CONTENT}
+
+For each chunk, please give a short succinct context to situate it within the overall document for the purposes of improving search retrieval of the chunk.
+
+Please ONLY return in json format like this, with one entry for every chunk:
+{{
+    "contexts": [
+        {{
+            "index": ### The index of the chunk,
+            "context": ### The short succinct context of the chunk
+        }}
+    ]
+}}
+"""
+
+PROMPT_SECTION_SUMMARY = """Here is a section of a longer document
+
+<section>
+{SECTION_CONTENT}
+</section>
+
+Please summarize this section in one or two sentences, naming its main topics, so it can serve as an entry in an outline of the document. Answer only with the summary and nothing else."""
+
+# replaces the whole document in contextual prompts for long documents
+PROMPT_OUTLINE = """Outline of the document, one summary per section:
+{OUTLINE}
+
+Sections {SECTIONS} of the document, where the chunk comes from:
+{SECTION_CONTENT}"""
+
 ASSISTANT_SYSTEM_PROMPT = """
 You are an advanced AI agent designed to assist users by searching through a diverse knowledge base
 of files and providing relevant information.
@@ -91,6 +126,133 @@ class RerankerService(Enum):
     
     FLAGEMBEDDING = "flag_embedding"
 
+class IngestionStatus(Enum):
+    """
+    Enum for the states an ingestion job moves through.
+    """
+    
+    def __str__(self):
+        return self.value
+    
+    QUEUED = "queued"
+    EXTRACTING = "extracting"
+    CONTEXTUALIZING = "contextualizing"
+    INDEXING = "indexing"
+    DONE = "done"
+    FAILED = "failed"
+
+class ContextualMode(Enum):
+    """
+    Enum for the different ways chunks can be contextualized.
+    """
+    
+    def __str__(self):
+        return self.value
+    
+    # one LLM call per chunk
+    SINGLE = "single"
+    # one LLM call per group of chunks, the document is sent once per group
+    BATCHED = "batched"
+
+class ChunkEmbeddingMode(Enum):
+    """
+    Enum for the ways the vector of a contextual chunk can be computed.
+    """
+    
+    def __str__(self):
+        return self.value
+    
+    # embed the context and the chunk text again
+    REEMBED = "reembed"
+    # mean of the sentence embeddings computed by the splitter
+    POOLED = "pooled"
+    # splitter sentence embeddings mixed with an embedding of the context only
+    COMBINED = "combined"
+
+
+class ChunkingMode(Enum):
+    """
+    Enum for the ways documents above the large document threshold are chunked.
+    """
+    
+    def __str__(self):
+        return self.value
+    
+    # embed every sentence group, like small documents
+    SEMANTIC = "semantic"
+    # fixed size chunks, boundaries moved to the largest semantic break nearby
+    WINDOWED = "windowed"
+    # semantic breakpoints computed on every n-th sentence group only
+    SAMPLED = "sampled"
+
+
+class CheckpointStage(Enum):
+    """
+    Enum for the stages recorded in an ingestion checkpoint, in order.
+    """
+    
+    def __str__(self):
+        return self.value
+    
+    SPLIT = "split"
+    CONTEXTUALIZED = "contextualized"
+    EMBEDDED = "embedded"
+    INDEXED = "indexed"
+
+
+class LLMPriority(Enum):
+    """
+    Enum for the priority classes of LLM calls, in scheduling order.
+    """
+    
+    def __str__(self):
+        return self.value
+    
+    # interactive chat, served first
+    CHAT = "chat"
+    # background ingestion (contextualization, section summaries)
+    INGESTION = "ingestion"
+
+class RetrievalMode(Enum):
+    """
+    Enum for the ways chunks are retrieved for a query.
+    """
+    
+    def __str__(self):
+        return self.value
+    
+    # ANN on Milvus only
+    SEMANTIC = "semantic"
+    # BM25 on Elasticsearch and ANN on Milvus, fused
+    HYBRID = "hybrid"
+
+class FusionMethod(Enum):
+    """
+    Enum for the ways hybrid retrieval results are fused.
+    """
+    
+    def __str__(self):
+        return self.value
+    
+    # reciprocal rank fusion, only the ranks matter
+    RRF = "rrf"
+    # sum of the min-max normalized scores
+    WEIGHTED = "weighted"
+
+class NearDuplicateScope(Enum):
+    """
+    Enum for the chunks a new chunk is compared with to find near-duplicates.
+    """
+    
+    def __str__(self):
+        return self.value
+    
+    # earlier chunks of the same document, duplicates are dropped
+    DOCUMENT = "document"
+    # also the stored chunks of the uploader's other documents, whose context
+    # and vector are copied instead of generated
+    USER = "user"
+
 class ContextualRAGConfig:
     """
     Class to hold configuration values.
@@ -108,6 +270,118 @@ class ContextualRAGConfig:
         self.reranker_top_n = 5
         self.llm_model = "gpt-4o-mini"
         
+        # contextual chunk generation
+        self.contextual_concurrency = int(config.get("CONTEXTUAL_CONCURRENCY", 8))
+        self.contextual_max_retries = int(config.get("CONTEXTUAL_MAX_RETRIES", 3))
+        self.contextual_retry_backoff = float(config.get("CONTEXTUAL_RETRY_BACKOFF", 1.0))
+        self.contextual_mode = ContextualMode(config.get("CONTEXTUAL_MODE", "single"))
+        self.contextual_batch_token_budget = int(config.get("CONTEXTUAL_BATCH_TOKEN_BUDGET", 2000))
+        self.contextual_batch_max_chunks = int(config.get("CONTEXTUAL_BATCH_MAX_CHUNKS", 16))
+        # documents above this many tokens are contextualized against an outline
+        # and the chunk's section instead of the full text, 0 disables it
+        self.contextual_hierarchical_threshold = int(config.get("CONTEXTUAL_HIERARCHICAL_THRESHOLD", 0))
+        self.contextual_section_tokens = int(config.get("CONTEXTUAL_SECTION_TOKENS", 2000))
+        
+        # streaming ingestion, a window is the part of the document chunks are situated in
+        self.stream_window_chars = int(config.get("STREAM_WINDOW_CHARS", 100000))
+        self.stream_section_chars = int(config.get("STREAM_SECTION_CHARS", 20000))
+        
+        # chunking, documents above the threshold (in characters) use the large mode
+        self.chunking_large_threshold = int(config.get("CHUNKING_LARGE_THRESHOLD", 50000))
+        self.chunking_large_mode = ChunkingMode(config.get("CHUNKING_LARGE_MODE", "semantic"))
+        self.chunking_target_chars = int(config.get("CHUNKING_TARGET_CHARS", 2000))
+        # sentences on each side of a windowed boundary that are embedded to refine it
+        self.chunking_refine_sentences = int(config.get("CHUNKING_REFINE_SENTENCES", 4))
+        self.chunking_sample_rate = int(config.get("CHUNKING_SAMPLE_RATE", 4))
+        
+        # per-document ingestion progress, disabled when the directory is empty
+        self.ingestion_checkpoint_dir = config.get("INGESTION_CHECKPOINT_DIR", "")
+        
+        # chunk embedding
+        self.embed_batch_size = int(config.get("EMBED_BATCH_SIZE", 32))
+        # share of the free (GPU or host) memory an embedding batch may use
+        self.embed_memory_fraction = float(config.get("EMBED_MEMORY_FRACTION", 0.25))
+        # rough peak memory of one item in a forward pass
+        self.embed_bytes_per_item = int(config.get("EMBED_BYTES_PER_ITEM", 16 * 1024 * 1024))
+        
+        self.chunk_embedding_mode = ChunkEmbeddingMode(config.get("CHUNK_EMBEDDING_MODE", "reembed"))
+        # weight of the context embedding in the combined mode
+        self.chunk_embedding_context_weight = float(config.get("CHUNK_EMBEDDING_CONTEXT_WEIGHT", 0.3))
+        
+        # persistent embedding cache, disabled when the path is empty
+        self.embedding_cache_path = config.get("EMBEDDING_CACHE_PATH", "")
+        self.embedding_cache_max_bytes = int(config.get("EMBEDDING_CACHE_MAX_BYTES", 1024 * 1024 * 1024))
+        # float16 halves the size on disk, float32 keeps full precision
+        self.embedding_cache_dtype = config.get("EMBEDDING_CACHE_DTYPE", "float16")
+        
+        # persistent cache of generated contexts, disabled when the path is empty
+        self.contextual_cache_path = config.get("CONTEXTUAL_CACHE_PATH", "")
+        self.contextual_cache_max_bytes = int(config.get("CONTEXTUAL_CACHE_MAX_BYTES", 256 * 1024 * 1024))
+        # seconds, 30 days by default
+        self.contextual_cache_ttl = float(config.get("CONTEXTUAL_CACHE_TTL", 30 * 24 * 3600))
+        
+        # LLM scheduling shared by chat and ingestion, 0 disables a limit
+        self.llm_requests_per_minute = int(config.get("LLM_REQUESTS_PER_MINUTE", 0))
+        self.llm_tokens_per_minute = int(config.get("LLM_TOKENS_PER_MINUTE", 0))
+        self.llm_max_concurrency = int(config.get("LLM_MAX_CONCURRENCY", 0))
+        # share of every limit that only chat calls may use
+        self.llm_chat_reserve = float(config.get("LLM_CHAT_RESERVE", 0.2))
+        # completion tokens assumed for a call until its real usage is known
+        self.llm_completion_tokens = int(config.get("LLM_COMPLETION_TOKENS", 512))
+        
+        # near-duplicate chunks, estimated Jaccard similarity of their word
+        # shingles, 0 disables the detection
+        self.near_duplicate_threshold = float(config.get("NEAR_DUPLICATE_THRESHOLD", 0))
+        self.near_duplicate_scope = NearDuplicateScope(config.get("NEAR_DUPLICATE_SCOPE", "document"))
+        self.near_duplicate_num_perm = int(config.get("NEAR_DUPLICATE_NUM_PERM", 64))
+        
+        # CPU sharing between chat and ingestion in the API process
+        # embedding batch size cap of ingestion while a chat is running
+        self.cpu_slice_items = int(config.get("CPU_SLICE_ITEMS", 16))
+        # seconds an ingestion slice waits for running chat work
+        self.cpu_max_defer = float(config.get("CPU_MAX_DEFER", 1.0))
+        # p95 seconds of the chat retrieval path, including the Milvus and
+        # Elasticsearch round trips and reranking, 0 disables throttling
+        self.chat_latency_slo = float(config.get("CHAT_LATENCY_SLO", 0))
+        self.cpu_max_throttle = float(config.get("CPU_MAX_THROTTLE", 4.0))
+        
+        # in-memory cache of query embeddings, disabled when the size is 0
+        self.query_cache_max_bytes = int(config.get("QUERY_CACHE_MAX_BYTES", 64 * 1024 * 1024))
+        # seconds
+        self.query_cache_ttl = float(config.get("QUERY_CACHE_TTL", 3600))
+        
+        # answers reused for similar first questions to a chatbot, opt-in
+        # with a cosine similarity such as 0.95, 0 disables
+        self.answer_cache_threshold = float(config.get("ANSWER_CACHE_THRESHOLD", 0))
+        # answers kept per chatbot
+        self.answer_cache_max_entries = int(config.get("ANSWER_CACHE_MAX_ENTRIES", 1000))
+        self.answer_cache_max_chatbots = int(config.get("ANSWER_CACHE_MAX_CHATBOTS", 256))
+        
+        # retrieval
+        self.retrieval_mode = RetrievalMode(config.get("RETRIEVAL_MODE", "semantic"))
+        self.fusion_method = FusionMethod(config.get("FUSION_METHOD", "rrf"))
+        self.fusion_rrf_k = int(config.get("FUSION_RRF_K", 60))
+        self.fusion_vector_weight = float(config.get("FUSION_VECTOR_WEIGHT", 1.0))
+        self.fusion_bm25_weight = float(config.get("FUSION_BM25_WEIGHT", 1.0))
+        # candidates taken from each source before fusion
+        self.hybrid_candidates = int(config.get("HYBRID_CANDIDATES", 20))
+        # threads running the Milvus side of hybrid searches
+        self.hybrid_search_workers = int(config.get("HYBRID_SEARCH_WORKERS", 8))
+        
+        # reranking of concurrent chats in shared batches, 0 disables
+        self.rerank_max_batch_size = int(config.get("RERANK_MAX_BATCH_SIZE", 64))
+        # seconds a rerank request waits for others to join its batch
+        self.rerank_max_wait = float(config.get("RERANK_MAX_WAIT", 0.01))
+        
+        # local copy of the chunk texts for retrieval, disabled when the path is empty
+        self.docstore_path = config.get("DOCSTORE_PATH", "")
+        
+        # bulk writes to Milvus and Elasticsearch
+        self.vectordb_insert_batch_size = int(config.get("MILVUS_INSERT_BATCH_SIZE", 1000))
+        self.es_bulk_chunk_size = int(config.get("ELASTICSEARCH_BULK_CHUNK_SIZE", 500))
+        self.bulk_max_retries = int(config.get("BULK_MAX_RETRIES", 3))
+        self.bulk_retry_backoff = float(config.get("BULK_RETRY_BACKOFF", 1.0))
+        
         self.key = config.get("OPEN_AI_API_KEY")
         self.vectordb_uri = config.get("MILVUS_URI")
         self.vectordb_collection = config.get("MILVUS_COLLECTION")
@@ -5,11 +5,12 @@ from contextlib import asynccontextmanager
 from fastapi import FastAPI, Request, status
 from fastapi.exceptions import RequestValidationError
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, PlainTextResponse
 from pydantic import ValidationError
 
 from utils.config import get_config
 from utils.logger import get_logger
+from utils.metrics import get_metrics
 
 from const import (
     ContextualRAGConfig,
@@ -37,15 +38,35 @@ This is API.
 # ]
 
 
+def include_routers(app: FastAPI):
+    # the routers import bootstrap, which loads the models and the database.
+    # Extraction workers are spawned and re-import this file as __mp_main__,
+    # so nothing at module level may import them.
+    from routers.agents.controller import router as agents_router
+    from routers.auth.controller import router as auth_router
+    from routers.documents.controller import router as documents_router
+    from routers.knowledges.controller import router as knowledges_router
+
+    app.include_router(agents_router, prefix="/agents", tags=["agents"])
+    app.include_router(auth_router, prefix="/auth", tags=["auth"])
+    app.include_router(documents_router, prefix="/documents", tags=["documents"])
+    app.include_router(knowledges_router, prefix="/knowledges", tags=["knowledges"])
+
+
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     # Startup
     logger.info("Starting up")
     logger.info("Start application in %s mode" % config["MODE"])
+    include_routers(app)
     yield
 
     # Shutdown
     logger.info("Shutting down")
+    from bootstrap import INGESTION_SERVICE, EXTRACTION_SERVICE, AGENTIC_SERVICE
+    INGESTION_SERVICE.shutdown()
+    EXTRACTION_SERVICE.shutdown()
+    AGENTIC_SERVICE.shutdown()
     # singletons.shutdown()
 
 
@@ -92,6 +113,19 @@ async def root():
     }
 
 
+@app.get("/metrics")
+async def metrics():
+    return PlainTextResponse(get_metrics().render())
+
+
+@app.get("/stats")
+async def stats():
+    # imported here, main.py must stay importable without bootstrap
+    from bootstrap import AGENTIC_SERVICE
+
+    return AGENTIC_SERVICE.stats()
+
+
 @app.get("/healh_check")
 async def healh_check():
     logger.info("Health check")
@@ -101,16 +135,6 @@ async def healh_check():
     }
 
 
-from routers.agents.controller import router as agents_router
-from routers.auth.controller import router as auth_router
-from routers.documents.controller import router as documents_router
-from routers.knowledges.controller import router as knowledges_router
-
-app.include_router(agents_router, prefix="/agents", tags=["agents"])
-app.include_router(auth_router, prefix="/auth", tags=["auth"])
-app.include_router(documents_router, prefix="/documents", tags=["documents"])
-app.include_router(knowledges_router, prefix="/knowledges", tags=["knowledges"])
-
 from middleware.authentication import AuthMiddleware
 
 app.add_middleware(
@@ -123,6 +147,7 @@ app.add_middleware(
         "/auth/profile",
         "/documents",
         "/knowledges",
+        "/stats",
     ],
 )
 
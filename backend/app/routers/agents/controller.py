@@ -7,6 +7,7 @@ import json
 from fastapi import APIRouter, Depends, File, UploadFile, Request
 from fastapi.responses import JSONResponse
 from fastapi.security import HTTPBearer
+from starlette.concurrency import run_in_threadpool
 from typing import Annotated, List
 
 from llama_index.core import Document
@@ -109,7 +110,13 @@ async def chat(
             content=ResponseModel(status=401, message="Unauthorized", data={}).dict(),
         )
     try:
-        data = AGENTIC_SERVICE.chat(chat_request.query, chat_request.conversation_id)
+        # off the event loop, so concurrent chats overlap and share rerank batches
+        data = await run_in_threadpool(
+            AGENTIC_SERVICE.chat,
+            chat_request.query,
+            chat_request.conversation_id,
+            username=request.state.user["username"],
+        )
 
     except Exception as e:
         return JSONResponse(
@@ -7,6 +7,7 @@ import json
 from fastapi import APIRouter,Depends,File,UploadFile
 
 from fastapi.responses import JSONResponse
+from starlette.concurrency import run_in_threadpool
 
 from typing import Annotated,List
 from fastapi import Request, Depends
@@ -16,6 +17,7 @@ from llama_index.core import Document
 
 from utils.logger import get_logger
 from utils.checker import check_upload_file
+from utils.hashing import copy_with_hash
 
 from routers.schemas import ResponseModel
 
@@ -24,6 +26,7 @@ from bootstrap import (
     AGENTIC_SERVICE,
     AUTH_SERVICE,
     KNOWLEDGE_SERVICE,
+    INGESTION_SERVICE,
 )
 
 router = APIRouter()
@@ -56,52 +59,247 @@ async def upload_documents(
         )
         
     doc_id = str(uuid.uuid4())
+    file_type = document.filename.split('.')[-1]
+    object_name = f"documents/{doc_id}.{file_type}"
     
-    temp_file_path = f"/tmp/{doc_id}.{document.filename.split('.')[-1]}"
+    temp_file_path = f"/tmp/{doc_id}.{file_type}"
     with open(temp_file_path, "wb") as temp_file:
-        shutil.copyfileobj(document.file, temp_file)
+        content_hash = await run_in_threadpool(copy_with_hash, document.file, temp_file)
     
-    if CLOUD_SERVICE.cloud_repository.upload(
-        object_name=f"documents/{doc_id}.{document.filename.split('.')[-1]}",
+    job_id = INGESTION_SERVICE.submit(
         file_path=temp_file_path,
-        bucket_name=CLOUD_SERVICE.bucket_name,
-    ):
-        logger.info(f"Document uploaded: {document.filename}")
-        
-        if AGENTIC_SERVICE.add_document(
-            file_path=temp_file_path,
-            doc_id=doc_id,
-            username=request.state.user["username"],
-            object_name=f"documents/{doc_id}.{document.filename.split('.')[-1]}",
-            file_name=document.filename,
-            file_type=document.filename.split('.')[-1],
-            file_size=os.path.getsize(temp_file_path),
-        ):
-            logger.info(f"Document processed: {document.filename}")
-            return JSONResponse(
-                status_code=200,
-                content=ResponseModel(status=200, message="Upload successful", data={})
-            )
-        else:
-            logger.error(f"Document processing failed: {document.filename}")
-            CLOUD_SERVICE.cloud_repository.delete(
-                object_name=f"documents/{doc_id}.{document.filename.split('.')[-1]}",
-                bucket_name=CLOUD_SERVICE.bucket_name
-            )
-            return JSONResponse(
-                status_code=500,
-                content=ResponseModel(status=500, message="Processing failed", data={})
-            )
-    else:
-        logger.error(f"Document upload failed: {document.filename}")
+        doc_id=doc_id,
+        username=request.state.user["username"],
+        object_name=object_name,
+        file_name=document.filename,
+        file_type=file_type,
+        file_size=os.path.getsize(temp_file_path),
+        content_hash=content_hash,
+    )
+    if not job_id:
+        logger.error(f"Document could not be queued: {document.filename}")
+        os.remove(temp_file_path)
+        return JSONResponse(
+            status_code=429,
+            content=ResponseModel(status=429, message="Ingestion queue is full", data={})
+        )
+    
+    logger.info(f"Document queued: {document.filename}")
+    return JSONResponse(
+        status_code=202,
+        content=ResponseModel(
+            status=202,
+            message="Upload accepted",
+            data={
+                "job_id": job_id,
+                "document_id": doc_id,
+            },
+        )
+    )
+
+@router.post("/bulk-upload", dependencies=[Depends(security)])
+async def bulk_upload_documents(
+    request: Request,
+    documents: List[UploadFile] = File(...),
+):
+    """
+    Upload many documents, or zip/tar archives of documents, at once
+    """
+    logger.info(f"Bulk upload request incoming")
+    
+    if not AUTH_SERVICE.is_access_token(request.state.user):
+        return JSONResponse(
+            status_code=401,
+            content=ResponseModel(status=401, message="Unauthorized", data={})
+        )
+    
+    # archives are kept whole, their entries are read one by one later
+    uploads = []
+    for document in documents:
+        file_name = os.path.basename(document.filename or "")
+        temp_file_path = f"/tmp/{uuid.uuid4()}-{file_name}"
+        with open(temp_file_path, "wb") as temp_file:
+            await run_in_threadpool(shutil.copyfileobj, document.file, temp_file)
+        uploads.append((temp_file_path, file_name))
+    
+    batch_id = INGESTION_SERVICE.submit_batch(
+        uploads=uploads,
+        username=request.state.user["username"],
+    )
+    if not batch_id:
+        for temp_file_path, _ in uploads:
+            os.remove(temp_file_path)
         return JSONResponse(
             status_code=500,
-            content=ResponseModel(status=500, message="Upload failed", data={})
+            content=ResponseModel(status=500, message="Bulk upload failed", data={})
         )
-        
+    
+    logger.info(f"Bulk upload queued: {len(uploads)} files")
+    return JSONResponse(
+        status_code=202,
+        content=ResponseModel(
+            status=202,
+            message="Bulk upload accepted",
+            data={
+                "batch_id": batch_id,
+            },
+        )
+    )
+
+@router.get("/batches/{batch_id}", dependencies=[Depends(security)])
+async def get_ingestion_batch(
+    batch_id: str,
+    request: Request,
+):
+    """
+    Get the progress of a bulk upload and the status of each file
+    """
+    logger.info(f"Get ingestion batch request incoming")
+    
+    if not AUTH_SERVICE.is_access_token(request.state.user):
+        return JSONResponse(
+            status_code=401,
+            content=ResponseModel(status=401, message="Unauthorized", data={})
+        )
+    
+    batch = INGESTION_SERVICE.get_batch(
+        batch_id=batch_id,
+        username=request.state.user["username"],
+    )
+    if not batch:
+        return JSONResponse(
+            status_code=404,
+            content=ResponseModel(status=404, message="Batch not found", data={})
+        )
+    
+    return JSONResponse(
+        status_code=200,
+        content=ResponseModel(status=200, message="Batch found", data=batch)
+    )
+
+@router.get("/jobs/{job_id}", dependencies=[Depends(security)])
+async def get_ingestion_job(
+    job_id: str,
+    request: Request,
+):
+    """
+    Get the status of an ingestion job
+    """
+    logger.info(f"Get ingestion job request incoming")
+    
+    if not AUTH_SERVICE.is_access_token(request.state.user):
+        return JSONResponse(
+            status_code=401,
+            content=ResponseModel(status=401, message="Unauthorized", data={})
+        )
+    
+    job = INGESTION_SERVICE.get_job(
+        job_id=job_id,
+        username=request.state.user["username"],
+    )
+    if not job:
+        return JSONResponse(
+            status_code=404,
+            content=ResponseModel(status=404, message="Job not found", data={})
+        )
+    
+    return JSONResponse(
+        status_code=200,
+        content=ResponseModel(status=200, message="Job found", data=job)
+    )
+
+@router.get("/jobs/{job_id}/report", dependencies=[Depends(security)])
+async def get_ingestion_report(
+    job_id: str,
+    request: Request,
+):
+    """
+    Get the per-stage timings and counts of an ingestion job
+    """
+    logger.info(f"Get ingestion report request incoming")
+    
+    if not AUTH_SERVICE.is_access_token(request.state.user):
+        return JSONResponse(
+            status_code=401,
+            content=ResponseModel(status=401, message="Unauthorized", data={})
+        )
+    
+    report = INGESTION_SERVICE.get_report(
+        job_id=job_id,
+        username=request.state.user["username"],
+    )
+    if not report:
+        return JSONResponse(
+            status_code=404,
+            content=ResponseModel(status=404, message="Report not found", data={})
+        )
+    
     return JSONResponse(
-        status_code=500,
-        content={"message": "Upload failed"},
+        status_code=200,
+        content=ResponseModel(status=200, message="Report found", data=report)
+    )
+
+@router.post("/jobs/{job_id}/retry", dependencies=[Depends(security)])
+async def retry_ingestion_job(
+    job_id: str,
+    request: Request,
+):
+    """
+    Resume a failed ingestion job from its checkpoint
+    """
+    logger.info(f"Retry ingestion job request incoming")
+    
+    if not AUTH_SERVICE.is_access_token(request.state.user):
+        return JSONResponse(
+            status_code=401,
+            content=ResponseModel(status=401, message="Unauthorized", data={})
+        )
+    
+    job_id = await run_in_threadpool(
+        INGESTION_SERVICE.retry,
+        job_id=job_id,
+        username=request.state.user["username"],
+    )
+    if not job_id:
+        return JSONResponse(
+            status_code=409,
+            content=ResponseModel(status=409, message="Job cannot be resumed", data={})
+        )
+    
+    return JSONResponse(
+        status_code=202,
+        content=ResponseModel(status=202, message="Job resumed", data={"job_id": job_id})
+    )
+
+@router.delete("/jobs/{job_id}", dependencies=[Depends(security)])
+async def discard_ingestion_job(
+    job_id: str,
+    request: Request,
+):
+    """
+    Drop the progress of a failed ingestion job
+    """
+    logger.info(f"Discard ingestion job request incoming")
+    
+    if not AUTH_SERVICE.is_access_token(request.state.user):
+        return JSONResponse(
+            status_code=401,
+            content=ResponseModel(status=401, message="Unauthorized", data={})
+        )
+    
+    if not await run_in_threadpool(
+        INGESTION_SERVICE.discard,
+        job_id=job_id,
+        username=request.state.user["username"],
+    ):
+        return JSONResponse(
+            status_code=409,
+            content=ResponseModel(status=409, message="Job cannot be discarded", data={})
+        )
+    
+    return JSONResponse(
+        status_code=200,
+        content=ResponseModel(status=200, message="Job discarded", data={})
     )
 
 @router.get("/list", dependencies=[Depends(security)])
@@ -131,4 +329,133 @@ async def list_documents(
     return JSONResponse(
         status_code=200,
         content=ResponseModel(status=200, message="Documents found", data=documents)
-    )
\ No newline at end of file
+    )
+
+@router.put("/{document_id}", dependencies=[Depends(security)])
+async def update_document(
+    document_id: str,
+    request: Request,
+    document: UploadFile = File(...),
+):
+    """
+    Replace the content of a document, only changed chunks are processed again
+    """
+    logger.info(f"Update document request incoming")
+    
+    if not AUTH_SERVICE.is_access_token(request.state.user):
+        return JSONResponse(
+            status_code=401,
+            content=ResponseModel(status=401, message="Unauthorized", data={})
+        )
+    
+    if not check_upload_file(document):
+        return JSONResponse(
+            status_code=400,
+            content=ResponseModel(status=400, message="Invalid file format", data={})
+        )
+    
+    existing = AGENTIC_SERVICE.get_document(
+        doc_id=document_id,
+        username=request.state.user["username"],
+    )
+    if not existing:
+        return JSONResponse(
+            status_code=404,
+            content=ResponseModel(status=404, message="Document not found", data={})
+        )
+    
+    if AGENTIC_SERVICE.count_source_references(document_id) > 1:
+        return JSONResponse(
+            status_code=409,
+            content=ResponseModel(status=409, message="Document content is shared with other documents", data={})
+        )
+    
+    file_type = document.filename.split('.')[-1]
+    # a new object per version, the previous one may be shared with duplicates
+    object_name = f"documents/{document_id}-{uuid.uuid4()}.{file_type}"
+    
+    temp_file_path = f"/tmp/{uuid.uuid4()}.{file_type}"
+    with open(temp_file_path, "wb") as temp_file:
+        content_hash = await run_in_threadpool(copy_with_hash, document.file, temp_file)
+    
+    if content_hash == existing["content_hash"]:
+        os.remove(temp_file_path)
+        return JSONResponse(
+            status_code=200,
+            content=ResponseModel(status=200, message="Document unchanged", data={"document_id": document_id})
+        )
+    
+    job_id = INGESTION_SERVICE.submit(
+        file_path=temp_file_path,
+        doc_id=document_id,
+        username=request.state.user["username"],
+        object_name=object_name,
+        file_name=document.filename,
+        file_type=file_type,
+        file_size=os.path.getsize(temp_file_path),
+        content_hash=content_hash,
+        update=True,
+    )
+    if not job_id:
+        logger.error(f"Document update could not be queued: {document.filename}")
+        os.remove(temp_file_path)
+        return JSONResponse(
+            status_code=429,
+            content=ResponseModel(status=429, message="Ingestion queue is full", data={})
+        )
+    
+    return JSONResponse(
+        status_code=202,
+        content=ResponseModel(
+            status=202,
+            message="Update accepted",
+            data={
+                "job_id": job_id,
+                "document_id": document_id,
+            },
+        )
+    )
+
+@router.delete("/{document_id}", dependencies=[Depends(security)])
+async def delete_document(
+    document_id: str,
+    request: Request,
+):
+    """
+    Delete a document
+    """
+    logger.info(f"Delete document request incoming")
+    
+    if not AUTH_SERVICE.is_access_token(request.state.user):
+        return JSONResponse(
+            status_code=401,
+            content=ResponseModel(status=401, message="Unauthorized", data={})
+        )
+    
+    document = AGENTIC_SERVICE.get_document(
+        doc_id=document_id,
+        username=request.state.user["username"],
+    )
+    if not document:
+        return JSONResponse(
+            status_code=404,
+            content=ResponseModel(status=404, message="Document not found", data={})
+        )
+    
+    if not AGENTIC_SERVICE.delete_document(document_id):
+        return JSONResponse(
+            status_code=500,
+            content=ResponseModel(status=500, message="Delete failed", data={})
+        )
+    
+    # the stored file may be shared with duplicates of this document
+    if AGENTIC_SERVICE.count_object_references(document["object_name"]) == 0:
+        CLOUD_SERVICE.cloud_repository.delete(
+            object_name=document["object_name"],
+            bucket_name=CLOUD_SERVICE.bucket_name,
+        )
+    
+    return JSONResponse(
+        status_code=200,
+        content=ResponseModel(status=200, message="Document deleted", data={})
+    )
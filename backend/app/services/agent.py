@@ -1,14 +1,20 @@
-import textract
 import os
 import threading
 import uuid
 
+from typing import Callable
+
 from src import AgenticRAG
-from const import ContextualRAGConfig
+from const import ContextualRAGConfig, IngestionStatus, LLMPriority, NearDuplicateScope
 
-from llama_index.core import Document
 from llama_index.core.llms import ChatMessage, MessageRole
 from utils.logger import get_logger
+from utils.text_extractor import iter_sections
+from utils.ingestion_report import timed_sections
+from utils.llm_scheduler import llm_scope
+from utils.minhash import MinHasher
+from utils.answer_cache import SemanticAnswerCache
+from utils.hashing import hash_text
 
 logger = get_logger()
 
@@ -18,9 +24,20 @@ class AgentService:
         self,
         database_instance,
         config,
+        extraction_service=None,
     ):
         self.agentic = AgenticRAG(config)
         self.database_instance = database_instance
+        self.extraction_service = extraction_service
+
+        rag_config = self.agentic.rag.config
+        self.answer_cache = None
+        if rag_config.answer_cache_threshold > 0:
+            self.answer_cache = SemanticAnswerCache(
+                threshold=rag_config.answer_cache_threshold,
+                max_entries=rag_config.answer_cache_max_entries,
+                max_chatbots=rag_config.answer_cache_max_chatbots,
+            )
 
     def add_document(
         self,
@@ -31,6 +48,8 @@ class AgentService:
         file_name: str,
         file_type: str,
         file_size: int,
+        content_hash: str = None,
+        on_stage: Callable[[IngestionStatus], None] = None,
     ):
         try:
             user = self.database_instance.read_by(
@@ -40,16 +59,21 @@ class AgentService:
                 logger.error(f"User not found: {username}")
                 return False
 
-            content = textract.process(file_path).decode("utf-8")
+            if on_stage:
+                on_stage(IngestionStatus.EXTRACTING)
+
+            corpus = None
+            if self.agentic.rag.config.near_duplicate_scope == NearDuplicateScope.USER:
+                corpus = self._load_corpus_index(user["id"])
 
-            chunks = self.agentic.rag.add_new_document(
+            chunks = self.agentic.rag.add_new_document_stream(
                 doc_id=doc_id,
-                doc=Document(
-                    text=content,
-                    metadata={
-                        "doc_id": doc_id,
-                    },
-                ),
+                sections=self._iter_sections(file_path),
+                metadata={
+                    "doc_id": doc_id,
+                },
+                on_stage=on_stage,
+                corpus=corpus,
             )
 
             if len(chunks) > 0:
@@ -62,6 +86,8 @@ class AgentService:
                         "file_name": file_name,
                         "file_type": file_type,
                         "file_size": file_size,
+                        "content_hash": content_hash,
+                        "source_document_id": doc_id,
                     },
                 )
 
@@ -70,34 +96,332 @@ class AgentService:
                     return False
 
                 logger.info(f"Document processed: {doc_id}")
-                for i, chunk in enumerate(chunks):
-                    logger.info(f"Inserting chunk {chunk}")
-                    res = self.database_instance.create(
-                        "chunks",
-                        **{
-                            "id": chunk.doc_id,
-                            "document_id": doc_id,
-                            "vector_id": chunk.doc_id,
-                            "chunk_index": i,
-                        },
-                    )
-                    if not res:
-                        logger.error(
-                            f"Failed to insert chunk {chunk.doc_id} for document {doc_id}"
-                        )
+                self._insert_chunks(doc_id, chunks)
                 return True
             else:
                 logger.error(f"Document processing failed: {doc_id}")
                 res = self.delete_document(doc_id)
                 return False
         except Exception as e:
+            # indexed chunks and the checkpoint survive, only rows are removed
             logger.error(f"Error processing document: {e}")
             res = self.delete_document(doc_id)
             return False
         finally:
             os.remove(file_path)
 
+    def _load_corpus_index(self, user_id: str):
+        """
+        Index the MinHash signatures of the chunks stored for the user's
+        documents, keyed by vector id. None when detection is disabled.
+        """
+        corpus = self.agentic.rag.new_duplicate_index()
+        if corpus is None:
+            return None
+
+        sql_query = """
+            select distinct chunks.vector_id, chunks.minhash from chunks join documents
+            on chunks.document_id = documents.id
+            where documents.user_id = ? and chunks.minhash is not null;
+        """
+        rows = self.database_instance.execute_query(
+            sql_query, (user_id,), fetch_all=True, fetch_one=False
+        ) or []
+        for row in rows:
+            try:
+                corpus.add(row["vector_id"], MinHasher.decode(row["minhash"]))
+            except ValueError:
+                # written with another signature length
+                continue
+
+        logger.info(f"Loaded {len(corpus)} chunk signatures of user {user_id}")
+        return corpus
+
+    def _iter_sections(self, file_path: str):
+        """
+        Extract in the process pool when there is one.
+        """
+        if self.extraction_service is not None:
+            sections = self.extraction_service.iter_sections(file_path)
+        else:
+            sections = iter_sections(
+                file_path,
+                section_chars=self.agentic.rag.config.stream_section_chars,
+            )
+        return timed_sections("extract", sections)
+
+    def _insert_chunks(self, doc_id: str, chunks: list):
+        """
+        Insert the chunks rows of a document from (id, content hash, MinHash
+        signature) tuples.
+        """
+        for i, (chunk_id, chunk_hash, minhash) in enumerate(chunks):
+            logger.info(f"Inserting chunk {chunk_id}")
+            res = self.database_instance.create(
+                "chunks",
+                **{
+                    "id": chunk_id,
+                    "document_id": doc_id,
+                    "vector_id": chunk_id,
+                    "chunk_index": i,
+                    "content_hash": chunk_hash,
+                    "minhash": minhash,
+                },
+            )
+            if not res:
+                logger.error(
+                    f"Failed to insert chunk {chunk_id} for document {doc_id}"
+                )
+
+    def update_document(
+        self,
+        file_path: str,
+        doc_id: str,
+        object_name: str,
+        file_name: str,
+        file_type: str,
+        file_size: int,
+        content_hash: str = None,
+        on_stage: Callable[[IngestionStatus], None] = None,
+    ):
+        """
+        Replace the content of a document. Chunks whose text did not change
+        keep their context and vector, only new chunks are processed.
+        """
+        try:
+            document = self.database_instance.read("documents", doc_id)
+            if not document:
+                logger.error(f"Document not found: {doc_id}")
+                return False
+
+            # other documents search the vectors stored under this id
+            if self.count_source_references(doc_id) > 1:
+                logger.error(f"Document {doc_id} shares its content with other documents")
+                return False
+
+            # a duplicate does not own the vectors it uses, it gets its own
+            rows = self.database_instance.read_by(
+                "chunks", "document_id", doc_id, fetch_one=False, fetch_all=True
+            ) or []
+            source_id = document["source_document_id"] or doc_id
+            existing_chunks = []
+            if source_id == doc_id:
+                existing_chunks = [(row["vector_id"], row["content_hash"]) for row in rows]
+
+            if on_stage:
+                on_stage(IngestionStatus.EXTRACTING)
+
+            chunks, written, vanished = self.agentic.rag.update_document_stream(
+                doc_id=doc_id,
+                sections=self._iter_sections(file_path),
+                existing_chunks=existing_chunks,
+                metadata={
+                    "doc_id": doc_id,
+                },
+                on_stage=on_stage,
+            )
+            if not chunks:
+                logger.error(f"Document update produced no chunks: {doc_id}")
+                self.agentic.rag.delete_chunks(written)
+                return False
+
+            try:
+                res = self.database_instance.update(
+                    "documents",
+                    doc_id,
+                    object_name=object_name,
+                    file_name=file_name,
+                    file_type=file_type,
+                    file_size=file_size,
+                    content_hash=content_hash,
+                    source_document_id=doc_id,
+                )
+                if not res:
+                    raise RuntimeError(f"Failed to update document {doc_id}")
+
+                res = self.database_instance.delete_by("chunks", "document_id", doc_id)
+                if not res:
+                    raise RuntimeError(f"Failed to delete chunks for document {doc_id}")
+                self._insert_chunks(doc_id, chunks)
+            except Exception:
+                # the previous version is still served, drop what was written for the new one
+                logger.error(f"Removing {len(written)} new chunks of document {doc_id}")
+                self.agentic.rag.delete_chunks(written)
+                raise
+
+            # only now nothing references the chunks of the previous version
+            self.agentic.rag.delete_chunks(vanished)
+
+            if source_id != doc_id and rows:
+                # the source may be deleted and only kept alive by this duplicate
+                self._release_source(source_id, [row["vector_id"] for row in rows])
+
+            self.invalidate_answers(doc_id)
+            logger.info(f"Document updated: {doc_id}")
+            return True
+        except Exception as e:
+            logger.error(f"Error updating document: {e}")
+            return False
+        finally:
+            os.remove(file_path)
+
+    def has_checkpoint(self, doc_id: str) -> bool:
+        """
+        Whether a failed ingestion of the document can be resumed.
+        """
+        return self.agentic.rag.has_checkpoint(doc_id)
+
+    def discard_progress(self, doc_id: str):
+        """
+        Remove the checkpoint and the indexed chunks of a failed ingestion.
+        """
+        self.agentic.rag.discard_checkpoint(doc_id)
+
+    def find_document_by_hash(self, content_hash: str, username: str):
+        """
+        Return a document of the user with the same content, if any. Files
+        and vectors are only shared between documents of the same user.
+        """
+        if not content_hash:
+            return None
+
+        sql_query = """
+            select documents.* from documents join users
+            on documents.user_id = users.id
+            where documents.content_hash = ? and users.username = ?;
+        """
+        document = self.database_instance.execute_query(
+            sql_query, (content_hash, username), fetch_one=True
+        )
+        if not document:
+            return None
+
+        return document
+
+    def add_duplicate_document(
+        self,
+        source_document: dict,
+        doc_id: str,
+        username: str,
+        file_name: str,
+        file_type: str,
+        file_size: int,
+    ):
+        """
+        Register a document whose content is already ingested. The new
+        document and its chunks rows point at the stored file, vectors and
+        ES entries of `source_document` instead of processing them again.
+        """
+        user = self.database_instance.read_by(
+            table="users", column="username", value=username
+        )
+        if not user:
+            logger.error(f"User not found: {username}")
+            return False
+
+        source_chunks = self.database_instance.read_by(
+            "chunks",
+            "document_id",
+            source_document["id"],
+            fetch_one=False,
+            fetch_all=True,
+        )
+        if not source_chunks:
+            logger.error(f"No chunks found for document {source_document['id']}")
+            return False
+
+        res = self.database_instance.create(
+            "documents",
+            **{
+                "id": doc_id,
+                "user_id": user["id"],
+                "object_name": source_document["object_name"],
+                "file_name": file_name,
+                "file_type": file_type,
+                "file_size": file_size,
+                "content_hash": source_document["content_hash"],
+                "source_document_id": source_document["source_document_id"]
+                or source_document["id"],
+            },
+        )
+        if not res:
+            logger.error(f"Failed to insert document {doc_id}")
+            return False
+
+        for chunk in source_chunks:
+            res = self.database_instance.create(
+                "chunks",
+                **{
+                    "id": str(uuid.uuid4()),
+                    "document_id": doc_id,
+                    "vector_id": chunk["vector_id"],
+                    "chunk_index": chunk["chunk_index"],
+                    "content_hash": chunk["content_hash"],
+                    "minhash": chunk["minhash"],
+                },
+            )
+            if not res:
+                logger.error(f"Failed to insert chunks for document {doc_id}")
+                self.delete_document(doc_id)
+                return False
+
+        logger.info(
+            f"Document {doc_id} reuses {len(source_chunks)} chunks of document {source_document['id']}"
+        )
+        return True
+
+    def get_document(self, doc_id: str, username: str):
+        sql_query = """
+            select documents.* from documents join users
+            on documents.user_id = users.id
+            where documents.id = ? and users.username = ?;
+        """
+        document = self.database_instance.execute_query(
+            sql_query, (doc_id, username), fetch_one=True
+        )
+        if not document:
+            logger.error(f"Document not found: {doc_id}")
+            return None
+
+        return document
+
+    def count_source_references(self, source_id: str) -> int:
+        """
+        Count documents using the vectors and ES entries of a source document.
+        """
+        sql_query = """
+            select count(*) as count from documents
+            where coalesce(source_document_id, id) = ?;
+        """
+        res = self.database_instance.execute_query(sql_query, (source_id,), fetch_one=True)
+        if not res:
+            return 0
+        return res["count"]
+
+    def count_object_references(self, object_name: str) -> int:
+        """
+        Count documents using a stored file.
+        """
+        res = self.database_instance.count_by("documents", "object_name", object_name)
+        if not res:
+            return 0
+        return res["COUNT(*)"]
+
     def delete_document(self, doc_id: str):
+        """
+        Delete a document and its chunks rows. Vectors and ES entries are
+        only removed once no other document references them.
+        """
+        document = self.database_instance.read("documents", doc_id)
+        chunks = self.database_instance.read_by(
+            "chunks", "document_id", doc_id, fetch_one=False, fetch_all=True
+        )
+
+        self.invalidate_answers(doc_id)
+        res = self.database_instance.delete_by("knowledge_documents", "document_id", doc_id)
+        if not res:
+            logger.error(f"Failed to delete knowledge documents for document {doc_id}")
+            return False
         res = self.database_instance.delete_by("documents", "id", doc_id)
         if not res:
             logger.error(f"Failed to delete document {doc_id}")
@@ -106,13 +430,33 @@ class AgentService:
         if not res:
             logger.error(f"Failed to delete chunks for document {doc_id}")
             return False
+
+        if document and chunks:
+            self._release_source(
+                document["source_document_id"] or document["id"],
+                [chunk["vector_id"] for chunk in chunks],
+            )
+
         return True
 
+    def _release_source(self, source_id: str, vector_ids: list):
+        """
+        Delete the vectors and ES entries of a source document once no
+        document references it any more.
+        """
+        references = self.count_source_references(source_id)
+        if references == 0:
+            self.agentic.rag.delete_chunks(vector_ids)
+        else:
+            logger.info(f"Keeping chunks of document {source_id}, still referenced {references} times")
+
     def get_documents(self, chatbot_id: str):
+        # vectors are stored under the id of the document they were ingested for
         sql_query = """
-            select documents.id from chatbot_knowledges join knowledges 
-            on chatbot_knowledges.knowledge_id = knowledges.id join documents
-            join knowledge_documents on documents.id = knowledge_documents.document_id
+            select distinct coalesce(documents.source_document_id, documents.id) as id
+            from chatbot_knowledges join knowledge_documents
+            on chatbot_knowledges.knowledge_id = knowledge_documents.knowledge_id join documents
+            on documents.id = knowledge_documents.document_id
             where chatbot_knowledges.chatbot_id = ?;
         """
         documents = self.database_instance.execute_query(
@@ -126,6 +470,56 @@ class AgentService:
 
         return doc_ids
 
+    def document_fingerprint(self, chatbot_id: str) -> str:
+        """
+        Return a hash of the documents a chatbot answers from, which changes
+        when its knowledges or their documents change.
+        """
+        sql_query = """
+            select distinct documents.id, documents.content_hash, documents.source_document_id
+            from chatbot_knowledges join knowledge_documents
+            on chatbot_knowledges.knowledge_id = knowledge_documents.knowledge_id join documents
+            on documents.id = knowledge_documents.document_id
+            where chatbot_knowledges.chatbot_id = ?
+            order by documents.id;
+        """
+        documents = self.database_instance.execute_query(
+            sql_query, (chatbot_id,), fetch_all=True, fetch_one=False
+        ) or []
+        return hash_text("\n".join(
+            f"{doc['id']}:{doc['content_hash']}:{doc['source_document_id']}" for doc in documents
+        ))
+
+    def stats(self) -> dict:
+        """
+        Return the counters of the caches, schedulers and batchers in use.
+        """
+        stats = self.agentic.rag.stats()
+        if self.answer_cache is not None:
+            stats["answer_cache"] = self.answer_cache.stats()
+        return stats
+
+    def invalidate_answers(self, doc_id: str):
+        """
+        Drop the cached answers of the chatbots whose knowledges contain a document.
+        """
+        if self.answer_cache is None:
+            return
+
+        sql_query = """
+            select distinct chatbot_knowledges.chatbot_id from knowledge_documents
+            join chatbot_knowledges on chatbot_knowledges.knowledge_id = knowledge_documents.knowledge_id
+            where knowledge_documents.document_id = ?;
+        """
+        chatbots = self.database_instance.execute_query(
+            sql_query, (doc_id,), fetch_all=True, fetch_one=False
+        ) or []
+        for chatbot in chatbots:
+            self.answer_cache.invalidate(chatbot["chatbot_id"])
+
+    def shutdown(self):
+        self.agentic.rag.shutdown()
+
     def create_conversation(self, chatbot_id: str, conversation_id: str, username: str):
         user = self.database_instance.read_by(
             table="users", column="username", value=username
@@ -241,11 +635,7 @@ class AgentService:
 
         return conversations
 
-    def chat(self, query: str, conversation_id: str):
-
-        response = self.agentic.chat(query=query, conversation_id=conversation_id)
-
-        text = response.response
+    def chat(self, query: str, conversation_id: str, username: str = None):
 
         current_count_message = self.database_instance.count_by(
             "messages", "conversation_id", conversation_id
@@ -258,6 +648,32 @@ class AgentService:
 
         current_count_message = current_count_message["COUNT(*)"]
 
+        # later answers depend on the conversation history, only the first
+        # question after the initial message is answered from the cache
+        chatbot_id = fingerprint = embedding = None
+        if self.answer_cache is not None and current_count_message <= 1:
+            conversation = self.database_instance.read("conversations", conversation_id)
+            if conversation:
+                chatbot_id = conversation["chatbot_id"]
+                fingerprint = self.document_fingerprint(chatbot_id)
+                embedding = self.agentic.rag.embed_query(query)
+
+        cached = None
+        if embedding is not None:
+            cached = self.answer_cache.lookup(chatbot_id, fingerprint, embedding)
+
+        if cached:
+            logger.info(f"Answered from cache (similarity {cached['similarity']:.3f}): {cached['query']}")
+            text = cached["answer"]
+            self.agentic.remember(query=query, answer=text, conversation_id=conversation_id)
+        else:
+            with llm_scope(LLMPriority.CHAT, tenant=username):
+                response = self.agentic.chat(query=query, conversation_id=conversation_id)
+
+            text = response.response
+            if embedding is not None:
+                self.answer_cache.store(chatbot_id, fingerprint, embedding, query, text)
+
         query_record = {
             "id": str(uuid.uuid4()),
             "conversation_id": conversation_id,
@@ -0,0 +1,196 @@
+import os
+import queue
+import tempfile
+import threading
+import time
+import multiprocessing
+
+from typing import Iterator
+
+from utils.logger import get_logger
+from utils.metrics import get_metrics
+from utils.text_extractor import write_sections, read_sections
+
+logger = get_logger()
+metrics = get_metrics()
+
+
+class ExtractionError(Exception):
+    pass
+
+
+class ExtractionTimeout(ExtractionError):
+    pass
+
+
+def _worker_main(conn, section_chars: int):
+    """
+    Extraction worker loop: receive (file_path, output_path), write the
+    sections to output_path and reply with ("ok", count) or ("error", message).
+    None stops the worker.
+    """
+    while True:
+        try:
+            job = conn.recv()
+        except EOFError:
+            break
+        if job is None:
+            break
+        file_path, output_path = job
+        try:
+            conn.send(("ok", write_sections(file_path, output_path, section_chars)))
+        except Exception as e:
+            conn.send(("error", f"{type(e).__name__}: {e}"))
+    conn.close()
+
+
+class _Worker:
+    def __init__(self, context, section_chars: int):
+        self.conn, child_conn = context.Pipe()
+        self.process = context.Process(
+            target=_worker_main,
+            args=(child_conn, section_chars),
+            daemon=True,
+        )
+        self.process.start()
+        child_conn.close()
+        self.jobs = 0
+
+    def stop(self):
+        try:
+            self.conn.send(None)
+        except (BrokenPipeError, OSError):
+            pass
+        self.process.join(timeout=5)
+        self.kill()
+
+    def kill(self):
+        if self.process.is_alive():
+            self.process.kill()
+            self.process.join()
+        self.conn.close()
+
+
+class ExtractionService:
+    def __init__(
+        self,
+        processes: int = 0,
+        timeout: float = 300,
+        max_jobs_per_worker: int = 50,
+        section_chars: int = 20000,
+        temp_dir: str = None,
+    ):
+        """
+        Extract text in a pool of worker processes so parsing does not hold
+        the GIL of the API process.
+
+        Every file gets its own deadline: a worker that exceeds it is killed
+        and replaced. Workers are also replaced after `max_jobs_per_worker`
+        files to release memory leaked by the parsers. Sections are handed
+        back through a temporary file instead of being pickled.
+
+        Args:
+            processes (int): The number of workers, 0 uses the number of CPUs minus one.
+            timeout (float): The extraction time limit of a file in seconds.
+            max_jobs_per_worker (int): The number of files a worker extracts before it is replaced.
+            section_chars (int): The approximate size of the sections.
+            temp_dir (str, optional): Where the extracted sections are written.
+        """
+        self.processes = processes or max(1, (os.cpu_count() or 2) - 1)
+        self.timeout = timeout
+        self.max_jobs_per_worker = max_jobs_per_worker
+        self.section_chars = section_chars
+        self.temp_dir = temp_dir
+
+        # spawned workers re-import the main module as __mp_main__, which
+        # must not load bootstrap (see main.include_routers)
+        self._context = multiprocessing.get_context("spawn")
+        self._idle = queue.LifoQueue()
+        self._closed = False
+        self._slots = threading.BoundedSemaphore(self.processes)
+
+        logger.info(f"Extraction pool with {self.processes} workers")
+
+    def _acquire(self) -> _Worker:
+        self._slots.acquire()
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            return _Worker(self._context, self.section_chars)
+
+    def _release(self, worker: _Worker, healthy: bool):
+        try:
+            if not healthy:
+                worker.kill()
+            elif self._closed or worker.jobs >= self.max_jobs_per_worker:
+                logger.info(f"Recycling extraction worker {worker.process.pid} after {worker.jobs} jobs")
+                worker.stop()
+            else:
+                self._idle.put(worker)
+        finally:
+            self._slots.release()
+
+    def extract_to_file(self, file_path: str) -> str:
+        """
+        Extract the sections of a file into a temporary file and return its
+        path, the caller removes it.
+        """
+        if self._closed:
+            raise ExtractionError("Extraction service is shut down")
+
+        fd, output_path = tempfile.mkstemp(suffix=".jsonl", dir=self.temp_dir)
+        os.close(fd)
+
+        start = time.time()
+        worker = self._acquire()
+        healthy = False
+        try:
+            worker.conn.send((os.path.abspath(file_path), output_path))
+            worker.jobs += 1
+            if not worker.conn.poll(self.timeout):
+                metrics.inc("extraction_timeouts_total")
+                raise ExtractionTimeout(
+                    f"Extraction of {file_path} took longer than {self.timeout}s"
+                )
+            try:
+                status, result = worker.conn.recv()
+            except EOFError:
+                raise ExtractionError(
+                    f"Extraction worker exited with code {worker.process.exitcode} on {file_path}"
+                )
+            healthy = True
+            if status != "ok":
+                raise ExtractionError(f"Extraction of {file_path} failed: {result}")
+        except Exception:
+            os.remove(output_path)
+            metrics.inc("extraction_failures_total")
+            raise
+        finally:
+            self._release(worker, healthy)
+
+        elapsed = time.time() - start
+        metrics.observe("extraction_seconds", elapsed)
+        logger.info(f"Extracted {result} sections from {file_path} in {elapsed:.2f}s")
+        return output_path
+
+    def iter_sections(self, file_path: str) -> Iterator[str]:
+        """
+        Yield the sections of a file, extracted in a worker process.
+        """
+        output_path = self.extract_to_file(file_path)
+        try:
+            yield from read_sections(output_path)
+        finally:
+            os.remove(output_path)
+
+    def shutdown(self):
+        """
+        Stop the idle workers, busy ones stop when their file is done.
+        """
+        self._closed = True
+        while True:
+            try:
+                worker = self._idle.get_nowait()
+            except queue.Empty:
+                break
+            worker.stop()
@@ -0,0 +1,635 @@
+import os
+import json
+import threading
+import uuid
+
+from concurrent.futures import ThreadPoolExecutor
+
+from const import IngestionStatus, LLMPriority
+from utils.archive import is_archive, iter_archive
+from utils.checker import check_file_name
+from utils.hashing import copy_with_hash
+from utils.ingestion_report import IngestionReport, get_report, report_scope
+from utils.llm_scheduler import llm_scope
+from utils.logger import get_logger
+
+logger = get_logger()
+
+
+class IngestionService:
+    def __init__(
+        self,
+        database_instance,
+        agent_service,
+        cloud_service,
+        max_workers: int = 2,
+        max_pending: int = 32,
+        max_entry_bytes: int = 100 * 1024 * 1024,
+    ):
+        """
+        Run document ingestion in a bounded pool of background workers.
+
+        Args:
+            database_instance: The database repository, jobs are stored in `ingestion_jobs`.
+            agent_service (AgentService): The service that processes documents.
+            cloud_service (CloudService): The service that stores the raw files.
+            max_workers (int): The number of documents processed at the same time.
+            max_pending (int): The number of queued and running jobs accepted before rejecting uploads.
+            max_entry_bytes (int): The largest file accepted from a bulk upload.
+        """
+        self.database_instance = database_instance
+        self.agent_service = agent_service
+        self.cloud_service = cloud_service
+        self.executor = ThreadPoolExecutor(
+            max_workers=max_workers,
+            thread_name_prefix="ingestion",
+        )
+        self.slots = threading.BoundedSemaphore(max_pending)
+        # bulk uploads are unpacked one at a time and wait for free slots
+        self.batch_executor = ThreadPoolExecutor(
+            max_workers=1,
+            thread_name_prefix="ingestion-batch",
+        )
+        self.max_entry_bytes = max_entry_bytes
+        self._closed = False
+
+        self._fail_interrupted_jobs()
+
+    def _fail_interrupted_jobs(self):
+        """
+        Mark jobs left unfinished by a previous process as failed.
+        """
+        sql_query = """
+            update ingestion_jobs set status = ?, error = ?, updated_at = datetime('now')
+            where status not in (?, ?);
+        """
+        res = self.database_instance.execute_query(
+            sql_query,
+            (
+                IngestionStatus.FAILED.value,
+                "Interrupted by a restart",
+                IngestionStatus.DONE.value,
+                IngestionStatus.FAILED.value,
+            ),
+        )
+        if res is None:
+            logger.error("Failed to clean up interrupted ingestion jobs")
+
+        res = self.database_instance.execute_query(
+            """
+            update ingestion_batches set status = 'failed', error = ?, updated_at = datetime('now')
+            where status = 'scanning';
+            """,
+            ("Interrupted by a restart",),
+        )
+        if res is None:
+            logger.error("Failed to clean up interrupted ingestion batches")
+
+    def submit(
+        self,
+        file_path: str,
+        doc_id: str,
+        username: str,
+        object_name: str,
+        file_name: str,
+        file_type: str,
+        file_size: int,
+        content_hash: str = None,
+        batch_id: str = None,
+        block: bool = False,
+        update: bool = False,
+    ):
+        """
+        Queue a document for ingestion, return the job id, or None when the
+        queue is full or the job could not be created. With `block`, wait for
+        a free slot instead of giving up. With `update`, the file replaces the
+        content of the existing document `doc_id`.
+        """
+        user = self.database_instance.read_by(
+            table="users", column="username", value=username
+        )
+        if not user:
+            logger.error(f"User not found: {username}")
+            return None
+
+        if not self._acquire_slot(block):
+            logger.error("Ingestion queue is full")
+            return None
+
+        job_id = str(uuid.uuid4())
+        res = self.database_instance.create(
+            "ingestion_jobs",
+            **{
+                "id": job_id,
+                "user_id": user["id"],
+                "batch_id": batch_id,
+                "document_id": doc_id,
+                "file_name": file_name,
+                "object_name": object_name,
+                "file_type": file_type,
+                "file_size": file_size,
+                "content_hash": content_hash,
+                "status": IngestionStatus.QUEUED.value,
+            },
+        )
+        if not res:
+            logger.error(f"Failed to create ingestion job for document {doc_id}")
+            self.slots.release()
+            return None
+
+        self.executor.submit(
+            self._run,
+            job_id=job_id,
+            file_path=file_path,
+            doc_id=doc_id,
+            username=username,
+            object_name=object_name,
+            file_name=file_name,
+            file_type=file_type,
+            file_size=file_size,
+            content_hash=content_hash,
+            update=update,
+        )
+        logger.info(f"Ingestion job queued: {job_id}")
+
+        return job_id
+
+    def _acquire_slot(self, block: bool) -> bool:
+        if not block:
+            return self.slots.acquire(blocking=False)
+        # wake up regularly so a shutdown does not leave the thread waiting
+        while not self._closed:
+            if self.slots.acquire(timeout=1):
+                return True
+        return False
+
+    def submit_batch(
+        self,
+        uploads: list,
+        username: str,
+    ):
+        """
+        Queue a bulk upload, return the batch id or None. `uploads` holds
+        (file path, file name) pairs of plain documents and zip/tar archives,
+        which are removed once they are processed.
+        """
+        user = self.database_instance.read_by(
+            table="users", column="username", value=username
+        )
+        if not user:
+            logger.error(f"User not found: {username}")
+            return None
+
+        batch_id = str(uuid.uuid4())
+        res = self.database_instance.create(
+            "ingestion_batches",
+            **{
+                "id": batch_id,
+                "user_id": user["id"],
+                "status": "scanning",
+            },
+        )
+        if not res:
+            logger.error("Failed to create ingestion batch")
+            return None
+
+        self.batch_executor.submit(
+            self._run_batch,
+            batch_id=batch_id,
+            user_id=user["id"],
+            username=username,
+            uploads=uploads,
+        )
+        logger.info(f"Ingestion batch queued: {batch_id}")
+
+        return batch_id
+
+    def _run_batch(
+        self,
+        batch_id: str,
+        user_id: str,
+        username: str,
+        uploads: list,
+    ):
+        """
+        Unpack the uploads entry by entry and queue one job per document,
+        waiting for free slots so at most `max_pending` files sit in /tmp.
+        """
+        total = 0
+        try:
+            for file_path, file_name in uploads:
+                if self._closed:
+                    break
+                try:
+                    if not is_archive(file_name):
+                        with open(file_path, "rb") as f:
+                            self._submit_entry(
+                                batch_id, user_id, username, file_name, os.path.getsize(file_path), f,
+                            )
+                        total += 1
+                        continue
+
+                    for entry_name, entry_size, f in iter_archive(file_path):
+                        if self._closed:
+                            break
+                        try:
+                            self._submit_entry(batch_id, user_id, username, entry_name, entry_size, f)
+                        except Exception as e:
+                            # only this entry is lost, the archive is read on
+                            logger.error(f"Error reading {entry_name} of {file_name} in batch {batch_id}: {e}")
+                            self._reject_entry(batch_id, user_id, entry_name, f"Unreadable file: {e}")
+                        total += 1
+                        if total % 100 == 0:
+                            self.database_instance.update("ingestion_batches", batch_id, total=total)
+                except Exception as e:
+                    logger.error(f"Error reading {file_name} of batch {batch_id}: {e}")
+                    self._reject_entry(batch_id, user_id, file_name, f"Unreadable file: {e}")
+                    total += 1
+                finally:
+                    os.remove(file_path)
+
+            self.database_instance.update(
+                "ingestion_batches", batch_id, total=total, status="scanned",
+            )
+            logger.info(f"Ingestion batch {batch_id} scanned, {total} files")
+        except Exception as e:
+            logger.error(f"Error running ingestion batch {batch_id}: {e}")
+            self.database_instance.update(
+                "ingestion_batches", batch_id, total=total, status="failed", error=str(e),
+            )
+
+    def _submit_entry(
+        self,
+        batch_id: str,
+        user_id: str,
+        username: str,
+        file_name: str,
+        file_size: int,
+        fsrc,
+    ):
+        """
+        Copy one document of a batch to /tmp and queue it.
+        """
+        base_name = os.path.basename(file_name)
+        if not check_file_name(base_name):
+            self._reject_entry(batch_id, user_id, file_name, "Invalid file format")
+            return
+        if file_size > self.max_entry_bytes:
+            self._reject_entry(batch_id, user_id, file_name, "File too large")
+            return
+
+        doc_id = str(uuid.uuid4())
+        file_type = base_name.split(".")[-1]
+        temp_file_path = f"/tmp/{doc_id}.{file_type}"
+        try:
+            with open(temp_file_path, "wb") as temp_file:
+                content_hash = copy_with_hash(fsrc, temp_file)
+        except Exception:
+            os.remove(temp_file_path)
+            raise
+
+        job_id = self.submit(
+            file_path=temp_file_path,
+            doc_id=doc_id,
+            username=username,
+            object_name=f"documents/{doc_id}.{file_type}",
+            file_name=base_name,
+            file_type=file_type,
+            file_size=os.path.getsize(temp_file_path),
+            content_hash=content_hash,
+            batch_id=batch_id,
+            block=True,
+        )
+        if not job_id:
+            os.remove(temp_file_path)
+            self._reject_entry(batch_id, user_id, file_name, "Could not be queued")
+
+    def _reject_entry(self, batch_id: str, user_id: str, file_name: str, error: str):
+        """
+        Record a batch entry that is not ingested as a failed job.
+        """
+        logger.error(f"Rejected {file_name} of batch {batch_id}: {error}")
+        res = self.database_instance.create(
+            "ingestion_jobs",
+            **{
+                "id": str(uuid.uuid4()),
+                "user_id": user_id,
+                "batch_id": batch_id,
+                "document_id": str(uuid.uuid4()),
+                "file_name": os.path.basename(file_name),
+                "status": IngestionStatus.FAILED.value,
+                "error": error,
+            },
+        )
+        if not res:
+            logger.error(f"Failed to record rejected file {file_name} of batch {batch_id}")
+
+    def get_batch(self, batch_id: str, username: str):
+        """
+        Return the batch with its progress per status and the status of every
+        file, if it belongs to the user.
+        """
+        sql_query = """
+            select ingestion_batches.* from ingestion_batches join users
+            on ingestion_batches.user_id = users.id
+            where ingestion_batches.id = ? and users.username = ?;
+        """
+        batch = self.database_instance.execute_query(
+            sql_query, (batch_id, username), fetch_one=True
+        )
+        if not batch:
+            logger.error(f"Ingestion batch not found: {batch_id}")
+            return None
+
+        jobs = self.database_instance.execute_query(
+            """
+            select id, document_id, file_name, status, error, updated_at
+            from ingestion_jobs where batch_id = ? order by created_at;
+            """,
+            (batch_id,),
+            fetch_all=True,
+        ) or []
+
+        progress = {str(status): 0 for status in IngestionStatus}
+        for job in jobs:
+            progress[job["status"]] += 1
+        finished = progress[str(IngestionStatus.DONE)] + progress[str(IngestionStatus.FAILED)]
+
+        return {
+            **batch,
+            "total": max(batch["total"], len(jobs)),
+            "finished": finished,
+            "progress": progress,
+            "jobs": jobs,
+        }
+
+    def _set_status(self, job_id: str, status: IngestionStatus, error: str = None):
+        logger.info(f"Ingestion job {job_id}: {status}")
+        fields = {"status": status.value, "error": error}
+        report = get_report()
+        if report is not None and status in (IngestionStatus.DONE, IngestionStatus.FAILED):
+            # written with the terminal status, a finished job always has its report
+            fields["report"] = json.dumps(report.to_dict())
+        res = self.database_instance.update(
+            "ingestion_jobs",
+            job_id,
+            **fields,
+        )
+        if not res:
+            logger.error(f"Failed to update ingestion job {job_id}")
+
+    def _run(
+        self,
+        job_id: str,
+        file_path: str,
+        doc_id: str,
+        username: str,
+        object_name: str,
+        file_name: str,
+        file_type: str,
+        file_size: int,
+        content_hash: str = None,
+        resume: bool = False,
+        update: bool = False,
+    ):
+        report = IngestionReport()
+        try:
+            with report_scope(report), llm_scope(LLMPriority.INGESTION, tenant=username):
+                try:
+                    if update:
+                        self._run_update(
+                            job_id=job_id,
+                            file_path=file_path,
+                            doc_id=doc_id,
+                            object_name=object_name,
+                            file_name=file_name,
+                            file_type=file_type,
+                            file_size=file_size,
+                            content_hash=content_hash,
+                        )
+                        return
+
+                    source_document = None if resume else self.agent_service.find_document_by_hash(
+                        content_hash, username
+                    )
+                    if source_document:
+                        logger.info(f"Document {file_name} is already ingested as {source_document['id']}")
+                        os.remove(file_path)
+                        if self.agent_service.add_duplicate_document(
+                            source_document=source_document,
+                            doc_id=doc_id,
+                            username=username,
+                            file_name=file_name,
+                            file_type=file_type,
+                            file_size=file_size,
+                        ):
+                            self._set_status(job_id, IngestionStatus.DONE)
+                        else:
+                            self._set_status(job_id, IngestionStatus.FAILED, "Processing failed")
+                        return
+
+                    self._set_status(job_id, IngestionStatus.EXTRACTING)
+
+                    if not resume and not self.cloud_service.cloud_repository.upload(
+                        object_name=object_name,
+                        file_path=file_path,
+                        bucket_name=self.cloud_service.bucket_name,
+                    ):
+                        logger.error(f"Document upload failed: {file_name}")
+                        os.remove(file_path)
+                        self._set_status(job_id, IngestionStatus.FAILED, "Upload failed")
+                        return
+
+                    if self.agent_service.add_document(
+                        file_path=file_path,
+                        doc_id=doc_id,
+                        username=username,
+                        object_name=object_name,
+                        file_name=file_name,
+                        file_type=file_type,
+                        file_size=file_size,
+                        content_hash=content_hash,
+                        on_stage=lambda status: self._set_status(job_id, status),
+                    ):
+                        self._set_status(job_id, IngestionStatus.DONE)
+                    elif self.agent_service.has_checkpoint(doc_id):
+                        # keep the stored file so the job can be resumed
+                        logger.error(f"Document processing failed, progress kept: {file_name}")
+                        self._set_status(job_id, IngestionStatus.FAILED, "Processing failed, retry to resume")
+                    else:
+                        logger.error(f"Document processing failed: {file_name}")
+                        self.cloud_service.cloud_repository.delete(
+                            object_name=object_name,
+                            bucket_name=self.cloud_service.bucket_name,
+                        )
+                        self._set_status(job_id, IngestionStatus.FAILED, "Processing failed")
+                except Exception as e:
+                    logger.error(f"Error running ingestion job {job_id}: {e}")
+                    self._set_status(job_id, IngestionStatus.FAILED, str(e))
+        finally:
+            self.slots.release()
+
+    def get_report(self, job_id: str, username: str):
+        """
+        Return the per-stage report of a job if it belongs to the user, None
+        if there is no such job or it has no report yet.
+        """
+        job = self.get_job(job_id, username)
+        if not job or not job.get("report"):
+            return None
+
+        return {
+            "job_id": job_id,
+            "status": job["status"],
+            "file_name": job["file_name"],
+            **job["report"],
+        }
+
+    def _run_update(
+        self,
+        job_id: str,
+        file_path: str,
+        doc_id: str,
+        object_name: str,
+        file_name: str,
+        file_type: str,
+        file_size: int,
+        content_hash: str = None,
+    ):
+        """
+        Store the new version next to the old one, update the document and
+        drop the old file once nothing references it.
+        """
+        document = self.database_instance.read("documents", doc_id)
+        if not document:
+            os.remove(file_path)
+            self._set_status(job_id, IngestionStatus.FAILED, "Document not found")
+            return
+
+        self._set_status(job_id, IngestionStatus.EXTRACTING)
+
+        if not self.cloud_service.cloud_repository.upload(
+            object_name=object_name,
+            file_path=file_path,
+            bucket_name=self.cloud_service.bucket_name,
+        ):
+            logger.error(f"Document upload failed: {file_name}")
+            os.remove(file_path)
+            self._set_status(job_id, IngestionStatus.FAILED, "Upload failed")
+            return
+
+        if self.agent_service.update_document(
+            file_path=file_path,
+            doc_id=doc_id,
+            object_name=object_name,
+            file_name=file_name,
+            file_type=file_type,
+            file_size=file_size,
+            content_hash=content_hash,
+            on_stage=lambda status: self._set_status(job_id, status),
+        ):
+            if self.agent_service.count_object_references(document["object_name"]) == 0:
+                self.cloud_service.cloud_repository.delete(
+                    object_name=document["object_name"],
+                    bucket_name=self.cloud_service.bucket_name,
+                )
+            self._set_status(job_id, IngestionStatus.DONE)
+        else:
+            logger.error(f"Document update failed: {file_name}")
+            self.cloud_service.cloud_repository.delete(
+                object_name=object_name,
+                bucket_name=self.cloud_service.bucket_name,
+            )
+            self._set_status(job_id, IngestionStatus.FAILED, "Update failed")
+
+    def get_job(self, job_id: str, username: str):
+        """
+        Return the job if it belongs to the user.
+        """
+        sql_query = """
+            select ingestion_jobs.* from ingestion_jobs join users
+            on ingestion_jobs.user_id = users.id
+            where ingestion_jobs.id = ? and users.username = ?;
+        """
+        job = self.database_instance.execute_query(
+            sql_query, (job_id, username), fetch_one=True
+        )
+        if not job:
+            logger.error(f"Ingestion job not found: {job_id}")
+            return None
+
+        job = dict(job)
+        if job.get("report"):
+            job["report"] = json.loads(job["report"])
+        return job
+
+    def retry(self, job_id: str, username: str):
+        """
+        Resume a failed job from its checkpoint. Return the job id, or None
+        when the job cannot be resumed or the queue is full.
+        """
+        job = self.get_job(job_id, username)
+        if not job or job["status"] != IngestionStatus.FAILED.value:
+            logger.error(f"Ingestion job {job_id} is not a failed job")
+            return None
+
+        if not job["object_name"] or not self.agent_service.has_checkpoint(job["document_id"]):
+            logger.error(f"Ingestion job {job_id} has no progress to resume")
+            return None
+
+        if not self.slots.acquire(blocking=False):
+            logger.error("Ingestion queue is full")
+            return None
+
+        file_path = f"/tmp/{job['document_id']}.{job['file_type']}"
+        if not self.cloud_service.cloud_repository.download(
+            object_name=job["object_name"],
+            bucket_name=self.cloud_service.bucket_name,
+            file_path=file_path,
+        ):
+            logger.error(f"Failed to download {job['object_name']} for job {job_id}")
+            self.slots.release()
+            return None
+
+        self._set_status(job_id, IngestionStatus.QUEUED)
+        self.executor.submit(
+            self._run,
+            job_id=job_id,
+            file_path=file_path,
+            doc_id=job["document_id"],
+            username=username,
+            object_name=job["object_name"],
+            file_name=job["file_name"],
+            file_type=job["file_type"],
+            file_size=job["file_size"],
+            content_hash=job["content_hash"],
+            resume=True,
+        )
+        logger.info(f"Ingestion job resumed: {job_id}")
+
+        return job_id
+
+    def discard(self, job_id: str, username: str):
+        """
+        Drop the progress and the stored file of a failed job.
+        """
+        job = self.get_job(job_id, username)
+        if not job or job["status"] != IngestionStatus.FAILED.value:
+            logger.error(f"Ingestion job {job_id} is not a failed job")
+            return False
+
+        if self.agent_service.has_checkpoint(job["document_id"]):
+            self.agent_service.discard_progress(job["document_id"])
+            if job["object_name"] and self.agent_service.count_object_references(job["object_name"]) == 0:
+                self.cloud_service.cloud_repository.delete(
+                    object_name=job["object_name"],
+                    bucket_name=self.cloud_service.bucket_name,
+                )
+        self._set_status(job_id, IngestionStatus.FAILED, "Discarded")
+
+        return True
+
+    def shutdown(self):
+        self._closed = True
+        self.batch_executor.shutdown(wait=False)
+        self.executor.shutdown(wait=False)
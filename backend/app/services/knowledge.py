@@ -7,8 +7,11 @@ class KnowledgeService:
     def __init__(
         self,
         database_instance,
+        answer_cache=None,
     ):
         self.database_instance = database_instance
+        # cached chatbot answers, dropped when the knowledges of a chatbot change
+        self.answer_cache = answer_cache
         
         
     def create_knowledge(
@@ -81,6 +84,16 @@ class KnowledgeService:
         knowledge_id: str,
     ):
         logger.info(f"Deleting knowledge: {knowledge_id}")
+        if self.answer_cache is not None:
+            chatbots = self.database_instance.read_by(
+                "chatbot_knowledges",
+                "knowledge_id",
+                knowledge_id,
+                fetch_one=False,
+                fetch_all=True,
+            ) or []
+            for chatbot in chatbots:
+                self.answer_cache.invalidate(chatbot["chatbot_id"])
         res = self.database_instance.delete_by(
             "knowledge_documents",
             "knowledge_id",
@@ -170,6 +183,8 @@ class KnowledgeService:
         self,
         chatbot_id: str,
     ):
+        if self.answer_cache is not None:
+            self.answer_cache.invalidate(chatbot_id)
         res = self.database_instance.delete_by(
             "chatbot_knowledges",
             "chatbot_id",
@@ -167,5 +167,20 @@ class AgenticRAG:
         logger.info(f"Agent history: {self.agents[conversation_id]['agent'].memory.to_dict()}")
         
         return response
-
-        
\ No newline at end of file
+    
+    def remember(
+        self,
+        query: str,
+        answer: str,
+        conversation_id: str = "default",
+        ):
+        """
+        add an exchange answered without the agent to its memory
+        """
+        agent = self.agents.get(conversation_id)
+        if agent is None:
+            return False
+        
+        agent["agent"].memory.put(ChatMessage(role=MessageRole.USER, content=query))
+        agent["agent"].memory.put(ChatMessage(role=MessageRole.ASSISTANT, content=answer))
+        return True
@@ -0,0 +1,254 @@
+import time
+
+from typing import List, Dict, Any
+from pymilvus import MilvusClient
+from elasticsearch import Elasticsearch
+from elasticsearch.helpers import streaming_bulk
+
+from llama_index.core import Document
+
+from utils.docstore import MmapDocstore
+from utils.ingestion_report import record_stage
+from utils.logger import get_logger
+
+logger = get_logger()
+
+
+class BulkWriteError(Exception):
+    """
+    Raised when a document could not be written to both stores.
+    """
+    ...
+
+
+class BulkWriter:
+    def __init__(
+        self,
+        vectordb: MilvusClient,
+        es: Elasticsearch,
+        es_index: str,
+        collection_name: str = "collection",
+        milvus_batch_size: int = 1000,
+        es_chunk_size: int = 500,
+        max_retries: int = 3,
+        retry_backoff: float = 1.0,
+        docstore: MmapDocstore = None,
+    ):
+        """
+        Write the chunks of a document to Milvus and Elasticsearch in bulk.
+
+        Args:
+            vectordb (MilvusClient): The Milvus client.
+            es (Elasticsearch): The Elasticsearch client.
+            es_index (str): The Elasticsearch chunk index.
+            collection_name (str): The Milvus collection.
+            milvus_batch_size (int): The number of rows per Milvus insert.
+            es_chunk_size (int): The number of actions per ES bulk request.
+            max_retries (int): The number of retries for rejected items.
+            retry_backoff (float): The initial backoff between retries, in seconds.
+            docstore (MmapDocstore, optional): The local copy of the chunk texts, kept in sync.
+        """
+        self.vectordb = vectordb
+        self.es = es
+        self.es_index = es_index
+        self.collection_name = collection_name
+        self.milvus_batch_size = max(1, milvus_batch_size)
+        self.es_chunk_size = max(1, es_chunk_size)
+        self.max_retries = max_retries
+        self.retry_backoff = retry_backoff
+        self.docstore = docstore
+
+    def write(
+        self,
+        doc_id: str,
+        chunks: List[Document],
+        embeddings: List[List[float]],
+        refresh: bool = True,
+    ) -> int:
+        """
+        Write chunks and their embeddings, return the number of inserted rows.
+        Callers writing a document in several parts pass `refresh=False` and
+        call `refresh()` once after the last part.
+
+        Rejected items are retried. If some items still fail on either store,
+        whatever was written for this document is removed from both stores
+        and BulkWriteError is raised, so the stores never disagree.
+        """
+        if not chunks:
+            return 0
+
+        rows = [
+            {
+                "id": chunk.doc_id,
+                "doc_id": doc_id,
+                "embedding": embedding,
+            }
+            for chunk, embedding in zip(chunks, embeddings)
+        ]
+        sources = {
+            chunk.doc_id: {
+                "doc_id": doc_id,
+                "embedding": embedding,
+                "text": chunk.text,
+            }
+            for chunk, embedding in zip(chunks, embeddings)
+        }
+
+        start_time = time.time()
+        inserted_ids = self._write_milvus(rows)
+        milvus_time = time.time() - start_time
+        record_stage("milvus", milvus_time, items=len(inserted_ids))
+
+        if len(inserted_ids) < len(rows):
+            logger.error(f"Milvus rejected {len(rows) - len(inserted_ids)}/{len(rows)} rows of document {doc_id}")
+            self.delete(list(inserted_ids))
+            raise BulkWriteError(f"Failed to write document {doc_id} to Milvus")
+
+        start_time = time.time()
+        indexed_ids = self._write_es(sources)
+        es_time = time.time() - start_time
+        record_stage("es", es_time, items=len(indexed_ids))
+
+        if len(indexed_ids) < len(sources):
+            logger.error(f"Elasticsearch rejected {len(sources) - len(indexed_ids)}/{len(sources)} chunks of document {doc_id}")
+            self.delete(list(sources.keys()))
+            raise BulkWriteError(f"Failed to write document {doc_id} to Elasticsearch")
+
+        if refresh:
+            self.refresh()
+
+        if self.docstore is not None:
+            self.docstore.put_many({
+                id: {"doc_id": source["doc_id"], "text": source["text"]}
+                for id, source in sources.items()
+            })
+
+        logger.info(
+            f"Bulk wrote {len(rows)} chunks of document {doc_id} "
+            f"(milvus: {milvus_time:.2f}s, es: {es_time:.2f}s)"
+        )
+        return len(inserted_ids)
+
+    def refresh(self):
+        """
+        Make the written chunks searchable in Elasticsearch, once the whole
+        document is in.
+        """
+        self.es.indices.refresh(index=self.es_index)
+
+    def delete(
+        self,
+        ids: List[str],
+    ):
+        """
+        Remove chunks from both stores, ignoring the ones that are missing.
+        """
+        if not ids:
+            return
+
+        logger.info(f"Deleting {len(ids)} chunks")
+        if self.docstore is not None:
+            self.docstore.delete(ids)
+
+        try:
+            self.vectordb.delete(collection_name=self.collection_name, ids=ids)
+        except Exception as e:
+            logger.error(f"Error deleting Milvus rows: {e}")
+
+        try:
+            for ok, item in streaming_bulk(
+                self.es,
+                (
+                    {"_op_type": "delete", "_index": self.es_index, "_id": id}
+                    for id in ids
+                ),
+                chunk_size=self.es_chunk_size,
+                raise_on_error=False,
+                raise_on_exception=False,
+                ignore_status=(404,),
+            ):
+                if not ok:
+                    logger.error(f"Error deleting ES chunk: {item}")
+            self.es.indices.refresh(index=self.es_index)
+        except Exception as e:
+            logger.error(f"Error deleting ES chunks: {e}")
+
+    def _write_milvus(
+        self,
+        rows: List[Dict[str, Any]],
+    ) -> set:
+        """
+        Insert rows in batches, return the ids that were inserted.
+        """
+        inserted_ids = set()
+        for start in range(0, len(rows), self.milvus_batch_size):
+            pending = rows[start:start + self.milvus_batch_size]
+            attempt = 0
+            while pending:
+                try:
+                    res = self.vectordb.insert(
+                        collection_name=self.collection_name,
+                        data=pending,
+                    )
+                    ids = res.get("ids") or []
+                    if not ids and res.get("insert_count") == len(pending):
+                        ids = [row["id"] for row in pending]
+                    inserted_ids.update(str(id) for id in ids)
+                    pending = [row for row in pending if row["id"] not in inserted_ids]
+                except Exception as e:
+                    logger.warning(f"Milvus insert of {len(pending)} rows failed (attempt {attempt + 1}): {e}")
+
+                if not pending:
+                    break
+                if attempt >= self.max_retries:
+                    return inserted_ids
+                time.sleep(self.retry_backoff * (2 ** attempt))
+                attempt += 1
+
+        return inserted_ids
+
+    def _write_es(
+        self,
+        sources: Dict[str, Dict[str, Any]],
+    ) -> set:
+        """
+        Index chunks with the bulk helper, return the ids that were indexed.
+        """
+        indexed_ids = set()
+        pending = list(sources.keys())
+        attempt = 0
+        while pending:
+            try:
+                # 429 rejections are retried by the helper itself
+                for ok, item in streaming_bulk(
+                    self.es,
+                    (
+                        {
+                            "_op_type": "index",
+                            "_index": self.es_index,
+                            "_id": id,
+                            "_source": sources[id],
+                        }
+                        for id in pending
+                    ),
+                    chunk_size=self.es_chunk_size,
+                    raise_on_error=False,
+                    raise_on_exception=False,
+                    max_retries=self.max_retries,
+                    initial_backoff=self.retry_backoff,
+                ):
+                    info = item.get("index", {})
+                    if ok:
+                        indexed_ids.add(info["_id"])
+                    else:
+                        logger.warning(f"ES rejected chunk {info.get('_id')}: {info.get('error')}")
+            except Exception as e:
+                logger.warning(f"ES bulk request failed (attempt {attempt + 1}): {e}")
+
+            pending = [id for id in pending if id not in indexed_ids]
+            if not pending or attempt >= self.max_retries:
+                break
+            time.sleep(self.retry_backoff * (2 ** attempt))
+            attempt += 1
+
+        return indexed_ids
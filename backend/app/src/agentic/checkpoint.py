@@ -0,0 +1,195 @@
+import os
+import json
+import shutil
+import threading
+import numpy as np
+
+from typing import Dict, List, Optional
+
+from llama_index.core import Document
+
+from const import CheckpointStage
+from utils.hashing import hash_text
+from utils.logger import get_logger
+
+logger = get_logger()
+
+STAGES = list(CheckpointStage)
+
+
+class IngestionCheckpoint:
+    def __init__(
+        self,
+        directory: str,
+        doc_id: str,
+    ):
+        """
+        Progress of the ingestion of one document, stored in
+        `directory/doc_id`. For every window the manifest records the hash of
+        its text and the last completed stage. The chunks, their contexts
+        (appended one by one as they are generated) and their embeddings are
+        kept next to it, so an interrupted ingestion resumes where it stopped.
+
+        Args:
+            directory (str): The checkpoint root directory.
+            doc_id (str): The document id.
+        """
+        self.doc_id = doc_id
+        self.path = os.path.join(directory, doc_id)
+        self._lock = threading.Lock()
+
+        os.makedirs(self.path, exist_ok=True)
+        self.manifest = self._load_manifest()
+
+    @property
+    def _manifest_path(self) -> str:
+        return os.path.join(self.path, "manifest.json")
+
+    def _window_path(self, window: int, name: str) -> str:
+        return os.path.join(self.path, f"window_{window}.{name}")
+
+    def _load_manifest(self) -> dict:
+        try:
+            with open(self._manifest_path, "r", encoding="utf-8") as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return {"doc_id": self.doc_id, "windows": {}}
+        except Exception as e:
+            logger.warning(f"Ignoring unreadable checkpoint of document {self.doc_id}: {e}")
+            return {"doc_id": self.doc_id, "windows": {}}
+
+    def _save_manifest(self):
+        temp_path = self._manifest_path + ".tmp"
+        with open(temp_path, "w", encoding="utf-8") as f:
+            json.dump(self.manifest, f)
+        os.replace(temp_path, self._manifest_path)
+
+    def _set_stage(self, window: int, stage: CheckpointStage, **fields):
+        with self._lock:
+            state = self.manifest["windows"].setdefault(str(window), {})
+            state.update(fields, stage=stage.value)
+            self._save_manifest()
+
+    def stage(self, window: int) -> Optional[CheckpointStage]:
+        """
+        Return the last completed stage of a window, None if nothing is done.
+        """
+        state = self.manifest["windows"].get(str(window))
+        if not state:
+            return None
+        return CheckpointStage(state["stage"])
+
+    def reached(self, window: int, stage: CheckpointStage) -> bool:
+        current = self.stage(window)
+        return current is not None and STAGES.index(current) >= STAGES.index(stage)
+
+    def indexed_chunk_ids(self, from_window: int = 0) -> List[str]:
+        """
+        Return the ids of the chunks written to the stores.
+        """
+        return [
+            chunk_id
+            for window, state in self.manifest["windows"].items()
+            if int(window) >= from_window and state["stage"] == CheckpointStage.INDEXED.value
+            for chunk_id in state.get("chunk_ids", [])
+        ]
+
+    def validate(self, window: int, text: str) -> List[str]:
+        """
+        Check that the window still has the recorded text. If it differs, the
+        window and every later one are dropped and the ids of their indexed
+        chunks are returned so the caller can remove them.
+        """
+        state = self.manifest["windows"].get(str(window))
+        if state is None or state["hash"] == hash_text(text):
+            return []
+
+        logger.warning(f"Window {window} of document {self.doc_id} changed, dropping its checkpoint")
+        return self.truncate(window)
+
+    def truncate(self, from_window: int) -> List[str]:
+        """
+        Drop the windows from `from_window` on, return the ids of their
+        indexed chunks.
+        """
+        stale_ids = self.indexed_chunk_ids(from_window)
+        with self._lock:
+            for window in [w for w in self.manifest["windows"] if int(w) >= from_window]:
+                del self.manifest["windows"][window]
+                for name in ("chunks.json", "contexts.jsonl", "embeddings.npy"):
+                    if os.path.exists(self._window_path(int(window), name)):
+                        os.remove(self._window_path(int(window), name))
+            self._save_manifest()
+        return stale_ids
+
+    def save_chunks(self, window: int, text: str, chunks: List[Document]):
+        with open(self._window_path(window, "chunks.json"), "w", encoding="utf-8") as f:
+            json.dump(
+                [
+                    {"text": chunk.text, "metadata": chunk.metadata, "embedding": chunk.embedding}
+                    for chunk in chunks
+                ],
+                f,
+            )
+        self._set_stage(window, CheckpointStage.SPLIT, hash=hash_text(text), chunks=len(chunks))
+
+    def load_chunks(self, window: int) -> Optional[List[Document]]:
+        if not self.reached(window, CheckpointStage.SPLIT):
+            return None
+        with open(self._window_path(window, "chunks.json"), "r", encoding="utf-8") as f:
+            return [
+                Document(text=item["text"], metadata=item["metadata"], embedding=item["embedding"])
+                for item in json.load(f)
+            ]
+
+    def save_context(self, window: int, position: int, contextual_chunk: Document):
+        """
+        Record the contextual chunk generated for one chunk of a window.
+        """
+        line = json.dumps({
+            "position": position,
+            "id": contextual_chunk.doc_id,
+            "text": contextual_chunk.text,
+        })
+        with self._lock:
+            with open(self._window_path(window, "contexts.jsonl"), "a", encoding="utf-8") as f:
+                f.write(line + "\n")
+
+    def load_contexts(self, window: int, metadata: dict) -> Dict[int, Document]:
+        """
+        Return {position: contextual chunk} for the chunks already contextualized.
+        """
+        contextual_chunks = {}
+        path = self._window_path(window, "contexts.jsonl")
+        if not self.reached(window, CheckpointStage.SPLIT) or not os.path.exists(path):
+            return contextual_chunks
+        with open(path, "r", encoding="utf-8") as f:
+            for line in f:
+                try:
+                    item = json.loads(line)
+                except json.JSONDecodeError:
+                    # last line of a write cut short by a crash
+                    continue
+                contextual_chunks[item["position"]] = Document(
+                    id_=item["id"], text=item["text"], metadata=metadata,
+                )
+        return contextual_chunks
+
+    def mark_contextualized(self, window: int):
+        self._set_stage(window, CheckpointStage.CONTEXTUALIZED)
+
+    def save_embeddings(self, window: int, embeddings: List[List[float]]):
+        with open(self._window_path(window, "embeddings.npy"), "wb") as f:
+            np.save(f, np.asarray(embeddings, dtype=np.float32))
+        self._set_stage(window, CheckpointStage.EMBEDDED)
+
+    def load_embeddings(self, window: int) -> Optional[List[List[float]]]:
+        if not self.reached(window, CheckpointStage.EMBEDDED):
+            return None
+        return np.load(self._window_path(window, "embeddings.npy")).tolist()
+
+    def mark_indexed(self, window: int, chunk_ids: List[str]):
+        self._set_stage(window, CheckpointStage.INDEXED, chunk_ids=chunk_ids)
+
+    def remove(self):
+        shutil.rmtree(self.path, ignore_errors=True)
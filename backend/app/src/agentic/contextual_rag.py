@@ -1,8 +1,16 @@
+import os
+import asyncio
+import bisect
 import json
+import time
 import torch
 import textract
+import tiktoken
+import psutil
+import numpy as np
 
-from typing import List, Dict, Any
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Dict, Any, Callable, Iterable, Iterator, Optional, Tuple
 from transformers import BitsAndBytesConfig
 from pymilvus import MilvusClient, DataType
 from tempfile import SpooledTemporaryFile
@@ -21,7 +29,7 @@ from llama_index.core.node_parser import SemanticSplitterNodeParser
 from llama_index.postprocessor.flag_embedding_reranker import FlagEmbeddingReranker
 
 from llama_index.core.llms import ChatMessage
-from llama_index.core.schema import Node, NodeWithScore, QueryBundle, TextNode
+from llama_index.core.schema import MetadataMode, Node, NodeWithScore, QueryBundle, TextNode
 from llama_index.core import (
     VectorStoreIndex, 
     StorageContext,
@@ -34,21 +42,53 @@ from const import (
     EmbedderService,
     VectorDBService,
     RerankerService,
+    ContextualMode,
+    ChunkEmbeddingMode,
+    CheckpointStage,
+    FusionMethod,
+    RetrievalMode,
     ContextualRAGConfig,
+    IngestionStatus,
     PROMPT_DOC,
     PROMPT_CHUNK,
+    PROMPT_CHUNKS,
+    PROMPT_CONTEXTUAL_VERSION,
+    PROMPT_SECTION_SUMMARY,
+    PROMPT_OUTLINE,
     ASSISTANT_SYSTEM_PROMPT,
     QA_PROMPT,
     
 )
+from .bulk_writer import BulkWriter
+from .checkpoint import IngestionCheckpoint
+from .embedding_cache import CachedEmbedding
+from .scheduled_llm import ScheduledLLM, response_tokens
+from .splitter import ContextualSemanticSplitter, SENTENCE_EMBEDDINGS_KEY, pool_embeddings
+from utils.disk_cache import DiskCache
+from utils.docstore import MmapDocstore
+from utils.fusion import reciprocal_rank_fusion, weighted_score_fusion
+from utils.hashing import hash_text
+from utils.ingestion_report import ingestion_stage, record_stage
+from utils.cpu_scheduler import CPUScheduler
+from utils.llm_scheduler import LLMScheduler
 from utils.logger import get_logger
+from utils.minhash import MinHasher, NearDuplicateIndex
+from utils.query_cache import QueryEmbeddingCache
+from utils.rerank_batcher import FlagRerankerScorer, RerankBatcher
 from utils.json_extractor import extract_json
+from utils.async_runner import run_async
+from utils.metrics import get_metrics
 
 logger = get_logger()
+metrics = get_metrics()
+
+CHUNK_HASH_KEY = "chunk_hash"
+CHUNK_MINHASH_KEY = "chunk_minhash"
 
 class ContextualRAG:
     def __init__(self, config: ContextualRAGConfig = ContextualRAGConfig()):
         self.config = config
+        self._tokenizer = None
         
         # ATTENTION TO THIS, IT IS THE MAIN DIFFERENCE
         # ADD ELASTICSEARCH TO ADDRESS THE MAXIMUM CHARACTER WHEN INDEX DATA TO MILVUS
@@ -61,13 +101,55 @@ class ContextualRAG:
         
         logger.info("Loading LLM")
         self.llm = self._load_llm(config.llm_service, config.llm_model) 
+        if config.llm_requests_per_minute or config.llm_tokens_per_minute or config.llm_max_concurrency:
+            logger.info("Wrapping LLM with the shared scheduler")
+            self.llm = ScheduledLLM(
+                llm=self.llm,
+                scheduler=LLMScheduler(
+                    requests_per_minute=config.llm_requests_per_minute,
+                    tokens_per_minute=config.llm_tokens_per_minute,
+                    max_concurrency=config.llm_max_concurrency,
+                    chat_reserve=config.llm_chat_reserve,
+                ),
+                completion_tokens=config.llm_completion_tokens,
+            )
         Settings.llm = self.llm
         logger.info("Loaded LLM!")
 
+        self.contextual_cache = None
+        if config.contextual_cache_path:
+            logger.info("Loading contextual response cache")
+            self.contextual_cache = DiskCache(
+                path=config.contextual_cache_path,
+                name="contextual",
+                max_bytes=config.contextual_cache_max_bytes,
+                ttl=config.contextual_cache_ttl,
+            )
+
         logger.info("Loading Embedder")
         self.embedder = self._load_embedder(config.embedder_service, config.embedder_model)
+        if config.embedding_cache_path:
+            logger.info("Wrapping Embedder with persistent cache")
+            self.embedder = CachedEmbedding(
+                embedder=self.embedder,
+                cache=DiskCache(
+                    path=config.embedding_cache_path,
+                    name="embedding",
+                    max_bytes=config.embedding_cache_max_bytes,
+                ),
+                dtype=config.embedding_cache_dtype,
+            )
         Settings.embed_model = self.embedder
         logger.info("Loaded Embedder!")
+
+        # only the search path goes through it, ingestion embeds directly
+        self.query_cache = None
+        if config.query_cache_max_bytes > 0:
+            self.query_cache = QueryEmbeddingCache(
+                name="query_embedding",
+                max_bytes=config.query_cache_max_bytes,
+                ttl=config.query_cache_ttl,
+            )
         
         if not self.es.indices.exists(index=self.es_chunk_index):
             logger.info("Creating Elasticsearch index")
@@ -95,14 +177,62 @@ class ContextualRAG:
         self.vectordb = self._load_vectordb(config.vectordb_service)
         logger.info("Loaded VectorDB!")
 
+        self.docstore = None
+        if config.docstore_path:
+            logger.info("Loading local docstore")
+            self.docstore = MmapDocstore(config.docstore_path)
+
+        self.writer = BulkWriter(
+            vectordb=self.vectordb,
+            es=self.es,
+            es_index=self.es_chunk_index,
+            collection_name="collection",
+            milvus_batch_size=config.vectordb_insert_batch_size,
+            es_chunk_size=config.es_bulk_chunk_size,
+            max_retries=config.bulk_max_retries,
+            retry_backoff=config.bulk_retry_backoff,
+            docstore=self.docstore,
+        )
+
+        self.minhasher = None
+        if config.near_duplicate_threshold > 0:
+            self.minhasher = MinHasher(num_perm=config.near_duplicate_num_perm)
+
+        self.cpu_scheduler = CPUScheduler(
+            slice_items=config.cpu_slice_items,
+            max_defer=config.cpu_max_defer,
+            latency_slo=config.chat_latency_slo,
+            max_throttle=config.cpu_max_throttle,
+        )
+
         logger.info("Loading Splitter")
         self.splitter = self._load_splitter(config.buffer_size, config.breakpoint_percentile_threshold)
         logger.info("Loaded Splitter!")
 
+        # runs the Milvus side of hybrid searches next to the ES side
+        self._search_executor = None
+        if config.retrieval_mode == RetrievalMode.HYBRID:
+            self._search_executor = ThreadPoolExecutor(
+                max_workers=max(1, config.hybrid_search_workers), thread_name_prefix="search",
+            )
+
         logger.info("Loading Reranker")
         self.reranker = self._load_reranker(config.reranker_service, config.reranker_model, config.reranker_top_n)
         logger.info("Loaded Reranker!")
         
+        self.rerank_batcher = None
+        if config.rerank_max_batch_size > 0:
+            try:
+                scorer = FlagRerankerScorer(self.reranker)
+            except TypeError as e:
+                logger.warning(f"Reranking without batching: {e}")
+            else:
+                self.rerank_batcher = RerankBatcher(
+                    compute_score=scorer,
+                    max_batch_size=config.rerank_max_batch_size,
+                    max_wait=config.rerank_max_wait,
+                )
+        
     def _load_llm(
             self,
             llm_service: str,
@@ -141,10 +271,16 @@ class ContextualRAG:
         """
         if embedder_service == EmbedderService.OPENAI:
             logger.info(f"Loading OpenAI Embedder with model: {embedder_model}")
-            return OpenAIEmbedding(embedder_model)
+            return OpenAIEmbedding(
+                embedder_model,
+                embed_batch_size=self.config.embed_batch_size,
+            )
         elif embedder_service == EmbedderService.HUGGINGFACE:
             logger.info(f"Loading HuggingFace Embedder with model: {embedder_model}")
-            return HuggingFaceEmbedding(embedder_model)
+            return HuggingFaceEmbedding(
+                embedder_model,
+                embed_batch_size=self.config.embed_batch_size,
+            )
         else:
             raise ValueError(f"Invalid Embedder service: {embedder_service}")
         
@@ -214,10 +350,16 @@ class ContextualRAG:
         return NodeParser object
         """
              
-        return SemanticSplitterNodeParser(
+        return ContextualSemanticSplitter(
             embed_model=self.embedder,
             buffer_size=buffer_size,
             breakpoint_percentile_threshold=breakpoint_percentile_threshold,
+            large_document_chars=self.config.chunking_large_threshold,
+            large_document_mode=self.config.chunking_large_mode,
+            target_chunk_chars=self.config.chunking_target_chars,
+            refine_sentences=self.config.chunking_refine_sentences,
+            sample_rate=self.config.chunking_sample_rate,
+            cpu_scheduler=self.cpu_scheduler,
         )
         
     
@@ -247,8 +389,12 @@ class ContextualRAG:
         return list of chunks
         """
         
-        nodes = self.splitter.get_nodes_from_documents([doc])
+        with ingestion_stage("split", bytes=len(doc.text.encode("utf-8"))) as stage:
+            nodes = self.splitter.get_nodes_from_documents([doc])
+            stage["items"] = len(nodes)
             
+        # the splitter already embedded the sentences of every chunk, keep
+        # their pooled vector on the chunk so it can be reused
         return [
             Document(
                 text=node.text,
@@ -256,18 +402,110 @@ class ContextualRAG:
                     "doc_id": doc_id,
                     "node_id": node.node_id,
                 },
+                embedding=pool_embeddings(node.metadata[SENTENCE_EMBEDDINGS_KEY])
+                if node.metadata.get(SENTENCE_EMBEDDINGS_KEY) else None,
             ) for node in nodes
         ]
         
-    def generate_contextual(
+    def new_duplicate_index(self) -> Optional[NearDuplicateIndex]:
+        """
+        return an empty near-duplicate index, None when detection is disabled
+        """
+        if self.minhasher is None:
+            return None
+        return NearDuplicateIndex(
+            threshold=self.config.near_duplicate_threshold,
+            num_perm=self.config.near_duplicate_num_perm,
+        )
+
+    def chunk_signature(self, text: str) -> Optional[str]:
+        """
+        return the encoded MinHash signature of a chunk text, None when
+        detection is disabled
+        """
+        if self.minhasher is None:
+            return None
+        return MinHasher.encode(self.minhasher.signature(text))
+
+    def _collapse_near_duplicates(
+        self,
+        chunks: List[Document],
+        duplicates: Optional[NearDuplicateIndex],
+        register_only: bool = False,
+    ) -> List[Document]:
+        """
+        return chunks without the near-duplicates of chunks already in
+        `duplicates` (earlier chunks of the same document). Kept chunks are
+        added to the index. With `register_only`, chunks are only added.
+        """
+        if duplicates is None:
+            return chunks
+
+        start_time = time.time()
+        kept = []
+        for chunk in chunks:
+            signature = self.minhasher.signature(chunk.text)
+            if register_only or duplicates.find(signature) is None:
+                duplicates.add(chunk.doc_id, signature)
+                kept.append(chunk)
+        if register_only:
+            return kept
+
+        dropped = len(chunks) - len(kept)
+        record_stage("dedup", time.time() - start_time, items=len(chunks), duplicates=dropped)
+        if dropped:
+            logger.info(f"Dropped {dropped}/{len(chunks)} near-duplicate chunks")
+        return kept
+
+    def _reuse_corpus_duplicates(
+        self,
+        chunks: List[Document],
+        indices: List[int],
+        corpus: Optional[NearDuplicateIndex],
+        metadata: Dict[str, Any],
+    ) -> Dict[int, Tuple[Document, List[float]]]:
+        """
+        return {index: (contextual chunk, embedding)} copied from the stored
+        chunks that the chunks at `indices` are near-duplicates of. `corpus`
+        is keyed by stored chunk id
+        """
+        if corpus is None or not len(corpus) or not indices:
+            return {}
+
+        start_time = time.time()
+        matches = {}
+        for index in indices:
+            match = corpus.find(self.minhasher.signature(chunks[index].text))
+            if match is not None:
+                matches[index] = match
+
+        reused = {}
+        if matches:
+            res = self.es.mget(index=self.es_chunk_index, ids=list(set(matches.values())))
+            sources = {doc["_id"]: doc["_source"] for doc in res["docs"] if doc.get("found")}
+            for index, chunk_id in matches.items():
+                source = sources.get(chunk_id)
+                # the matched chunk may have been removed since the index was built
+                if source is not None:
+                    reused[index] = (
+                        Document(text=source["text"], metadata=metadata),
+                        source["embedding"],
+                    )
+
+        record_stage("corpus_dedup", time.time() - start_time, items=len(indices), reused=len(reused))
+        if reused:
+            logger.info(f"Copied {len(reused)}/{len(indices)} chunks from near-duplicates in the corpus")
+        return reused
+
+    def _contextual_messages(
         self,
         chunk_text: str,
         doc: Document,
-    ):
+    ) -> List[ChatMessage]:
         """
-        return contextual response
+        return messages asking the LLM to situate a chunk within the document
         """
-        messages = [
+        return [
             ChatMessage(
                 role="system",
                 content="You are a helpful assistant.",
@@ -281,69 +519,1073 @@ class ContextualRAG:
             ),
         ] 
 
-        # logger.info(f"chunk_text: {chunk_text}")
-        
-         
-        contextualized_content = self.llm.chat(
+    def _record_llm_call(
+        self,
+        start_time: float,
+        response,
+    ):
+        """
+        record the latency and, when the provider reports it, the token usage
+        of an LLM call
+        """
+        tokens = response_tokens(response)
+        counts = {"items": 1}
+        if tokens:
+            counts["tokens"] = tokens
+        record_stage("llm", time.time() - start_time, **counts)
+
+    def _contextual_cache_keys(
+        self,
+        chunk_texts: List[str],
+        doc: Document,
+        kind: str = "context",
+    ) -> List[str]:
+        """
+        return cache keys of the contexts of chunks within a document, `kind`
+        separates the entries of other generations such as section summaries
+        """
+        doc_hash = hash_text(doc.text)
+        return [
+            hash_text(json.dumps([
+                kind, self.config.llm_model, PROMPT_CONTEXTUAL_VERSION, doc_hash, chunk_text,
+            ]))
+            for chunk_text in chunk_texts
+        ]
+
+    def _get_cached_contexts(
+        self,
+        chunk_texts: List[str],
+        doc: Document,
+        kind: str = "context",
+    ) -> Dict[int, str]:
+        """
+        return {position in chunk_texts: context} for the cached contexts
+        """
+        if self.contextual_cache is None or not chunk_texts:
+            return {}
+
+        start_time = time.time()
+        keys = self._contextual_cache_keys(chunk_texts, doc, kind)
+        found = self.contextual_cache.get_many(keys)
+        record_stage(
+            "contextual_cache", time.time() - start_time,
+            items=len(keys), hits=sum(1 for key in keys if key in found),
+        )
+        return {
+            index: found[key].decode("utf-8")
+            for index, key in enumerate(keys) if key in found
+        }
+
+    def _set_cached_contexts(
+        self,
+        contexts: Dict[str, str],
+        doc: Document,
+        kind: str = "context",
+    ):
+        """
+        store {chunk text: context} in the contextual cache
+        """
+        if self.contextual_cache is None or not contexts:
+            return
+
+        chunk_texts = list(contexts.keys())
+        keys = self._contextual_cache_keys(chunk_texts, doc, kind)
+        self.contextual_cache.set_many({
+            key: contexts[chunk_text].encode("utf-8")
+            for key, chunk_text in zip(keys, chunk_texts)
+        })
+
+    async def agenerate_contextual(
+        self,
+        chunk_text: str,
+        doc: Document,
+    ):
+        """
+        return the chunk prepended with its context within the document
+        """
+        messages = self._contextual_messages(chunk_text, doc)
+
+        start_time = time.time()
+        response = await self.llm.achat(
             messages=messages,
-        ).message.content
-        
-        # logger.info(f"contextualized_content: {contextualized_content}")
-        
-        # return the prepended content
+        )
+        self._record_llm_call(start_time, response)
+        contextualized_content = response.message.content
+        self._set_cached_contexts({chunk_text: contextualized_content}, doc)
+
         return Document(
             text="\n\n".join([contextualized_content, chunk_text]),
             metadata=doc.metadata,
         )
+
+    def _count_tokens(self, text: str) -> int:
+        """
+        return number of tokens in text, counted with the LLM's tiktoken encoding
+        """
+        if self._tokenizer is None:
+            try:
+                self._tokenizer = tiktoken.encoding_for_model(self.config.llm_model)
+            except KeyError:
+                self._tokenizer = tiktoken.get_encoding("cl100k_base")
+        return len(self._tokenizer.encode(text, disallowed_special=()))
+
+    def _group_chunks(
+        self,
+        chunks: List[Document],
+    ) -> List[List[int]]:
+        """
+        return groups of consecutive chunk indices, each group fitting in the
+        contextual batch token budget
+        """
+        budget = self.config.contextual_batch_token_budget
+        max_chunks = max(1, self.config.contextual_batch_max_chunks)
+
+        groups = []
+        current = []
+        current_tokens = 0
+        for index, chunk in enumerate(chunks):
+            tokens = self._count_tokens(chunk.text)
+            if current and (current_tokens + tokens > budget or len(current) >= max_chunks):
+                groups.append(current)
+                current = []
+                current_tokens = 0
+            current.append(index)
+            current_tokens += tokens
+        if current:
+            groups.append(current)
+
+        return groups
+
+    async def _agenerate_contextual_batch(
+        self,
+        chunk_texts: List[str],
+        doc: Document,
+    ) -> Dict[int, str]:
+        """
+        return {position in chunk_texts: context} for one group of chunks,
+        sending the whole document only once. Chunks the LLM did not answer
+        for are missing from the result.
+        """
+        chunks_content = "\n".join([
+            f'<chunk index="{index}">\n{chunk_text}\n</chunk>'
+            for index, chunk_text in enumerate(chunk_texts)
+        ])
+        messages = [
+            ChatMessage(
+                role="system",
+                content="You are a helpful assistant.",
+            ),
+            ChatMessage(
+                role="user",
+                content=f"""
+                {PROMPT_DOC.format(WHOLE_DOCUMENT=doc.text)}
+                {PROMPT_CHUNKS.format(CHUNKS_CONTENT=chunks_content)}
+                """
+            ),
+        ]
+
+        start_time = time.time()
+        response = await self.llm.achat(
+            messages=messages,
+        )
+        self._record_llm_call(start_time, response)
+        content = response.message.content
+
+        data, ok = extract_json(content)
+        if not ok:
+            try:
+                data = json.loads(content)
+            except json.JSONDecodeError:
+                logger.warning("Could not parse batched contextual response")
+                return {}
+
+        contexts = {}
+        items = data.get("contexts", []) if isinstance(data, dict) else data
+        for item in items if isinstance(items, list) else []:
+            try:
+                index = int(item["index"])
+                context = str(item["context"]).strip()
+            except (KeyError, TypeError, ValueError):
+                continue
+            if 0 <= index < len(chunk_texts) and context:
+                contexts[index] = context
+
+        self._set_cached_contexts(
+            {chunk_texts[index]: context for index, context in contexts.items()}, doc,
+        )
+        return contexts
+
+    def _split_sections(
+        self,
+        text: str,
+    ) -> List[Tuple[int, int]]:
+        """
+        return (start, end) character spans of consecutive sections of about
+        `contextual_section_tokens` tokens, cut at line breaks
+        """
+        budget = max(1, self.config.contextual_section_tokens)
+
+        sections = []
+        start = 0
+        tokens = 0
+        position = 0
+        for line in text.splitlines(keepends=True):
+            line_tokens = self._count_tokens(line)
+            if tokens and tokens + line_tokens > budget:
+                sections.append((start, position))
+                start = position
+                tokens = 0
+            tokens += line_tokens
+            position += len(line)
+        if position > start or not sections:
+            sections.append((start, position))
+
+        return sections
+
+    def _locate_chunks(
+        self,
+        chunks: List[Document],
+        text: str,
+        sections: List[Tuple[int, int]],
+    ) -> List[Tuple[int, int]]:
+        """
+        return (first, last) section of every chunk. Chunks are searched in
+        order, a chunk that cannot be found keeps the sections of the previous one
+        """
+        starts = [start for start, _ in sections]
+        located = []
+        cursor = 0
+        first = last = 0
+        for chunk in chunks:
+            head = chunk.text.strip()[:100]
+            position = text.find(head, cursor) if head else -1
+            if position >= 0:
+                end = position + len(chunk.text.strip())
+                first = max(0, bisect.bisect_right(starts, position) - 1)
+                last = max(first, bisect.bisect_left(starts, end) - 1)
+                cursor = position + len(head)
+            located.append((first, last))
+
+        return located
+
+    async def _asummarize_section(
+        self,
+        section_text: str,
+    ) -> str:
+        """
+        return a short summary of a section, used as an outline entry
+        """
+        section = Document(text=section_text)
+        cached = self._get_cached_contexts([PROMPT_SECTION_SUMMARY], section, kind="summary")
+        if cached:
+            return cached[0]
+
+        start_time = time.time()
+        response = await self.llm.achat(
+            messages=[
+                ChatMessage(
+                    role="system",
+                    content="You are a helpful assistant.",
+                ),
+                ChatMessage(
+                    role="user",
+                    content=PROMPT_SECTION_SUMMARY.format(SECTION_CONTENT=section_text),
+                ),
+            ],
+        )
+        self._record_llm_call(start_time, response)
+        summary = response.message.content.strip()
+        self._set_cached_contexts({PROMPT_SECTION_SUMMARY: summary}, section, kind="summary")
+
+        return summary
+
+    async def _asummarize_sections(
+        self,
+        text: str,
+        with_retries: Callable,
+    ) -> List[str]:
+        """
+        return the summaries of the sections of `_split_sections(text)`
+        """
+        return await asyncio.gather(*[
+            with_retries(
+                f"Section {index}",
+                lambda start=start, end=end: self._asummarize_section(text[start:end]),
+            )
+            for index, (start, end) in enumerate(self._split_sections(text))
+        ])
+
+    @staticmethod
+    def _format_outline(summaries: List[str]) -> str:
+        return "\n".join(
+            f"[{index + 1}] {summary}" for index, summary in enumerate(summaries)
+        )
+
+    async def _aoutline_units(
+        self,
+        chunks: List[Document],
+        doc: Document,
+        with_retries: Callable,
+        outline: Tuple[str, int] = None,
+    ) -> List[Tuple[Document, List[int]]]:
+        """
+        return (prompt document, chunk indices) units for a long document: each
+        section is summarized once, and chunks are situated within the outline
+        built from the summaries plus the sections they come from.
+
+        `outline` is the (outline, number of sections before `doc`) of the
+        whole document when `doc` is one of its windows, otherwise the
+        outline is built from `doc`
+        """
+        sections = self._split_sections(doc.text)
+        if outline is None:
+            outline = (self._format_outline(await self._asummarize_sections(doc.text, with_retries)), 0)
+            logger.info(
+                f"Built outline of {len(sections)} sections "
+                f"({self._count_tokens(outline[0])} tokens) for hierarchical contextualization"
+            )
+        outline, offset = outline
+
+        units = {}
+        for index, span in enumerate(self._locate_chunks(chunks, doc.text, sections)):
+            units.setdefault(span, []).append(index)
+
+        return [
+            (
+                Document(
+                    text=PROMPT_OUTLINE.format(
+                        OUTLINE=outline,
+                        SECTIONS=(
+                            f"{offset + first + 1}-{offset + last + 1}"
+                            if last > first else f"{offset + first + 1}"
+                        ),
+                        SECTION_CONTENT=doc.text[sections[first][0]:sections[last][1]],
+                    ),
+                    metadata=doc.metadata,
+                ),
+                indices,
+            )
+            for (first, last), indices in units.items()
+        ]
+
+    async def _aretry(
+        self,
+        semaphore: asyncio.Semaphore,
+        label: str,
+        make_call: Callable,
+    ):
+        """
+        return the result of `make_call()`, run under the semaphore and retried
+        with exponential backoff up to `contextual_max_retries` times
+        """
+        max_retries = self.config.contextual_max_retries
+        attempt = 0
+        while True:
+            async with semaphore:
+                try:
+                    return await make_call()
+                except Exception as e:
+                    if attempt >= max_retries:
+                        logger.error(f"{label} failed after {attempt + 1} attempts: {e}")
+                        raise
+                    logger.warning(f"{label} failed (attempt {attempt + 1}), retrying: {e}")
+            # back off outside the semaphore so other chunks keep the slot busy
+            await asyncio.sleep(self.config.contextual_retry_backoff * (2 ** attempt))
+            attempt += 1
+
+    async def _acontextualize_chunks(
+        self,
+        chunks: List[Document],
+        doc: Document,
+        on_chunk: Callable[[int, Document], None] = None,
+        outline: Tuple[str, int] = None,
+    ) -> List[Document]:
+        """
+        return contextual chunks in the same order as the input chunks,
+        keeping at most `contextual_concurrency` LLM calls in flight.
+        `on_chunk(index, contextual_chunk)` is called as soon as a chunk is done.
+        With the `outline` of the whole document, `doc` is one of its windows
+        and is contextualized hierarchically against that outline
+        """
+        semaphore = asyncio.Semaphore(max(1, self.config.contextual_concurrency))
+        progress = tqdm(total=len(chunks), desc="Generating contextual responses")
+
+        async def _with_retries(label: str, make_call):
+            return await self._aretry(semaphore, label, make_call)
+
+        def _done(index: int, contextual_chunk: Document) -> Document:
+            if on_chunk:
+                on_chunk(index, contextual_chunk)
+            progress.update(1)
+            return contextual_chunk
+
+        async def _contextualize(index: int, prompt_doc: Document) -> Document:
+            contextual_chunk = await _with_retries(
+                f"Chunk {index}",
+                lambda: self.agenerate_contextual(chunks[index].text, prompt_doc),
+            )
+            return _done(index, contextual_chunk)
+
+        async def _contextualize_group(indices: List[int], prompt_doc: Document) -> List[Document]:
+            try:
+                contexts = await _with_retries(
+                    f"Chunks {indices[0]}-{indices[-1]}",
+                    lambda: self._agenerate_contextual_batch(
+                        [chunks[index].text for index in indices], prompt_doc,
+                    ),
+                )
+            except Exception:
+                contexts = {}
+
+            missing = [index for position, index in enumerate(indices) if position not in contexts]
+            if missing:
+                logger.info(f"Falling back to per-chunk calls for {len(missing)}/{len(indices)} chunks")
+            fallbacks = dict(zip(missing, await asyncio.gather(*[
+                _contextualize(index, prompt_doc) for index in missing
+            ])))
+
+            results = []
+            for position, index in enumerate(indices):
+                if index in fallbacks:
+                    results.append(fallbacks[index])
+                    continue
+                results.append(_done(index, Document(
+                    text="\n\n".join([contexts[position], chunks[index].text]),
+                    metadata=doc.metadata,
+                )))
+            return results
+
+        async def _contextualize_unit(prompt_doc: Document, indices: List[int]) -> Dict[int, Document]:
+            """
+            contextualize the chunks sharing one prompt document
+            """
+            results = {}
+            cached = self._get_cached_contexts([chunks[index].text for index in indices], prompt_doc)
+            for position, context in cached.items():
+                index = indices[position]
+                results[index] = _done(index, Document(
+                    text="\n\n".join([context, chunks[index].text]),
+                    metadata=doc.metadata,
+                ))
+            pending = [index for index in indices if index not in results]
+            if cached:
+                logger.info(f"Reusing {len(cached)}/{len(indices)} cached contexts")
+
+            if self.config.contextual_mode == ContextualMode.BATCHED:
+                groups = [
+                    [pending[position] for position in group]
+                    for group in self._group_chunks([chunks[index] for index in pending])
+                ]
+                grouped = await asyncio.gather(*[
+                    _contextualize_group(group, prompt_doc) for group in groups
+                ])
+                for group, contextual_chunks in zip(groups, grouped):
+                    results.update(zip(group, contextual_chunks))
+            else:
+                results.update(zip(pending, await asyncio.gather(*[
+                    _contextualize(index, prompt_doc) for index in pending
+                ])))
+
+            return results
+
+        try:
+            threshold = self.config.contextual_hierarchical_threshold
+            if outline is not None:
+                units = await self._aoutline_units(chunks, doc, _with_retries, outline=outline)
+            elif threshold > 0 and self._count_tokens(doc.text) > threshold:
+                units = await self._aoutline_units(chunks, doc, _with_retries)
+            else:
+                units = [(doc, list(range(len(chunks))))]
+
+            results = {}
+            for unit_results in await asyncio.gather(*[
+                _contextualize_unit(prompt_doc, indices) for prompt_doc, indices in units
+            ]):
+                results.update(unit_results)
+
+            return [results[index] for index in range(len(chunks))]
+        finally:
+            progress.close()
+
+    def contextualize_chunks(
+        self,
+        chunks: List[Document],
+        doc: Document,
+        on_chunk: Callable[[int, Document], None] = None,
+        outline: Tuple[str, int] = None,
+    ) -> List[Document]:
+        """
+        return contextual chunks, generated concurrently. `outline` is the
+        whole-document outline when `doc` is a window, see `_document_outline`
+        """
+        if not chunks:
+            return []
+
+        start_time = time.time()
+        with ingestion_stage("contextualize", items=len(chunks)):
+            contextual_chunks = run_async(self._acontextualize_chunks(chunks, doc, on_chunk, outline))
+        elapsed = time.time() - start_time
+
+        logger.info(
+            f"Contextualized {len(chunks)} chunks in {elapsed:.2f}s "
+            f"({len(chunks) / max(elapsed, 1e-6):.2f} chunks/s, "
+            f"mode={self.config.contextual_mode}, "
+            f"concurrency={self.config.contextual_concurrency})"
+        )
+        return contextual_chunks
     
+    def _embed_batch_size(self) -> int:
+        """
+        return embedding batch size, capped by the memory currently available
+        """
+        batch_size = max(1, self.config.embed_batch_size)
+
+        if torch.cuda.is_available() and self.config.embedder_service == EmbedderService.HUGGINGFACE:
+            available, _ = torch.cuda.mem_get_info()
+        else:
+            available = psutil.virtual_memory().available
+
+        budget = available * self.config.embed_memory_fraction
+        memory_cap = int(budget // max(1, self.config.embed_bytes_per_item))
+
+        return max(1, min(batch_size, memory_cap))
+
+    def embed_contextual_chunks(
+        self,
+        contextual_chunks: List[Document],
+        chunks: List[Document],
+    ) -> List[List[float]]:
+        """
+        return embeddings of contextual chunks according to `chunk_embedding_mode`:
+        - reembed: embed the whole contextual text
+        - pooled: reuse the pooled sentence embeddings of the splitter
+        - combined: mix the pooled sentence embeddings with an embedding of the context only
+        """
+        mode = self.config.chunk_embedding_mode
+        if mode == ChunkEmbeddingMode.REEMBED or any(chunk.embedding is None for chunk in chunks):
+            return self.embed_chunks(contextual_chunks)
+
+        pooled = np.asarray([chunk.embedding for chunk in chunks], dtype=np.float32)
+        if mode == ChunkEmbeddingMode.POOLED:
+            logger.info(f"Reusing splitter embeddings for {len(chunks)} chunks")
+            return pooled.tolist()
+
+        # the contextual text is the context followed by the chunk text
+        contexts = [
+            Document(text=contextual_chunk.text[:-len(chunk.text)].strip() or chunk.text)
+            for contextual_chunk, chunk in zip(contextual_chunks, chunks)
+        ]
+        context_embeddings = np.asarray(self.embed_chunks(contexts), dtype=np.float32)
+        context_embeddings /= np.maximum(
+            np.linalg.norm(context_embeddings, axis=1, keepdims=True), 1e-12
+        )
+
+        weight = self.config.chunk_embedding_context_weight
+        combined = (1 - weight) * pooled + weight * context_embeddings
+        combined /= np.maximum(np.linalg.norm(combined, axis=1, keepdims=True), 1e-12)
+
+        logger.info(f"Combined splitter and context embeddings for {len(chunks)} chunks")
+        return combined.tolist()
+
+    def embed_chunks(
+        self,
+        chunks: List[Document],
+    ) -> List[List[float]]:
+        """
+        return embeddings of chunks, computed in batches. The batch size is
+        halved when a batch runs out of memory. Every batch is a background
+        slice of the CPU scheduler, capped at `cpu_slice_items` while a chat
+        is running.
+        """
+        texts = [chunk.text for chunk in chunks]
+        embeddings = []
+
+        batch_size = self._embed_batch_size()
+        logger.info(f"Embedding {len(texts)} chunks with batch size {batch_size}")
+
+        start_time = time.time()
+        start = 0
+        batch_index = 0
+        capped = False
+        while start < len(texts):
+            size = self.cpu_scheduler.slice_size(batch_size)
+            if size < batch_size and not capped:
+                capped = True
+                logger.info(f"Chat running, embedding batches capped at {size} chunks (CPU_SLICE_ITEMS)")
+            batch = texts[start:start + size]
+            batch_start = time.time()
+            try:
+                with self.cpu_scheduler.background_slice():
+                    embeddings.extend(self.embedder.get_text_embedding_batch(batch))
+            except (MemoryError, RuntimeError) as e:
+                if batch_size == 1 or not (
+                    isinstance(e, MemoryError) or "out of memory" in str(e).lower()
+                ):
+                    raise
+                batch_size = max(1, batch_size // 2)
+                logger.warning(f"Out of memory while embedding, retrying with batch size {batch_size}")
+                if torch.cuda.is_available():
+                    torch.cuda.empty_cache()
+                continue
+
+            batch_index += 1
+            logger.info(
+                f"Embedded batch {batch_index} "
+                f"({len(batch)} chunks) in {time.time() - batch_start:.2f}s"
+            )
+            start += len(batch)
+
+        elapsed = time.time() - start_time
+        record_stage(
+            "embed", elapsed,
+            items=len(texts), bytes=sum(len(text.encode("utf-8")) for text in texts),
+        )
+        logger.info(
+            f"Embedded {len(texts)} chunks in {elapsed:.2f}s "
+            f"({len(texts) / max(elapsed, 1e-6):.2f} chunks/s)"
+        )
+        return embeddings
+
     def add_new_document(
         self,
         doc_id: str,
         doc: Document,
-    ) -> bool:
+        on_stage: Callable[[IngestionStatus], None] = None,
+        checkpoint: IngestionCheckpoint = None,
+        window: int = 0,
+        duplicates: NearDuplicateIndex = None,
+        corpus: NearDuplicateIndex = None,
+        outline: Tuple[str, int] = None,
+        refresh: bool = True,
+    ) -> List[Document]:
         """
-        handle new document
+        handle new document, `on_stage` is called when a new stage starts.
+        With a checkpoint, the work already recorded for `window` is reused
+        and every finished step is recorded.
+
+        Chunks that are near-duplicates of a chunk in `duplicates` (earlier
+        windows of the document) are dropped before contextualization, and
+        the ones matching a stored chunk in `corpus` get a copy of its
+        context and vector. `outline` is the whole-document outline when `doc`
+        is a window of a long document. Without `refresh` the chunks are only
+        searchable after `writer.refresh()`
         """
+        if on_stage:
+            on_stage(IngestionStatus.CONTEXTUALIZING)
         
-        chunks = self.chunk_text(doc, doc_id)
+        if checkpoint:
+            self.delete_chunks(checkpoint.validate(window, doc.text))
+            if checkpoint.reached(window, CheckpointStage.INDEXED):
+                logger.info(f"Window {window} of document {doc_id} is already indexed")
+                contexts = checkpoint.load_contexts(window, doc.metadata)
+                chunks = checkpoint.load_chunks(window)
+                self._collapse_near_duplicates(chunks, duplicates, register_only=True)
+                return self._set_chunk_hashes(
+                    [contexts[index] for index in range(len(contexts))],
+                    chunks,
+                )
+        
+        chunks = checkpoint.load_chunks(window) if checkpoint else None
+        if chunks is None:
+            chunks = self._collapse_near_duplicates(self.chunk_text(doc, doc_id), duplicates)
+            if checkpoint:
+                checkpoint.save_chunks(window, doc.text, chunks)
+        else:
+            self._collapse_near_duplicates(chunks, duplicates, register_only=True)
 
-        chunks = tqdm(chunks, desc="Generating contextual responses")
+        done = checkpoint.load_contexts(window, doc.metadata) if checkpoint else {}
+        pending = [index for index in range(len(chunks)) if index not in done]
+        if done:
+            logger.info(f"Resuming document {doc_id}: {len(done)}/{len(chunks)} chunks already contextualized")
 
-        total_inserted = 0
-        contextual_chunks = []
-        for chunk in chunks:
-            contextual_chunks.append(self.generate_contextual(chunk.text, doc))
+        reused = self._reuse_corpus_duplicates(chunks, pending, corpus, doc.metadata)
+        if reused:
+            pending = [index for index in pending if index not in reused]
+            if checkpoint:
+                for index, (contextual_chunk, _) in reused.items():
+                    checkpoint.save_context(window, index, contextual_chunk)
+
+        contextual_chunks = dict(done)
+        contextual_chunks.update(
+            (index, contextual_chunk) for index, (contextual_chunk, _) in reused.items()
+        )
+        contextual_chunks.update(zip(pending, self.contextualize_chunks(
+            [chunks[index] for index in pending],
+            doc,
+            on_chunk=(
+                lambda position, contextual_chunk: checkpoint.save_context(
+                    window, pending[position], contextual_chunk,
+                )
+            ) if checkpoint else None,
+            outline=outline,
+        )))
+        contextual_chunks = [contextual_chunks[index] for index in range(len(chunks))]
         
-        for contextual_chunk in contextual_chunks:
-            embeddings = self.embedder.get_text_embedding(contextual_chunk.text)
-            # logger.info(f"Inserted: {contextual_chunk.}")
-            res = self.vectordb.insert(
-                collection_name="collection",
-                data = [
-                    {
-                        "id": contextual_chunk.doc_id,
-                        "doc_id": doc_id,
-                        "embedding": embeddings,
-                    }
-                ]
-            )
-            
-            total_inserted += res["insert_count"]
-            res = self.es.index(
-                index=self.es_chunk_index,
-                id=contextual_chunk.doc_id,
-                document={
-                    "doc_id": doc_id,
-                    "embedding": embeddings,
-                    "text": contextual_chunk.text,
-                },  
-            )
+        if on_stage:
+            on_stage(IngestionStatus.INDEXING)
+        
+        chunk_embeddings = checkpoint.load_embeddings(window) if checkpoint else None
+        if chunk_embeddings is None:
+            if checkpoint:
+                checkpoint.mark_contextualized(window)
+            chunk_embeddings = [reused[index][1] if index in reused else None for index in range(len(chunks))]
+            missing = [index for index, embedding in enumerate(chunk_embeddings) if embedding is None]
+            if missing:
+                computed = self.embed_contextual_chunks(
+                    [contextual_chunks[index] for index in missing],
+                    [chunks[index] for index in missing],
+                )
+                for index, embedding in zip(missing, computed):
+                    chunk_embeddings[index] = embedding
+            if checkpoint:
+                checkpoint.save_embeddings(window, chunk_embeddings)
+        elif checkpoint:
+            # a previous attempt may have died in the middle of the write
+            self.delete_chunks([chunk.doc_id for chunk in contextual_chunks])
+        
+        total_inserted = self.writer.write(doc_id, contextual_chunks, chunk_embeddings, refresh=refresh)
+        if checkpoint:
+            checkpoint.mark_indexed(window, [chunk.doc_id for chunk in contextual_chunks])
         
         logger.info(f"Collection updated with document: {doc_id}")
         logger.info(f"Total inserted: {total_inserted}")
         
+        return self._set_chunk_hashes(contextual_chunks, chunks)
+
+    def _set_chunk_hashes(
+        self,
+        contextual_chunks: List[Document],
+        chunks: List[Document],
+    ) -> List[Document]:
+        """
+        return contextual chunks with the hash of their chunk text in
+        `metadata[CHUNK_HASH_KEY]`, used to diff document versions, and its
+        MinHash signature in `metadata[CHUNK_MINHASH_KEY]`
+        """
+        for contextual_chunk, chunk in zip(contextual_chunks, chunks):
+            contextual_chunk.metadata = {
+                **contextual_chunk.metadata,
+                CHUNK_HASH_KEY: hash_text(chunk.text),
+                CHUNK_MINHASH_KEY: self.chunk_signature(chunk.text),
+            }
         return contextual_chunks
 
+    def _iter_windows(
+        self,
+        sections: Iterable[str],
+    ) -> Iterator[str]:
+        """
+        return windows of consecutive sections, each up to `stream_window_chars`
+        characters unless a single section is longer
+        """
+        buffer = []
+        size = 0
+        for section in sections:
+            if buffer and size + len(section) > self.config.stream_window_chars:
+                yield "\n".join(buffer)
+                buffer = []
+                size = 0
+            buffer.append(section)
+            size += len(section) + 1
+        if buffer:
+            yield "\n".join(buffer)
+
+    def _read_spool(self, spool) -> Iterator[str]:
+        spool.seek(0)
+        for line in spool:
+            yield json.loads(line)
+
+    async def _aoutline_document(
+        self,
+        windows: Iterable[str],
+    ) -> List[List[str]]:
+        """
+        return the section summaries of every window
+        """
+        semaphore = asyncio.Semaphore(max(1, self.config.contextual_concurrency))
+
+        async def _with_retries(label: str, make_call):
+            return await self._aretry(semaphore, label, make_call)
+
+        return [
+            await self._asummarize_sections(window, _with_retries)
+            for window in windows
+        ]
+
+    def _document_outline(
+        self,
+        windows: Iterator[str],
+    ) -> Tuple[Iterator[str], Optional[List[Tuple[str, int]]]]:
+        """
+        return the windows again and, for a document of several windows above
+        `contextual_hierarchical_threshold` tokens, the (outline, number of
+        sections before the window) of every window. The outline summarizes
+        the sections of the whole document, so the windows are spooled to a
+        temporary file and read twice
+        """
+        if self.config.contextual_hierarchical_threshold <= 0:
+            return windows, None
+
+        spool = SpooledTemporaryFile(max_size=self.config.stream_window_chars, mode="w+", encoding="utf-8")
+        tokens = 0
+        count = 0
+        for window in windows:
+            spool.write(json.dumps(window) + "\n")
+            tokens += self._count_tokens(window)
+            count += 1
+
+        def _replay() -> Iterator[str]:
+            with spool:
+                yield from self._read_spool(spool)
+
+        # a single window is the whole document, it builds its own outline
+        if count <= 1 or tokens <= self.config.contextual_hierarchical_threshold:
+            return _replay(), None
+
+        start_time = time.time()
+        summaries = run_async(self._aoutline_document(self._read_spool(spool)))
+        outline = self._format_outline([summary for window in summaries for summary in window])
+        record_stage("outline", time.time() - start_time, items=sum(len(window) for window in summaries))
+        logger.info(
+            f"Built outline of {sum(len(window) for window in summaries)} sections over {count} windows "
+            f"({self._count_tokens(outline)} tokens) for hierarchical contextualization"
+        )
+
+        outlines = []
+        offset = 0
+        for window in summaries:
+            outlines.append((outline, offset))
+            offset += len(window)
+        return _replay(), outlines
+
+    def add_new_document_stream(
+        self,
+        doc_id: str,
+        sections: Iterable[str],
+        metadata: Dict[str, Any] = None,
+        on_stage: Callable[[IngestionStatus], None] = None,
+        corpus: NearDuplicateIndex = None,
+    ) -> List[Tuple[str, str, Optional[str]]]:
+        """
+        handle new document given as a stream of sections, return the
+        (id, content hash, MinHash signature) of every chunk
+
+        Sections are grouped into windows that are chunked, contextualized and
+        indexed one after another, so only one window is held in memory. Each
+        chunk is situated within its window, and for long documents within
+        the outline of the whole document as well.
+
+        When checkpoints are enabled, a failed ingestion keeps its progress and
+        calling this again with the same document id resumes it. Otherwise the
+        chunks written so far are removed.
+
+        Near-duplicate chunks are collapsed within the document, and against
+        `corpus` (stored chunks, keyed by id) when given.
+        """
+        checkpoint = self.load_checkpoint(doc_id)
+        duplicates = self.new_duplicate_index()
+        chunks = []
+        try:
+            windows, outlines = self._document_outline(self._iter_windows(sections))
+            index = -1
+            for index, window in enumerate(windows):
+                logger.info(f"Processing window {index} of document {doc_id} ({len(window)} chars)")
+                contextual_chunks = self.add_new_document(
+                    doc_id=doc_id,
+                    doc=Document(
+                        text=window,
+                        metadata=metadata or {"doc_id": doc_id},
+                    ),
+                    on_stage=on_stage,
+                    checkpoint=checkpoint,
+                    window=index,
+                    duplicates=duplicates,
+                    corpus=corpus,
+                    outline=outlines[index] if outlines else None,
+                    refresh=False,
+                )
+                chunks.extend(
+                    (chunk.doc_id, chunk.metadata[CHUNK_HASH_KEY], chunk.metadata[CHUNK_MINHASH_KEY])
+                    for chunk in contextual_chunks
+                )
+        except Exception:
+            if checkpoint:
+                logger.error(f"Ingestion of document {doc_id} failed, progress kept in {checkpoint.path}")
+            else:
+                logger.error(f"Removing {len(chunks)} chunks of partially ingested document {doc_id}")
+                self.delete_chunks([chunk[0] for chunk in chunks])
+            raise
+
+        # refresh once, after the last window
+        self.writer.refresh()
+
+        if checkpoint:
+            # windows left over from a longer earlier attempt
+            self.delete_chunks(checkpoint.truncate(index + 1))
+            checkpoint.remove()
+
+        return chunks
+
+    def update_document_stream(
+        self,
+        doc_id: str,
+        sections: Iterable[str],
+        existing_chunks: List[Tuple[str, str]],
+        metadata: Dict[str, Any] = None,
+        on_stage: Callable[[IngestionStatus], None] = None,
+    ) -> Tuple[List[Tuple[str, str, Optional[str]]], List[str], List[str]]:
+        """
+        index the new content of a document, return the (id, content hash,
+        MinHash signature) of every chunk of the new version, the ids of the
+        chunks written and the ids of the existing chunks no longer used
+
+        The new version is chunked, and chunks whose text hash matches one of
+        `existing_chunks` (id, content hash) keep their stored context and
+        vector. Only the other chunks are contextualized, embedded and
+        written. Unused chunks are not removed, the caller deletes them once
+        it committed the new version, or deletes the written ones instead.
+        """
+        available = {}
+        for chunk_id, chunk_hash in existing_chunks:
+            if chunk_hash:
+                available.setdefault(chunk_hash, []).append(chunk_id)
+
+        duplicates = self.new_duplicate_index()
+        chunks = []
+        written = []
+        try:
+            windows, outlines = self._document_outline(self._iter_windows(sections))
+            for index, window in enumerate(windows):
+                doc = Document(
+                    text=window,
+                    metadata=metadata or {"doc_id": doc_id},
+                )
+                if on_stage:
+                    on_stage(IngestionStatus.CONTEXTUALIZING)
+
+                window_chunks = self._collapse_near_duplicates(self.chunk_text(doc, doc_id), duplicates)
+                hashes = [hash_text(chunk.text) for chunk in window_chunks]
+                ids = [None] * len(window_chunks)
+                changed = []
+                for position, chunk_hash in enumerate(hashes):
+                    if available.get(chunk_hash):
+                        ids[position] = available[chunk_hash].pop()
+                    else:
+                        changed.append(position)
+                logger.info(
+                    f"Window {index} of document {doc_id}: "
+                    f"{len(window_chunks) - len(changed)} unchanged, {len(changed)} new chunks"
+                )
+
+                if changed:
+                    contextual_chunks = self.contextualize_chunks(
+                        [window_chunks[position] for position in changed], doc,
+                        outline=outlines[index] if outlines else None,
+                    )
+                    if on_stage:
+                        on_stage(IngestionStatus.INDEXING)
+                    chunk_embeddings = self.embed_contextual_chunks(
+                        contextual_chunks, [window_chunks[position] for position in changed],
+                    )
+                    self.writer.write(doc_id, contextual_chunks, chunk_embeddings, refresh=False)
+                    for position, contextual_chunk in zip(changed, contextual_chunks):
+                        ids[position] = contextual_chunk.doc_id
+                        written.append(contextual_chunk.doc_id)
+
+                chunks.extend(zip(ids, hashes, [self.chunk_signature(chunk.text) for chunk in window_chunks]))
+        except Exception:
+            logger.error(f"Removing {len(written)} new chunks of document {doc_id}, keeping the previous version")
+            self.delete_chunks(written)
+            raise
+
+        kept = {chunk[0] for chunk in chunks}
+        vanished = [chunk_id for chunk_id, _ in existing_chunks if chunk_id not in kept]
+        logger.info(
+            f"Updated document {doc_id}: {len(written)} chunks written, "
+            f"{len(chunks) - len(written)} reused, {len(vanished)} no longer used"
+        )
+        if written:
+            # refresh once, after the last window
+            self.writer.refresh()
+
+        return chunks, written, vanished
+
+    def load_checkpoint(
+        self,
+        doc_id: str,
+    ) -> IngestionCheckpoint:
+        """
+        return the ingestion checkpoint of a document, None when disabled
+        """
+        if not self.config.ingestion_checkpoint_dir:
+            return None
+        return IngestionCheckpoint(self.config.ingestion_checkpoint_dir, doc_id)
+
+    def has_checkpoint(
+        self,
+        doc_id: str,
+    ) -> bool:
+        """
+        return whether a failed ingestion of the document left progress behind
+        """
+        directory = self.config.ingestion_checkpoint_dir
+        return bool(directory) and os.path.exists(os.path.join(directory, doc_id, "manifest.json"))
+
+    def discard_checkpoint(
+        self,
+        doc_id: str,
+    ):
+        """
+        remove the progress of a failed ingestion, including its indexed chunks
+        """
+        if not self.has_checkpoint(doc_id):
+            return
+        checkpoint = self.load_checkpoint(doc_id)
+        self.delete_chunks(checkpoint.indexed_chunk_ids())
+        checkpoint.remove()
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        return the counters of the caches, schedulers and batchers in use
+        """
+        stats = {}
+        if isinstance(self.llm, ScheduledLLM):
+            stats["llm_scheduler"] = self.llm.scheduler.stats()
+        if self.contextual_cache is not None:
+            stats["contextual_cache"] = self.contextual_cache.stats()
+        if isinstance(self.embedder, CachedEmbedding):
+            stats["embedding_cache"] = self.embedder.stats()
+        if self.query_cache is not None:
+            stats["query_cache"] = self.query_cache.stats()
+        if self.rerank_batcher is not None:
+            stats["rerank_batcher"] = self.rerank_batcher.stats()
+        return stats
+
+    def shutdown(self):
+        """
+        stop the hybrid search threads
+        """
+        if self._search_executor is not None:
+            self._search_executor.shutdown(wait=False)
+            self._search_executor = None
+
+    def delete_chunks(
+        self,
+        chunk_ids: List[str],
+    ):
+        """
+        remove chunks from the vector database and Elasticsearch
+        """
+        self.writer.delete(chunk_ids)
+
+    def embed_query(self, query: str) -> List[float]:
+        """
+        return the embedding of a query, through the query cache when enabled
+        """
+        if self.query_cache is not None:
+            return self.query_cache.get_or_embed(query, self.embedder.get_text_embedding)
+        return self.embedder.get_text_embedding(query)
+
     def sematic_search(
         self,
         query: str,
@@ -356,7 +1598,7 @@ class ContextualRAG:
         return list of top_k documents
         """
         
-        embeddings = self.embedder.get_text_embedding(query)
+        embeddings = self.embed_query(query)
         # logger.info(f"Embeddings: {embeddings}")
         
         # logger.info("Searching in VectorDB")
@@ -381,6 +1623,161 @@ class ContextualRAG:
     
         return semantic_results
     
+    def bm25_search(
+        self,
+        query: str,
+        top_k: int = 5,
+        document_ids: List[str] = None,
+    ) -> List[Dict[str, Any]]:
+        """
+        return the top_k chunks of a BM25 query on the chunk text in
+        Elasticsearch, as {"id", "score", "source"}
+        """
+        match = {"match": {"text": query}}
+        if document_ids:
+            # doc_id is an analyzed text field, match each id as a phrase
+            match = {
+                "bool": {
+                    "must": match,
+                    "filter": {
+                        "bool": {
+                            "should": [{"match_phrase": {"doc_id": id}} for id in document_ids],
+                            "minimum_should_match": 1,
+                        },
+                    },
+                },
+            }
+
+        res = self.es.search(
+            index=self.es_chunk_index,
+            query=match,
+            size=top_k,
+            source_excludes=["embedding"],
+        )
+        return [
+            {"id": hit["_id"], "score": hit["_score"], "source": hit["_source"]}
+            for hit in res["hits"]["hits"]
+        ]
+
+    def _timed_search(self, source: str, search: Callable, **kwargs) -> list:
+        """
+        return the hits of one retrieval source, an empty list when it fails
+        so the other source still answers
+        """
+        start_time = time.time()
+        try:
+            return search(**kwargs)
+        except Exception as e:
+            logger.error(f"{source} search failed: {e}")
+            metrics.inc("retrieval_errors_total", source=source)
+            return []
+        finally:
+            elapsed = time.time() - start_time
+            metrics.observe("retrieval_seconds", elapsed, source=source)
+            logger.info(f"{source} search took {elapsed:.3f}s")
+
+    def hybrid_search(
+        self,
+        query: str,
+        top_k: int = 5,
+        document_ids: List[str] = None,
+    ) -> Tuple[List[Tuple[str, float]], Dict[str, Dict[str, Any]]]:
+        """
+        return the top_k (id, score) of BM25 on Elasticsearch and ANN on
+        Milvus, queried concurrently and fused with `fusion_method`, and the
+        chunk sources already returned by Elasticsearch
+        """
+        candidates = max(top_k, self.config.hybrid_candidates)
+        if self._search_executor is None:
+            # not in hybrid mode, the sources are queried one after the other
+            vector_hits = self._timed_search(
+                "vector", self.sematic_search,
+                query=query, top_k=candidates, document_ids=document_ids,
+            )
+            bm25_hits = self._timed_search(
+                "bm25", self.bm25_search,
+                query=query, top_k=candidates, document_ids=document_ids,
+            )
+        else:
+            vector_future = self._search_executor.submit(
+                self._timed_search, "vector", self.sematic_search,
+                query=query, top_k=candidates, document_ids=document_ids,
+            )
+            bm25_hits = self._timed_search(
+                "bm25", self.bm25_search,
+                query=query, top_k=candidates, document_ids=document_ids,
+            )
+            vector_hits = vector_future.result()
+
+        rankings = {
+            # score is L2 distance so we need to invert it
+            "vector": [(hit["id"], 1 / (1e-6 + hit["distance"])) for hit in vector_hits],
+            "bm25": [(hit["id"], hit["score"]) for hit in bm25_hits],
+        }
+        weights = {
+            "vector": self.config.fusion_vector_weight,
+            "bm25": self.config.fusion_bm25_weight,
+        }
+        if self.config.fusion_method == FusionMethod.WEIGHTED:
+            fused = weighted_score_fusion(rankings, weights)
+        else:
+            fused = reciprocal_rank_fusion(rankings, weights, k=self.config.fusion_rrf_k)
+
+        logger.info(
+            f"Hybrid search fused {len(vector_hits)} vector and {len(bm25_hits)} BM25 hits "
+            f"into {len(fused)} chunks"
+        )
+        return fused[:top_k], {hit["id"]: hit["source"] for hit in bm25_hits}
+
+    def _fetch_chunk_sources(
+        self,
+        ids: List[str],
+    ) -> Dict[str, Dict[str, Any]]:
+        """
+        return {id: source} of stored chunks, read from the local docstore
+        when it is enabled, the others fetched from Elasticsearch in one mget
+        """
+        sources = self.docstore.get_many(ids) if self.docstore is not None else {}
+        missing = [id for id in ids if id not in sources]
+        if not missing:
+            return sources
+
+        res = self.es.mget(
+            index=self.es_chunk_index,
+            ids=missing,
+            source_excludes=["embedding"],
+        )
+        fetched = {doc["_id"]: doc["_source"] for doc in res["docs"] if doc.get("found")}
+        if self.docstore is not None and fetched:
+            # chunks written before the docstore was enabled
+            self.docstore.put_many(fetched)
+        sources.update(fetched)
+        return sources
+
+    def rerank(
+        self,
+        query: str,
+        nodes: List[NodeWithScore],
+    ) -> List[NodeWithScore]:
+        """
+        return the reranker's top_n nodes, scored in batches shared with concurrent searches
+        """
+        if self.rerank_batcher is None:
+            return self.reranker.postprocess_nodes(
+                nodes=nodes, query_bundle=QueryBundle(query_str=query)
+            )
+        if not nodes:
+            return []
+        
+        # same pairs and ordering as FlagEmbeddingReranker.postprocess_nodes
+        scores = self.rerank_batcher.score([
+            (query, node.node.get_content(metadata_mode=MetadataMode.EMBED))
+            for node in nodes
+        ])
+        for node, score in zip(nodes, scores):
+            node.score = score
+        return sorted(nodes, key=lambda node: -node.score)[:self.reranker.top_n]
+    
     def contextual_search(
         self,
         query: str,
@@ -391,33 +1788,47 @@ class ContextualRAG:
         return list of top_k documents
         """
             
-        semantic_results = tqdm(self.sematic_search(
-            query=query, top_k=top_k, document_ids=document_ids,
-            ), desc="Getting contextual results")
-        combined_nodes = []
-        for hit in semantic_results:
-            doc = self.es.get(
-                index=self.es_chunk_index, id=hit['id'],
-            )["_source"]
-            # logger.info(f"Doc: {doc}")
-            combined_nodes.append(
-                NodeWithScore(
-                    node=TextNode(
-                        text=doc["text"],
-                        metadata={
-                            "doc_id": doc["doc_id"],
-                            "node_id": hit["id"],
-                        },
-                    ),
+        # embedding and reranking compete with ingestion for the CPU
+        with self.cpu_scheduler.foreground():
+            if self.config.retrieval_mode == RetrievalMode.HYBRID:
+                ranked, sources = self.hybrid_search(
+                    query=query, top_k=top_k, document_ids=document_ids,
+                )
+            else:
+                ranked = [
                     # score is L2 distance so we need to invert it
-                    score=1 / (1e-6 + hit["distance"]),
+                    (hit["id"], 1 / (1e-6 + hit["distance"]))
+                    for hit in self.sematic_search(
+                        query=query, top_k=top_k, document_ids=document_ids,
+                    )
+                ]
+                sources = {}
+            sources.update(self._fetch_chunk_sources(
+                [chunk_id for chunk_id, _ in ranked if chunk_id not in sources]
+            ))
+
+            combined_nodes = []
+            for chunk_id, score in tqdm(ranked, desc="Getting contextual results"):
+                doc = sources.get(chunk_id)
+                if doc is None:
+                    logger.warning(f"Chunk {chunk_id} is in Milvus but not in Elasticsearch")
+                    continue
+                # logger.info(f"Doc: {doc}")
+                combined_nodes.append(
+                    NodeWithScore(
+                        node=TextNode(
+                            text=doc["text"],
+                            metadata={
+                                "doc_id": doc["doc_id"],
+                                "node_id": chunk_id,
+                            },
+                        ),
+                        score=score,
+                    )
                 )
-            )
-        logger.info(f"Combined nodes: {combined_nodes}")
-        
-        reranked_nodes = self.reranker.postprocess_nodes(
-            nodes=combined_nodes, query_bundle=QueryBundle(query_str=query)
-        )
+            logger.info(f"Combined nodes: {combined_nodes}")
+            
+            reranked_nodes = self.rerank(query, combined_nodes)
         
         logger.info(f"Reranked nodes: {reranked_nodes}")
         
@@ -0,0 +1,126 @@
+import numpy as np
+
+from typing import Any, List
+
+from llama_index.core.base.embeddings.base import BaseEmbedding, Embedding
+from llama_index.core.bridge.pydantic import PrivateAttr
+
+from utils.disk_cache import DiskCache
+from utils.hashing import hash_text
+from utils.logger import get_logger
+
+logger = get_logger()
+
+
+class CachedEmbedding(BaseEmbedding):
+    """
+    Embedding model that stores every computed vector in a DiskCache, keyed by
+    (model name, dimensions, dtype, kind, text hash), and only calls the
+    wrapped model on misses.
+    """
+
+    _embedder: BaseEmbedding = PrivateAttr()
+    _cache: DiskCache = PrivateAttr()
+    _dtype: Any = PrivateAttr()
+    _key_prefix: str = PrivateAttr()
+
+    def __init__(
+        self,
+        embedder: BaseEmbedding,
+        cache: DiskCache,
+        dtype: str = "float16",
+        **kwargs: Any,
+    ):
+        super().__init__(
+            model_name=embedder.model_name,
+            embed_batch_size=embedder.embed_batch_size,
+            callback_manager=embedder.callback_manager,
+            **kwargs,
+        )
+        self._embedder = embedder
+        self._cache = cache
+        self._dtype = np.dtype(dtype)
+        # models with a configurable output size (OpenAI `dimensions`) give
+        # different vectors for the same name, None is the model default
+        dimensions = getattr(embedder, "dimensions", None)
+        self._key_prefix = f"{self.model_name}:{dimensions or 'default'}:{self._dtype.name}"
+
+    @classmethod
+    def class_name(cls) -> str:
+        return "CachedEmbedding"
+
+    @property
+    def embedder(self) -> BaseEmbedding:
+        return self._embedder
+
+    def stats(self) -> dict:
+        return self._cache.stats()
+
+    def _key(self, kind: str, text: str) -> str:
+        return f"{self._key_prefix}:{kind}:{hash_text(text)}"
+
+    def _encode(self, embedding: Embedding) -> bytes:
+        return np.asarray(embedding, dtype=self._dtype).tobytes()
+
+    def _decode(self, value: bytes) -> Embedding:
+        return np.frombuffer(value, dtype=self._dtype).astype(np.float32).tolist()
+
+    def _lookup(self, kind: str, texts: List[str]):
+        """
+        return (embeddings with None for misses, indices of the misses)
+        """
+        keys = [self._key(kind, text) for text in texts]
+        found = self._cache.get_many(keys)
+        embeddings = [
+            self._decode(found[key]) if key in found else None for key in keys
+        ]
+        missing = [i for i, embedding in enumerate(embeddings) if embedding is None]
+        return embeddings, missing
+
+    def _store(self, kind: str, texts: List[str], embeddings: List[Embedding]):
+        self._cache.set_many({
+            self._key(kind, text): self._encode(embedding)
+            for text, embedding in zip(texts, embeddings)
+        })
+
+    def _get_query_embedding(self, query: str) -> Embedding:
+        embeddings, missing = self._lookup("query", [query])
+        if not missing:
+            return embeddings[0]
+        embedding = self._embedder._get_query_embedding(query)
+        self._store("query", [query], [embedding])
+        return embedding
+
+    async def _aget_query_embedding(self, query: str) -> Embedding:
+        embeddings, missing = self._lookup("query", [query])
+        if not missing:
+            return embeddings[0]
+        embedding = await self._embedder._aget_query_embedding(query)
+        self._store("query", [query], [embedding])
+        return embedding
+
+    def _get_text_embedding(self, text: str) -> Embedding:
+        return self._get_text_embeddings([text])[0]
+
+    async def _aget_text_embedding(self, text: str) -> Embedding:
+        return (await self._aget_text_embeddings([text]))[0]
+
+    def _get_text_embeddings(self, texts: List[str]) -> List[Embedding]:
+        embeddings, missing = self._lookup("text", texts)
+        if missing:
+            missing_texts = [texts[i] for i in missing]
+            computed = self._embedder._get_text_embeddings(missing_texts)
+            self._store("text", missing_texts, computed)
+            for i, embedding in zip(missing, computed):
+                embeddings[i] = embedding
+        return embeddings
+
+    async def _aget_text_embeddings(self, texts: List[str]) -> List[Embedding]:
+        embeddings, missing = self._lookup("text", texts)
+        if missing:
+            missing_texts = [texts[i] for i in missing]
+            computed = await self._embedder._aget_text_embeddings(missing_texts)
+            self._store("text", missing_texts, computed)
+            for i, embedding in zip(missing, computed):
+                embeddings[i] = embedding
+        return embeddings
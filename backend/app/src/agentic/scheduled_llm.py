@@ -0,0 +1,250 @@
+from typing import Any, Optional, Sequence
+
+from llama_index.core.base.llms.types import (
+    ChatMessage,
+    ChatResponse,
+    ChatResponseAsyncGen,
+    ChatResponseGen,
+    CompletionResponse,
+    CompletionResponseAsyncGen,
+    CompletionResponseGen,
+    LLMMetadata,
+)
+from llama_index.core.bridge.pydantic import PrivateAttr
+from llama_index.core.llms import LLM
+
+from utils.llm_scheduler import LLMScheduler, Ticket
+from utils.logger import get_logger
+
+logger = get_logger()
+
+# seconds the scheduler stops admitting calls after a 429 without retry-after
+RATE_LIMIT_PAUSE = 10.0
+
+
+def response_tokens(response) -> Optional[int]:
+    """
+    Return the total tokens reported by the provider for a response, if any.
+    """
+    raw = getattr(response, "raw", None)
+    usage = raw.get("usage") if isinstance(raw, dict) else getattr(raw, "usage", None)
+    if isinstance(usage, dict):
+        return usage.get("total_tokens")
+    return getattr(usage, "total_tokens", None)
+
+
+def _estimate_tokens(text: str) -> int:
+    # about 4 characters per token for English text
+    return len(text) // 4 + 1
+
+
+def _stream_text(response) -> str:
+    if response is None:
+        return ""
+    if hasattr(response, "message"):
+        return str(response.message.content or "")
+    return response.text or ""
+
+
+class ScheduledLLM(LLM):
+    """
+    LLM that goes through an LLMScheduler before every call to the wrapped
+    model, so chat and ingestion share the provider limits.
+    """
+
+    _llm: LLM = PrivateAttr()
+    _scheduler: LLMScheduler = PrivateAttr()
+    _completion_tokens: int = PrivateAttr()
+
+    def __init__(
+        self,
+        llm: LLM,
+        scheduler: LLMScheduler,
+        completion_tokens: int = 512,
+        **kwargs: Any,
+    ):
+        super().__init__(callback_manager=llm.callback_manager, **kwargs)
+        self._llm = llm
+        self._scheduler = scheduler
+        self._completion_tokens = completion_tokens
+
+    @classmethod
+    def class_name(cls) -> str:
+        return "ScheduledLLM"
+
+    @property
+    def llm(self) -> LLM:
+        return self._llm
+
+    @property
+    def scheduler(self) -> LLMScheduler:
+        return self._scheduler
+
+    @property
+    def metadata(self) -> LLMMetadata:
+        return self._llm.metadata
+
+    def _chat_tokens(self, messages: Sequence[ChatMessage]) -> int:
+        prompt = "".join(str(message.content or "") for message in messages)
+        return _estimate_tokens(prompt) + self._completion_tokens
+
+    def _completion_tokens_for(self, prompt: str) -> int:
+        return _estimate_tokens(prompt) + self._completion_tokens
+
+    def _failed(self, ticket: Ticket, e: Exception):
+        self._scheduler.release(ticket)
+        if getattr(e, "status_code", None) != 429:
+            return
+        headers = getattr(getattr(e, "response", None), "headers", None) or {}
+        try:
+            delay = float(headers.get("retry-after", RATE_LIMIT_PAUSE))
+        except (TypeError, ValueError):
+            delay = RATE_LIMIT_PAUSE
+        self._scheduler.pause(delay)
+
+    def _finished(self, ticket: Ticket, response, text: str = None):
+        tokens = response_tokens(response)
+        if tokens is None and text is not None:
+            # streamed responses rarely report usage, the last one holds the whole text
+            tokens = ticket.tokens - self._completion_tokens + _estimate_tokens(text)
+        self._scheduler.release(ticket, tokens)
+
+    def chat(self, messages: Sequence[ChatMessage], **kwargs: Any) -> ChatResponse:
+        ticket = self._scheduler.acquire(self._chat_tokens(messages))
+        try:
+            response = self._llm.chat(messages, **kwargs)
+        except Exception as e:
+            self._failed(ticket, e)
+            raise
+        self._finished(ticket, response)
+        return response
+
+    async def achat(self, messages: Sequence[ChatMessage], **kwargs: Any) -> ChatResponse:
+        ticket = await self._scheduler.aacquire(self._chat_tokens(messages))
+        try:
+            response = await self._llm.achat(messages, **kwargs)
+        except Exception as e:
+            self._failed(ticket, e)
+            raise
+        self._finished(ticket, response)
+        return response
+
+    def complete(self, prompt: str, formatted: bool = False, **kwargs: Any) -> CompletionResponse:
+        ticket = self._scheduler.acquire(self._completion_tokens_for(prompt))
+        try:
+            response = self._llm.complete(prompt, formatted=formatted, **kwargs)
+        except Exception as e:
+            self._failed(ticket, e)
+            raise
+        self._finished(ticket, response)
+        return response
+
+    async def acomplete(self, prompt: str, formatted: bool = False, **kwargs: Any) -> CompletionResponse:
+        ticket = await self._scheduler.aacquire(self._completion_tokens_for(prompt))
+        try:
+            response = await self._llm.acomplete(prompt, formatted=formatted, **kwargs)
+        except Exception as e:
+            self._failed(ticket, e)
+            raise
+        self._finished(ticket, response)
+        return response
+
+    def stream_chat(self, messages: Sequence[ChatMessage], **kwargs: Any) -> ChatResponseGen:
+        ticket = self._scheduler.acquire(self._chat_tokens(messages))
+        try:
+            stream = self._llm.stream_chat(messages, **kwargs)
+        except Exception as e:
+            self._failed(ticket, e)
+            raise
+
+        def gen() -> ChatResponseGen:
+            response = None
+            failed = False
+            try:
+                for response in stream:
+                    yield response
+            except Exception as e:
+                failed = True
+                self._failed(ticket, e)
+                raise
+            finally:
+                # also runs when the consumer stops reading early
+                if not failed:
+                    self._finished(ticket, response, _stream_text(response))
+
+        return gen()
+
+    def stream_complete(self, prompt: str, formatted: bool = False, **kwargs: Any) -> CompletionResponseGen:
+        ticket = self._scheduler.acquire(self._completion_tokens_for(prompt))
+        try:
+            stream = self._llm.stream_complete(prompt, formatted=formatted, **kwargs)
+        except Exception as e:
+            self._failed(ticket, e)
+            raise
+
+        def gen() -> CompletionResponseGen:
+            response = None
+            failed = False
+            try:
+                for response in stream:
+                    yield response
+            except Exception as e:
+                failed = True
+                self._failed(ticket, e)
+                raise
+            finally:
+                # also runs when the consumer stops reading early
+                if not failed:
+                    self._finished(ticket, response, _stream_text(response))
+
+        return gen()
+
+    async def astream_chat(self, messages: Sequence[ChatMessage], **kwargs: Any) -> ChatResponseAsyncGen:
+        ticket = await self._scheduler.aacquire(self._chat_tokens(messages))
+        try:
+            stream = await self._llm.astream_chat(messages, **kwargs)
+        except Exception as e:
+            self._failed(ticket, e)
+            raise
+
+        async def gen() -> ChatResponseAsyncGen:
+            response = None
+            failed = False
+            try:
+                async for response in stream:
+                    yield response
+            except Exception as e:
+                failed = True
+                self._failed(ticket, e)
+                raise
+            finally:
+                # also runs when the consumer stops reading early
+                if not failed:
+                    self._finished(ticket, response, _stream_text(response))
+
+        return gen()
+
+    async def astream_complete(self, prompt: str, formatted: bool = False, **kwargs: Any) -> CompletionResponseAsyncGen:
+        ticket = await self._scheduler.aacquire(self._completion_tokens_for(prompt))
+        try:
+            stream = await self._llm.astream_complete(prompt, formatted=formatted, **kwargs)
+        except Exception as e:
+            self._failed(ticket, e)
+            raise
+
+        async def gen() -> CompletionResponseAsyncGen:
+            response = None
+            failed = False
+            try:
+                async for response in stream:
+                    yield response
+            except Exception as e:
+                failed = True
+                self._failed(ticket, e)
+                raise
+            finally:
+                # also runs when the consumer stops reading early
+                if not failed:
+                    self._finished(ticket, response, _stream_text(response))
+
+        return gen()
@@ -0,0 +1,292 @@
+import numpy as np
+
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+from llama_index.core.bridge.pydantic import Field
+from llama_index.core.node_parser import SemanticSplitterNodeParser
+from llama_index.core.node_parser.node_utils import build_nodes_from_splits
+from llama_index.core.schema import BaseNode, Document
+
+from const import ChunkingMode
+
+SENTENCE_EMBEDDINGS_KEY = "sentence_embeddings"
+
+
+class ContextualSemanticSplitter(SemanticSplitterNodeParser):
+    """
+    Semantic splitter that keeps the sentence group embeddings it computes to
+    find breakpoints. Every node carries the embeddings of its sentence groups
+    in `metadata[SENTENCE_EMBEDDINGS_KEY]` (hidden from the LLM and embedder),
+    so they can be reused instead of embedding the chunk again.
+
+    Documents longer than `large_document_chars` are chunked with
+    `large_document_mode`. The windowed and sampled modes embed only part of
+    the sentences, the default semantic mode splits them like the others.
+    """
+
+    large_document_chars: int = Field(
+        default=50000,
+        description="Documents above this many characters use the large document mode.",
+    )
+    large_document_mode: ChunkingMode = Field(
+        default=ChunkingMode.SEMANTIC,
+        description="How large documents are chunked.",
+    )
+    target_chunk_chars: int = Field(
+        default=2000,
+        description="Chunk size of the windowed mode, in characters.",
+    )
+    refine_sentences: int = Field(
+        default=4,
+        description="Sentences on each side of a windowed boundary considered to move it.",
+    )
+    sample_rate: int = Field(
+        default=4,
+        description="Only every n-th sentence group is embedded in the sampled mode.",
+    )
+    cpu_scheduler: Optional[Any] = Field(
+        default=None,
+        exclude=True,
+        description="CPUScheduler the sentence embeddings are computed in slices of.",
+    )
+
+    @classmethod
+    def class_name(cls) -> str:
+        return "ContextualSemanticSplitter"
+
+    def build_semantic_nodes_from_documents(
+        self,
+        documents: Sequence[Document],
+        show_progress: bool = False,
+    ) -> List[BaseNode]:
+        all_nodes: List[BaseNode] = []
+        for doc in documents:
+            text_splits = self.sentence_splitter(doc.text)
+
+            sentences = self._build_sentence_groups(text_splits)
+            if not sentences:
+                continue
+
+            mode = ChunkingMode.SEMANTIC
+            if len(doc.text) > self.large_document_chars:
+                mode = self.large_document_mode
+
+            if mode == ChunkingMode.WINDOWED:
+                groups = self._build_windowed_groups(sentences, show_progress)
+            elif mode == ChunkingMode.SAMPLED:
+                groups = self._build_sampled_groups(sentences, show_progress)
+            else:
+                groups = self._build_semantic_groups(sentences, show_progress)
+
+            nodes = build_nodes_from_splits(
+                [text for text, _ in groups],
+                doc,
+                id_func=self.id_func,
+            )
+
+            # nodes may share metadata containers with the document, replace them
+            for node, (_, embeddings) in zip(nodes, groups):
+                if not embeddings:
+                    continue
+                node.metadata = {
+                    **node.metadata,
+                    SENTENCE_EMBEDDINGS_KEY: embeddings,
+                }
+                node.excluded_embed_metadata_keys = [
+                    *node.excluded_embed_metadata_keys, SENTENCE_EMBEDDINGS_KEY,
+                ]
+                node.excluded_llm_metadata_keys = [
+                    *node.excluded_llm_metadata_keys, SENTENCE_EMBEDDINGS_KEY,
+                ]
+
+            all_nodes.extend(nodes)
+
+        return all_nodes
+
+    def _embed_sentence_groups(
+        self,
+        sentences: list,
+        indices: List[int],
+        show_progress: bool = False,
+    ) -> Dict[int, List[float]]:
+        """
+        Embed the combined sentences at `indices`, return {index: embedding}.
+        With a CPU scheduler they are embedded one background slice at a time,
+        capped at its slice size while a chat is running.
+        """
+        texts = [sentences[i]["combined_sentence"] for i in indices]
+        if self.cpu_scheduler is None:
+            embeddings = self.embed_model.get_text_embedding_batch(
+                texts, show_progress=show_progress,
+            )
+            return dict(zip(indices, embeddings))
+
+        embeddings = []
+        batch_size = max(1, getattr(self.embed_model, "embed_batch_size", self.cpu_scheduler.slice_items))
+        start = 0
+        while start < len(texts):
+            step = self.cpu_scheduler.slice_size(batch_size)
+            with self.cpu_scheduler.background_slice():
+                embeddings.extend(
+                    self.embed_model.get_text_embedding_batch(texts[start:start + step])
+                )
+            start += step
+        return dict(zip(indices, embeddings))
+
+    def _build_semantic_groups(
+        self,
+        sentences: list,
+        show_progress: bool = False,
+    ) -> List[Tuple[str, List[List[float]]]]:
+        """
+        Embed every sentence group, return (text, sentence group embeddings)
+        for every chunk.
+        """
+        embeddings = self._embed_sentence_groups(
+            sentences, list(range(len(sentences))), show_progress,
+        )
+        for i, embedding in embeddings.items():
+            sentences[i]["combined_sentence_embedding"] = embedding
+
+        distances = self._calculate_distances_between_sentence_groups(sentences)
+
+        return [
+            (text, [s["combined_sentence_embedding"] for s in sentences[start:end]])
+            for text, start, end in self._build_node_groups(sentences, distances)
+        ]
+
+    def _build_windowed_groups(
+        self,
+        sentences: list,
+        show_progress: bool = False,
+    ) -> List[Tuple[str, None]]:
+        """
+        Cut the sentences into chunks of about `target_chunk_chars`, then move
+        every cut to the largest semantic break among the `refine_sentences`
+        sentences around it. Only the sentences around the cuts are embedded.
+        """
+        cuts = []
+        size = 0
+        for i, sentence in enumerate(sentences[:-1]):
+            size += len(sentence["sentence"])
+            if size >= self.target_chunk_chars:
+                # a cut at i + 1 starts a new chunk with sentence i + 1
+                cuts.append(i + 1)
+                size = 0
+
+        # keep every refined cut between the midpoints to its neighbours, so
+        # cuts never cross
+        bounds = [0] + cuts + [len(sentences)]
+        windows = []
+        for j, cut in enumerate(cuts):
+            low = max(cut - self.refine_sentences, (bounds[j] + cut) // 2 + 1, 1)
+            high = min(cut + self.refine_sentences, (cut + bounds[j + 2]) // 2, len(sentences) - 1)
+            windows.append((low, high) if low <= high else (cut, cut))
+
+        needed = sorted({i for low, high in windows for i in range(low - 1, high + 1)})
+        embeddings = self._embed_sentence_groups(sentences, needed, show_progress)
+
+        refined = []
+        for low, high in windows:
+            candidates = list(range(low, high + 1))
+            distances = [
+                _cosine_distance(embeddings[cut - 1], embeddings[cut]) for cut in candidates
+            ]
+            refined.append(candidates[int(np.argmax(distances))])
+
+        bounds = [0] + refined + [len(sentences)]
+        return [
+            ("".join(s["sentence"] for s in sentences[start:end]), None)
+            for start, end in zip(bounds[:-1], bounds[1:]) if end > start
+        ]
+
+    def _build_sampled_groups(
+        self,
+        sentences: list,
+        show_progress: bool = False,
+    ) -> List[Tuple[str, List[List[float]]]]:
+        """
+        Embed every `sample_rate`-th sentence group and break where the
+        distance between consecutive samples is above the percentile
+        threshold, halfway between the two samples.
+        """
+        step = max(1, self.sample_rate)
+        sampled = list(range(0, len(sentences), step))
+        embeddings = self._embed_sentence_groups(sentences, sampled, show_progress)
+
+        if len(sampled) < 2:
+            return [("".join(s["sentence"] for s in sentences), list(embeddings.values()))]
+
+        distances = [
+            _cosine_distance(embeddings[a], embeddings[b])
+            for a, b in zip(sampled[:-1], sampled[1:])
+        ]
+        threshold = np.percentile(distances, self.breakpoint_percentile_threshold)
+
+        cuts = [
+            (a + b + 1) // 2
+            for (a, b), distance in zip(zip(sampled[:-1], sampled[1:]), distances)
+            if distance > threshold
+        ]
+
+        bounds = [0] + cuts + [len(sentences)]
+        return [
+            (
+                "".join(s["sentence"] for s in sentences[start:end]),
+                [embeddings[i] for i in sampled if start <= i < end],
+            )
+            for start, end in zip(bounds[:-1], bounds[1:]) if end > start
+        ]
+
+    def _build_node_groups(
+        self,
+        sentences: list,
+        distances: List[float],
+    ) -> List[Tuple[str, int, int]]:
+        """
+        Same breakpoints as SemanticSplitterNodeParser._build_node_chunks,
+        returning (text, first sentence, end sentence) for every chunk.
+        """
+        if len(distances) == 0:
+            return [(" ".join([s["sentence"] for s in sentences]), 0, len(sentences))]
+
+        breakpoint_distance_threshold = np.percentile(
+            distances, self.breakpoint_percentile_threshold
+        )
+
+        groups = []
+        start_index = 0
+        for index, distance in enumerate(distances):
+            if distance > breakpoint_distance_threshold:
+                groups.append((
+                    "".join([s["sentence"] for s in sentences[start_index:index + 1]]),
+                    start_index,
+                    index + 1,
+                ))
+                start_index = index + 1
+
+        if start_index < len(sentences):
+            groups.append((
+                "".join([s["sentence"] for s in sentences[start_index:]]),
+                start_index,
+                len(sentences),
+            ))
+
+        return groups
+
+
+def pool_embeddings(embeddings: List[List[float]]) -> List[float]:
+    """
+    Return the L2-normalized mean of embeddings.
+    """
+    pooled = np.mean(np.asarray(embeddings, dtype=np.float32), axis=0)
+    norm = np.linalg.norm(pooled)
+    if norm > 0:
+        pooled = pooled / norm
+    return pooled.tolist()
+
+
+def _cosine_distance(a: List[float], b: List[float]) -> float:
+    a = np.asarray(a, dtype=np.float32)
+    b = np.asarray(b, dtype=np.float32)
+    return 1.0 - float(np.dot(a, b) / max(np.linalg.norm(a) * np.linalg.norm(b), 1e-12))
@@ -0,0 +1,176 @@
+import time
+import threading
+import numpy as np
+
+from collections import OrderedDict
+from typing import List, Optional
+
+from utils.metrics import get_metrics
+
+metrics = get_metrics()
+
+
+class _ChatbotAnswers:
+    def __init__(self, fingerprint: str, dim: int, capacity: int):
+        self.fingerprint = fingerprint
+        self.vectors = np.zeros((capacity, dim), dtype=np.float32)
+        self.last_used = np.zeros(capacity, dtype=np.float64)
+        self.queries: List[str] = [None] * capacity
+        self.answers: List[str] = [None] * capacity
+        self.count = 0
+
+
+class SemanticAnswerCache:
+    def __init__(
+        self,
+        threshold: float = 0.95,
+        max_entries: int = 1000,
+        max_chatbots: int = 256,
+        name: str = "answer",
+    ):
+        """
+        In-memory cache of chatbot answers, looked up by query embedding.
+
+        Every chatbot has a fixed-size matrix of normalized query vectors
+        scanned with one matrix product. An entry is returned when its
+        cosine similarity with the query reaches `threshold` and the
+        chatbot's document fingerprint is unchanged, otherwise the answers
+        of that chatbot are dropped. The least recently used answer of a
+        full chatbot and the least recently used chatbot are evicted.
+
+        Args:
+            threshold (float): The cosine similarity from which a cached answer is reused.
+            max_entries (int): The number of answers kept per chatbot.
+            max_chatbots (int): The number of chatbots with cached answers.
+            name (str): The name used for the hit/miss metrics.
+        """
+        self.threshold = threshold
+        self.max_entries = max(1, max_entries)
+        self.max_chatbots = max(1, max_chatbots)
+        self.name = name
+        self.hits = 0
+        self.misses = 0
+
+        self._lock = threading.Lock()
+        self._chatbots: "OrderedDict[str, _ChatbotAnswers]" = OrderedDict()
+
+    @staticmethod
+    def _normalize(embedding: List[float]) -> np.ndarray:
+        vector = np.asarray(embedding, dtype=np.float32)
+        return vector / max(float(np.linalg.norm(vector)), 1e-12)
+
+    def _entries(self, chatbot_id: str, fingerprint: str) -> Optional[_ChatbotAnswers]:
+        entries = self._chatbots.get(chatbot_id)
+        if entries is None:
+            return None
+        if entries.fingerprint != fingerprint:
+            # the documents of the chatbot changed, its answers may be stale
+            del self._chatbots[chatbot_id]
+            metrics.inc("answer_cache_invalidations_total")
+            return None
+        self._chatbots.move_to_end(chatbot_id)
+        return entries
+
+    def _best(self, entries: _ChatbotAnswers, vector: np.ndarray):
+        if entries.count == 0:
+            return None, 0.0
+        similarities = entries.vectors[:entries.count] @ vector
+        best = int(np.argmax(similarities))
+        return best, float(similarities[best])
+
+    def lookup(
+        self,
+        chatbot_id: str,
+        fingerprint: str,
+        embedding: List[float],
+    ) -> Optional[dict]:
+        """
+        Return {"query", "answer", "similarity"} of the closest cached answer
+        of the chatbot, None on a miss.
+        """
+        vector = self._normalize(embedding)
+        result = None
+        with self._lock:
+            entries = self._entries(chatbot_id, fingerprint)
+            if entries is not None and entries.vectors.shape[1] == vector.shape[0]:
+                best, similarity = self._best(entries, vector)
+                if best is not None and similarity >= self.threshold:
+                    entries.last_used[best] = time.monotonic()
+                    result = {
+                        "query": entries.queries[best],
+                        "answer": entries.answers[best],
+                        "similarity": similarity,
+                    }
+
+            if result is not None:
+                self.hits += 1
+            else:
+                self.misses += 1
+
+        if result is not None:
+            metrics.inc("cache_hits_total", cache=self.name)
+        else:
+            metrics.inc("cache_misses_total", cache=self.name)
+        return result
+
+    def store(
+        self,
+        chatbot_id: str,
+        fingerprint: str,
+        embedding: List[float],
+        query: str,
+        answer: str,
+    ):
+        """
+        Cache the answer given to a query of the chatbot.
+        """
+        vector = self._normalize(embedding)
+        with self._lock:
+            entries = self._entries(chatbot_id, fingerprint)
+            if entries is None or entries.vectors.shape[1] != vector.shape[0]:
+                entries = _ChatbotAnswers(fingerprint, vector.shape[0], self.max_entries)
+                self._chatbots[chatbot_id] = entries
+                while len(self._chatbots) > self.max_chatbots:
+                    self._chatbots.popitem(last=False)
+
+            best, similarity = self._best(entries, vector)
+            if best is not None and similarity >= self.threshold:
+                # an equivalent query was answered meanwhile, refresh it
+                row = best
+            elif entries.count < self.max_entries:
+                row = entries.count
+                entries.count += 1
+            else:
+                row = int(np.argmin(entries.last_used))
+                metrics.inc("cache_evictions_total", cache=self.name)
+
+            entries.vectors[row] = vector
+            entries.last_used[row] = time.monotonic()
+            entries.queries[row] = query
+            entries.answers[row] = answer
+
+            size = sum(entries.count for entries in self._chatbots.values())
+        metrics.set("answer_cache_entries", size)
+
+    def invalidate(self, chatbot_id: str):
+        """
+        Drop the cached answers of a chatbot.
+        """
+        with self._lock:
+            self._chatbots.pop(chatbot_id, None)
+
+    def stats(self) -> dict:
+        """
+        Return hit/miss counters and the number of cached answers.
+        """
+        with self._lock:
+            entries = sum(entries.count for entries in self._chatbots.values())
+            chatbots = len(self._chatbots)
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0,
+            "entries": entries,
+            "chatbots": chatbots,
+        }
@@ -0,0 +1,46 @@
+import os
+import tarfile
+import zipfile
+
+from typing import BinaryIO, Iterator, Tuple
+
+ARCHIVE_EXTENSIONS = (".zip", ".tar", ".tar.gz", ".tgz", ".tar.bz2", ".tar.xz")
+
+
+def is_archive(file_name: str) -> bool:
+    """
+    Check whether a file name looks like a zip or tar archive.
+    """
+    return file_name.lower().endswith(ARCHIVE_EXTENSIONS)
+
+
+def iter_archive(file_path: str) -> Iterator[Tuple[str, int, BinaryIO]]:
+    """
+    Yield (name, size, file object) for every regular file of a zip or tar
+    archive, one at a time and without extracting the archive. A file object
+    is only valid until the next entry is requested.
+    """
+    if zipfile.is_zipfile(file_path):
+        with zipfile.ZipFile(file_path) as archive:
+            for info in archive.infolist():
+                if info.is_dir() or _is_hidden(info.filename):
+                    continue
+                with archive.open(info) as f:
+                    yield info.filename, info.file_size, f
+        return
+
+    # stream mode reads the members in order, compressed or not
+    with tarfile.open(file_path, mode="r|*") as archive:
+        for member in archive:
+            if not member.isfile() or _is_hidden(member.name):
+                continue
+            f = archive.extractfile(member)
+            if f is None:
+                continue
+            yield member.name, member.size, f
+
+
+def _is_hidden(name: str) -> bool:
+    # macOS resource forks and dot files are not documents
+    parts = name.replace("\\", "/").split("/")
+    return "__MACOSX" in parts or os.path.basename(name).startswith(".")
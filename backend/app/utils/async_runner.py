@@ -0,0 +1,46 @@
+import asyncio
+import contextvars
+import threading
+
+from typing import Any, Coroutine
+
+_loop = None
+_lock = threading.Lock()
+
+
+def _get_loop() -> asyncio.AbstractEventLoop:
+    """
+    Return the background event loop, starting it on first use.
+    """
+    global _loop
+    with _lock:
+        if _loop is None or _loop.is_closed():
+            _loop = asyncio.new_event_loop()
+            threading.Thread(
+                target=_loop.run_forever,
+                name="async-runner",
+                daemon=True,
+            ).start()
+    return _loop
+
+
+async def _run_in_context(context: contextvars.Context, coro: Coroutine) -> Any:
+    for var, value in context.items():
+        var.set(value)
+    return await coro
+
+
+def run_async(coro: Coroutine) -> Any:
+    """
+    Run a coroutine from synchronous code and wait for its result.
+
+    The coroutine runs on a long-lived background loop, so this works from
+    inside FastAPI handlers (where a loop is already running) and async
+    clients cached by the LLM stay bound to a single loop. Context variables
+    of the caller are carried over to the coroutine.
+    """
+    future = asyncio.run_coroutine_threadsafe(
+        _run_in_context(contextvars.copy_context(), coro),
+        _get_loop(),
+    )
+    return future.result()
@@ -1,3 +1,5 @@
+import mimetypes
+
 from tempfile import SpooledTemporaryFile
 from const import SUPPORTED_FILE_TYPES
 
@@ -11,4 +13,16 @@ def check_upload_file(
         return False
     
     return True
-    
\ No newline at end of file
+
+
+def check_file_name(
+    file_name: str,
+) -> bool:
+    """
+    Check a file name, for files that come without a content type.
+    """
+    content_type, _ = mimetypes.guess_type(file_name)
+    if content_type not in SUPPORTED_FILE_TYPES:
+        return False
+    
+    return True
@@ -0,0 +1,145 @@
+import time
+import threading
+
+from collections import deque
+from contextlib import contextmanager
+
+from utils.logger import get_logger
+from utils.metrics import get_metrics
+
+logger = get_logger()
+metrics = get_metrics()
+
+
+class CPUScheduler:
+    def __init__(
+        self,
+        slice_items: int = 16,
+        max_defer: float = 1.0,
+        latency_slo: float = 0.0,
+        max_throttle: float = 4.0,
+        window: int = 50,
+    ):
+        """
+        Share the CPU between chat and background ingestion in one process.
+
+        Chat-path work runs inside `foreground()`. Background work is cut
+        into slices, of at most `slice_items` items while chat work is
+        running (see `slice_size()`), each run inside
+        `background_slice()`: a slice waits (up to `max_defer` seconds) while
+        chat work is running, and when the p95 of the recent chat latencies
+        misses `latency_slo` it also sleeps after every slice, for a multiple
+        of the slice time that doubles while the SLO is missed and halves
+        once it is met again.
+
+        Args:
+            slice_items (int): The number of items in a background slice while chat work is running.
+            max_defer (float): The longest a slice waits for chat work, in seconds.
+            latency_slo (float): The p95 chat latency target in seconds, 0 disables throttling.
+            max_throttle (float): The largest sleep after a slice, as a multiple of its duration.
+            window (int): The number of recent chat latencies the p95 is computed on.
+        """
+        self.slice_items = max(1, slice_items)
+        self.max_defer = max_defer
+        self.latency_slo = latency_slo
+        self.max_throttle = max_throttle
+
+        self._cond = threading.Condition()
+        self._foreground = 0
+        self._latencies = deque(maxlen=max(1, window))
+        self._throttle = 0.0
+
+    @property
+    def throttle(self) -> float:
+        return self._throttle
+
+    @contextmanager
+    def foreground(self):
+        """
+        Run chat-path work, background slices hold back until it is done and
+        its latency counts towards the SLO.
+        """
+        with self._cond:
+            self._foreground += 1
+            metrics.set("cpu_scheduler_foreground_active", self._foreground)
+
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            with self._cond:
+                self._foreground -= 1
+                metrics.set("cpu_scheduler_foreground_active", self._foreground)
+                self._cond.notify_all()
+            self._observe(elapsed)
+
+    def slice_size(self, batch_size: int) -> int:
+        """
+        Return the size of the next background batch: `batch_size`, capped
+        at `slice_items` while chat work is running.
+        """
+        with self._cond:
+            busy = self._foreground > 0
+        return min(batch_size, self.slice_items) if busy else batch_size
+
+    @contextmanager
+    def background_slice(self):
+        """
+        Run one slice of background work, after any running chat work and
+        followed by the throttle sleep.
+        """
+        self._yield_to_foreground()
+
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            metrics.inc("cpu_scheduler_slices_total")
+            metrics.observe("cpu_scheduler_slice_seconds", elapsed)
+
+            throttle = self._throttle
+            if throttle > 0:
+                pause = elapsed * throttle
+                metrics.observe("cpu_scheduler_throttle_seconds", pause)
+                time.sleep(pause)
+
+    def _yield_to_foreground(self):
+        start = time.perf_counter()
+        deadline = time.monotonic() + self.max_defer
+        with self._cond:
+            while self._foreground > 0:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    # do not starve ingestion under a steady chat load
+                    break
+                self._cond.wait(remaining)
+
+        waited = time.perf_counter() - start
+        if waited > 0.001:
+            metrics.observe("cpu_scheduler_deferred_seconds", waited)
+
+    def _observe(self, seconds: float):
+        metrics.observe("chat_cpu_latency_seconds", seconds)
+        if self.latency_slo <= 0:
+            return
+
+        with self._cond:
+            self._latencies.append(seconds)
+            latencies = sorted(self._latencies)
+            p95 = latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))]
+
+            previous = self._throttle
+            if p95 > self.latency_slo:
+                self._throttle = min(self.max_throttle, max(0.25, self._throttle * 2))
+            elif self._throttle > 0:
+                self._throttle = self._throttle / 2 if self._throttle > 0.25 else 0.0
+            throttle = self._throttle
+
+        metrics.set("cpu_scheduler_throttle", throttle)
+        if throttle != previous and (throttle == 0 or previous == 0):
+            logger.info(
+                f"Chat p95 latency {p95:.3f}s vs SLO {self.latency_slo:.3f}s, "
+                f"background throttle {previous:.2f} -> {throttle:.2f}"
+            )
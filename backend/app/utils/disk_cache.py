@@ -0,0 +1,206 @@
+import os
+import sqlite3
+import threading
+import time
+
+from typing import Dict, List, Optional
+
+from utils.logger import get_logger
+from utils.metrics import get_metrics
+
+logger = get_logger()
+metrics = get_metrics()
+
+
+class DiskCache:
+    def __init__(
+        self,
+        path: str,
+        name: str,
+        max_bytes: int = 1024 * 1024 * 1024,
+        ttl: Optional[float] = None,
+    ):
+        """
+        Persistent key-value cache stored in a SQLite file.
+
+        Entries are evicted least recently used first once the stored values
+        exceed `max_bytes`, and are ignored once they are older than `ttl`.
+
+        Args:
+            path (str): The SQLite file.
+            name (str): The name used for the hit/miss metrics.
+            max_bytes (int): The maximum size of the stored values.
+            ttl (float, optional): The lifetime of an entry in seconds, None keeps entries forever.
+        """
+        self.path = path
+        self.name = name
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL;")
+        self._conn.execute("PRAGMA synchronous=NORMAL;")
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS entries (
+                key TEXT PRIMARY KEY,
+                value BLOB NOT NULL,
+                size INTEGER NOT NULL,
+                created_at REAL NOT NULL,
+                accessed_at REAL NOT NULL
+            );
+            """
+        )
+        self._conn.execute(
+            "CREATE INDEX IF NOT EXISTS entries_accessed_at_idx ON entries (accessed_at);"
+        )
+        self._conn.commit()
+        self._size = self._conn.execute(
+            "SELECT COALESCE(SUM(size), 0) FROM entries;"
+        ).fetchone()[0]
+
+        logger.info(f"Loaded {name} cache from {path} ({self._size} bytes)")
+
+    def get(self, key: str) -> Optional[bytes]:
+        """
+        Return the value stored for key, None on a miss.
+        """
+        return self.get_many([key]).get(key)
+
+    def get_many(self, keys: List[str]) -> Dict[str, bytes]:
+        """
+        Return {key: value} for the keys found in the cache.
+        """
+        found = {}
+        if not keys:
+            return found
+
+        now = time.time()
+        unique_keys = list(dict.fromkeys(keys))
+        with self._lock:
+            for start in range(0, len(unique_keys), 500):
+                batch = unique_keys[start:start + 500]
+                placeholders = ", ".join(["?"] * len(batch))
+                rows = self._conn.execute(
+                    f"SELECT key, value, created_at FROM entries WHERE key IN ({placeholders});",
+                    batch,
+                ).fetchall()
+                expired = []
+                for key, value, created_at in rows:
+                    if self.ttl is not None and now - created_at > self.ttl:
+                        expired.append(key)
+                        continue
+                    found[key] = value
+                if expired:
+                    self._delete(expired)
+                if found:
+                    self._conn.executemany(
+                        "UPDATE entries SET accessed_at = ? WHERE key = ?;",
+                        [(now, key) for key in batch if key in found],
+                    )
+            self._conn.commit()
+
+            hits = sum(1 for key in keys if key in found)
+            self.hits += hits
+            self.misses += len(keys) - hits
+
+        metrics.inc("cache_hits_total", hits, cache=self.name)
+        metrics.inc("cache_misses_total", len(keys) - hits, cache=self.name)
+
+        return found
+
+    def set(self, key: str, value: bytes):
+        """
+        Store a value.
+        """
+        self.set_many({key: value})
+
+    def set_many(self, items: Dict[str, bytes]):
+        """
+        Store several values, evicting old entries if the cache is full.
+        """
+        if not items:
+            return
+
+        now = time.time()
+        with self._lock:
+            keys = list(items.keys())
+            for start in range(0, len(keys), 500):
+                batch = keys[start:start + 500]
+                placeholders = ", ".join(["?"] * len(batch))
+                replaced = self._conn.execute(
+                    f"SELECT COALESCE(SUM(size), 0) FROM entries WHERE key IN ({placeholders});",
+                    batch,
+                ).fetchone()[0]
+                self._conn.executemany(
+                    """
+                    INSERT OR REPLACE INTO entries (key, value, size, created_at, accessed_at)
+                    VALUES (?, ?, ?, ?, ?);
+                    """,
+                    [(key, items[key], len(items[key]), now, now) for key in batch],
+                )
+                self._size += sum(len(items[key]) for key in batch) - replaced
+            self._evict()
+            self._conn.commit()
+
+        metrics.set("cache_size_bytes", self._size, cache=self.name)
+
+    def _delete(self, keys: List[str]):
+        placeholders = ", ".join(["?"] * len(keys))
+        freed = self._conn.execute(
+            f"SELECT COALESCE(SUM(size), 0) FROM entries WHERE key IN ({placeholders});",
+            keys,
+        ).fetchone()[0]
+        self._conn.execute(f"DELETE FROM entries WHERE key IN ({placeholders});", keys)
+        self._size -= freed
+
+    def _evict(self):
+        """
+        Drop least recently used entries until the cache is below 90% of max_bytes.
+        """
+        if self._size <= self.max_bytes:
+            return
+
+        target = int(self.max_bytes * 0.9)
+        evicted = 0
+        while self._size > target:
+            rows = self._conn.execute(
+                "SELECT key, size FROM entries ORDER BY accessed_at ASC LIMIT 500;"
+            ).fetchall()
+            if not rows:
+                self._size = 0
+                break
+            keys = []
+            for key, size in rows:
+                keys.append(key)
+                self._size -= size
+                if self._size <= target:
+                    break
+            self._conn.execute(
+                f"DELETE FROM entries WHERE key IN ({', '.join(['?'] * len(keys))});",
+                keys,
+            )
+            evicted += len(keys)
+
+        metrics.inc("cache_evictions_total", evicted, cache=self.name)
+        logger.info(f"Evicted {evicted} entries from {self.name} cache")
+
+    def stats(self) -> dict:
+        """
+        Return hit/miss counters and the stored size.
+        """
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0,
+            "size_bytes": self._size,
+            "max_bytes": self.max_bytes,
+        }
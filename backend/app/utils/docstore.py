@@ -0,0 +1,135 @@
+import os
+import json
+import mmap
+import threading
+
+from typing import Dict, Iterable, List, Tuple
+
+from utils.logger import get_logger
+from utils.metrics import get_metrics
+
+logger = get_logger()
+metrics = get_metrics()
+
+
+class MmapDocstore:
+    def __init__(self, path: str):
+        """
+        Append-only store of chunk sources read through a memory map.
+
+        Records are appended to `<path>.data` and their (offset, length) to
+        `<path>.index`, which is loaded into memory on start. Deletions
+        append a tombstone and replaced records stay in the data file. A
+        record is always written before its index line, so a crash can at
+        worst lose the last records, never point at a torn one.
+
+        Args:
+            path (str): The path prefix of the data and index files.
+        """
+        self.path = path
+        self.data_path = f"{path}.data"
+        self.index_path = f"{path}.index"
+
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        self._lock = threading.Lock()
+        self._offsets: Dict[str, Tuple[int, int]] = {}
+        self._data = open(self.data_path, "a+b")
+        self._index = open(self.index_path, "a", encoding="utf-8")
+        self._map = None
+        self._size = 0
+        self._load()
+
+        logger.info(f"Loaded docstore from {path} ({len(self._offsets)} records, {self._size} bytes)")
+
+    def __len__(self) -> int:
+        return len(self._offsets)
+
+    def _load(self):
+        self._data.seek(0, os.SEEK_END)
+        self._size = self._data.tell()
+        with open(self.index_path, "rb") as f:
+            content = f.read()
+        end = content.rfind(b"\n") + 1
+        if end < len(content):
+            # last line of a write cut short by a crash, later appends must
+            # not be glued to it
+            logger.warning(f"Dropping a truncated line at the end of {self.index_path}")
+            with open(self.index_path, "r+b") as f:
+                f.truncate(end)
+
+        for line in content[:end].decode("utf-8").split("\n")[:-1]:
+            id, offset, length = line.rsplit("\t", 2)
+            offset, length = int(offset), int(length)
+            if offset < 0:
+                self._offsets.pop(id, None)
+            elif offset + length <= self._size:
+                self._offsets[id] = (offset, length)
+        self._remap()
+
+    def _remap(self):
+        if self._map is not None:
+            self._map.close()
+            self._map = None
+        if self._size > 0:
+            self._map = mmap.mmap(self._data.fileno(), self._size, access=mmap.ACCESS_READ)
+
+    def put_many(self, sources: Dict[str, dict]):
+        """
+        Store {id: source}, replacing the sources already stored for these ids.
+        """
+        if not sources:
+            return
+
+        with self._lock:
+            records = []
+            end = self._size
+            for id, source in sources.items():
+                value = json.dumps(source, ensure_ascii=False).encode("utf-8")
+                records.append((id, end, len(value), value))
+                end += len(value)
+
+            self._data.seek(0, os.SEEK_END)
+            self._data.write(b"".join(value for _, _, _, value in records))
+            self._data.flush()
+            self._index.write("".join(f"{id}\t{offset}\t{length}\n" for id, offset, length, _ in records))
+            self._index.flush()
+
+            for id, offset, length, _ in records:
+                self._offsets[id] = (offset, length)
+            self._size = end
+            self._remap()
+
+        metrics.set("docstore_records", len(self._offsets))
+        metrics.set("docstore_bytes", self._size)
+
+    def get_many(self, ids: Iterable[str]) -> Dict[str, dict]:
+        """
+        Return {id: source} for the ids found in the store.
+        """
+        found = {}
+        with self._lock:
+            for id in ids:
+                location = self._offsets.get(id)
+                if location is None:
+                    continue
+                offset, length = location
+                found[id] = self._map[offset:offset + length]
+
+        sources = {id: json.loads(value) for id, value in found.items()}
+        metrics.inc("docstore_hits_total", len(sources))
+        return sources
+
+    def delete(self, ids: List[str]):
+        """
+        Forget the sources of the ids, missing ids are ignored.
+        """
+        with self._lock:
+            removed = [id for id in ids if self._offsets.pop(id, None) is not None]
+            if removed:
+                self._index.write("".join(f"{id}\t-1\t0\n" for id in removed))
+                self._index.flush()
+
+        metrics.set("docstore_records", len(self._offsets))
@@ -0,0 +1,51 @@
+from typing import Dict, List, Tuple
+
+Ranking = List[Tuple[str, float]]
+
+
+def reciprocal_rank_fusion(
+    rankings: Dict[str, Ranking],
+    weights: Dict[str, float],
+    k: int = 60,
+) -> Ranking:
+    """
+    Fuse rankings by summing weight / (k + rank) over the sources an id
+    appears in. Scores are ignored, only the order of each ranking matters.
+
+    Args:
+        rankings (Dict[str, Ranking]): The (id, score) lists per source, best first.
+        weights (Dict[str, float]): The weight of every source, 1 when missing.
+        k (int): The rank offset, larger values flatten the difference between ranks.
+    """
+    fused: Dict[str, float] = {}
+    for source, ranking in rankings.items():
+        weight = weights.get(source, 1.0)
+        for rank, (id, _) in enumerate(ranking, start=1):
+            fused[id] = fused.get(id, 0.0) + weight / (k + rank)
+    return sorted(fused.items(), key=lambda item: item[1], reverse=True)
+
+
+def weighted_score_fusion(
+    rankings: Dict[str, Ranking],
+    weights: Dict[str, float],
+) -> Ranking:
+    """
+    Fuse rankings by summing the weighted scores of every source, min-max
+    normalized per source so BM25 and vector scores are comparable. Higher
+    scores must be better in every ranking.
+
+    Args:
+        rankings (Dict[str, Ranking]): The (id, score) lists per source, best first.
+        weights (Dict[str, float]): The weight of every source, 1 when missing.
+    """
+    fused: Dict[str, float] = {}
+    for source, ranking in rankings.items():
+        if not ranking:
+            continue
+        weight = weights.get(source, 1.0)
+        scores = [score for _, score in ranking]
+        low, high = min(scores), max(scores)
+        for id, score in ranking:
+            normalized = (score - low) / (high - low) if high > low else 1.0
+            fused[id] = fused.get(id, 0.0) + weight * normalized
+    return sorted(fused.items(), key=lambda item: item[1], reverse=True)
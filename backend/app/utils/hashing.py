@@ -0,0 +1,22 @@
+import hashlib
+
+
+def copy_with_hash(fsrc, fdst, chunk_size: int = 1024 * 1024) -> str:
+    """
+    Copy a file object into another one and return the sha256 of the content.
+    """
+    digest = hashlib.sha256()
+    while True:
+        buffer = fsrc.read(chunk_size)
+        if not buffer:
+            break
+        digest.update(buffer)
+        fdst.write(buffer)
+    return digest.hexdigest()
+
+
+def hash_text(text: str) -> str:
+    """
+    Return the sha256 of a text.
+    """
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
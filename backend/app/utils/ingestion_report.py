@@ -0,0 +1,112 @@
+import time
+import threading
+import contextvars
+
+from contextlib import contextmanager
+from typing import Dict, Iterable, Iterator, Optional
+
+from utils.metrics import get_metrics
+
+metrics = get_metrics()
+
+_current_report: contextvars.ContextVar = contextvars.ContextVar("ingestion_report", default=None)
+
+
+class IngestionReport:
+    def __init__(self):
+        """
+        Per-stage timings and counters of one ingestion job. Stages that run
+        several times (once per window, per batch or per LLM call) are summed.
+        """
+        self._lock = threading.Lock()
+        self.started_at = time.time()
+        self.stages: Dict[str, Dict[str, float]] = {}
+
+    def add(self, stage: str, seconds: float = 0.0, **counts):
+        """
+        Add the time and counts of one run of a stage.
+        """
+        with self._lock:
+            record = self.stages.setdefault(stage, {"seconds": 0.0, "runs": 0})
+            record["seconds"] += seconds
+            record["runs"] += 1
+            for key, value in counts.items():
+                record[key] = record.get(key, 0) + value
+
+    def to_dict(self) -> dict:
+        with self._lock:
+            return {
+                "total_seconds": time.time() - self.started_at,
+                "stages": {name: dict(record) for name, record in self.stages.items()},
+            }
+
+
+def get_report() -> Optional[IngestionReport]:
+    """
+    Return the report of the ingestion job running in this context, if any.
+    """
+    return _current_report.get()
+
+
+@contextmanager
+def report_scope(report: IngestionReport):
+    """
+    Make `report` the current report, stages recorded inside the block (and
+    in coroutines started with run_async) are added to it.
+    """
+    token = _current_report.set(report)
+    try:
+        yield report
+    finally:
+        _current_report.reset(token)
+
+
+def record_stage(stage: str, seconds: float, **counts):
+    """
+    Record one run of a stage in the metrics and the current report.
+    """
+    metrics.observe("ingestion_stage_seconds", seconds, stage=stage)
+    for key, value in counts.items():
+        metrics.inc(f"ingestion_stage_{key}_total", value, stage=stage)
+
+    report = _current_report.get()
+    if report is not None:
+        report.add(stage, seconds, **counts)
+
+
+@contextmanager
+def ingestion_stage(stage: str, **counts):
+    """
+    Time a block as one run of a stage. The yielded dict can be filled with
+    counts (items, bytes, tokens, ...) known only inside the block.
+    """
+    start = time.perf_counter()
+    try:
+        yield counts
+    finally:
+        record_stage(stage, time.perf_counter() - start, **counts)
+
+
+def timed_sections(stage: str, sections: Iterable[str]) -> Iterator[str]:
+    """
+    Yield the sections, recording the time spent producing them, their
+    number and their size in bytes as one run of a stage.
+    """
+    seconds = 0.0
+    items = 0
+    size = 0
+    iterator = iter(sections)
+    try:
+        while True:
+            start = time.perf_counter()
+            try:
+                section = next(iterator)
+            except StopIteration:
+                break
+            finally:
+                seconds += time.perf_counter() - start
+            items += 1
+            size += len(section.encode("utf-8"))
+            yield section
+    finally:
+        record_stage(stage, seconds, items=items, bytes=size)
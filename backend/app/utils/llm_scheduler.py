@@ -0,0 +1,319 @@
+import time
+import asyncio
+import threading
+import contextvars
+
+from collections import OrderedDict, deque
+from contextlib import contextmanager
+from typing import Dict, Optional
+
+from const import LLMPriority
+from utils.logger import get_logger
+from utils.metrics import get_metrics
+
+logger = get_logger()
+metrics = get_metrics()
+
+DEFAULT_TENANT = "default"
+
+_current_scope: contextvars.ContextVar = contextvars.ContextVar("llm_scope", default=None)
+
+
+@contextmanager
+def llm_scope(priority: LLMPriority, tenant: str = None):
+    """
+    Run the LLM calls made inside the block (and in coroutines started with
+    run_async) with the given priority, queued under the given tenant.
+    """
+    token = _current_scope.set((priority, tenant or DEFAULT_TENANT))
+    try:
+        yield
+    finally:
+        _current_scope.reset(token)
+
+
+def current_scope():
+    """
+    Return (priority, tenant) of the running context, chat by default.
+    """
+    return _current_scope.get() or (LLMPriority.CHAT, DEFAULT_TENANT)
+
+
+class _Bucket:
+    def __init__(self, per_minute: int):
+        """
+        Token bucket refilled continuously at `per_minute` units per minute,
+        holding at most one minute worth of units.
+        """
+        self.capacity = float(per_minute)
+        self.rate = per_minute / 60.0
+        self.level = self.capacity
+        self.updated_at = time.monotonic()
+
+    def refill(self, now: float):
+        self.level = min(self.capacity, self.level + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+
+    def wait_time(self, amount: float, floor: float) -> float:
+        """
+        Seconds until `amount` can be taken while keeping `floor` units.
+        """
+        missing = amount + floor - self.level
+        return 0.0 if missing <= 0 else missing / self.rate
+
+
+class Ticket:
+    __slots__ = (
+        "priority", "tenant", "tokens", "enqueued_at",
+        "granted", "_event", "_loop", "_future",
+    )
+
+    def __init__(self, priority: LLMPriority, tenant: str, tokens: int):
+        self.priority = priority
+        self.tenant = tenant
+        self.tokens = tokens
+        self.enqueued_at = time.monotonic()
+        self.granted = False
+        self._event = None
+        self._loop = None
+        self._future = None
+
+    def _grant(self):
+        self.granted = True
+        if self._future is not None:
+            self._loop.call_soon_threadsafe(_resolve, self._future)
+        else:
+            self._event.set()
+
+
+def _resolve(future: asyncio.Future):
+    if not future.done():
+        future.set_result(None)
+
+
+class LLMScheduler:
+    def __init__(
+        self,
+        requests_per_minute: int = 0,
+        tokens_per_minute: int = 0,
+        max_concurrency: int = 0,
+        chat_reserve: float = 0.2,
+    ):
+        """
+        Process-wide admission control for LLM calls.
+
+        Calls wait in one queue per priority class. Chat is always served
+        before ingestion, and inside a class the tenants are served round
+        robin so one large upload cannot hold back the others. A call is
+        admitted when the request and token buckets and the concurrency
+        limit allow it; lower priorities must also leave `chat_reserve` of
+        every limit free, so a chat arriving after an ingestion burst does
+        not wait for the buckets to refill.
+
+        Args:
+            requests_per_minute (int): The request limit, 0 for none.
+            tokens_per_minute (int): The token limit, 0 for none.
+            max_concurrency (int): The number of calls in flight, 0 for no limit.
+            chat_reserve (float): The share of every limit kept for chat.
+        """
+        self.requests = _Bucket(requests_per_minute) if requests_per_minute > 0 else None
+        self.tokens = _Bucket(tokens_per_minute) if tokens_per_minute > 0 else None
+        self.max_concurrency = max_concurrency
+        self.chat_reserve = min(max(chat_reserve, 0.0), 1.0)
+
+        self._cond = threading.Condition()
+        self._queues: Dict[LLMPriority, "OrderedDict[str, deque]"] = {
+            priority: OrderedDict() for priority in LLMPriority
+        }
+        self._in_flight = 0
+        # nothing is admitted before this time, set after a 429
+        self._paused_until = 0.0
+
+        self._dispatcher = threading.Thread(target=self._dispatch_loop, daemon=True)
+        self._dispatcher.start()
+
+    def acquire(self, tokens: int) -> Ticket:
+        """
+        Block until a call of about `tokens` tokens may run, with the priority
+        and tenant of the running context.
+        """
+        ticket = self._enqueue(tokens)
+        ticket._event = threading.Event()
+        self._submit(ticket)
+        ticket._event.wait()
+        self._admitted(ticket)
+        return ticket
+
+    async def aacquire(self, tokens: int) -> Ticket:
+        """
+        Wait, without blocking the event loop, until a call may run.
+        """
+        ticket = self._enqueue(tokens)
+        ticket._loop = asyncio.get_running_loop()
+        ticket._future = ticket._loop.create_future()
+        self._submit(ticket)
+        try:
+            await ticket._future
+        except asyncio.CancelledError:
+            with self._cond:
+                if not ticket.granted:
+                    self._remove(ticket)
+                    self._update_gauges()
+                    raise
+            self.release(ticket)
+            raise
+        self._admitted(ticket)
+        return ticket
+
+    def release(self, ticket: Ticket, tokens: Optional[int] = None):
+        """
+        Mark a call as finished. `tokens` is its real usage when known, the
+        difference with the estimate is charged to (or refunded from) the
+        token bucket.
+        """
+        with self._cond:
+            self._in_flight -= 1
+            if self.tokens is not None and tokens is not None:
+                self.tokens.level = min(self.tokens.capacity, self.tokens.level - (tokens - ticket.tokens))
+            self._cond.notify()
+
+        metrics.inc("llm_scheduler_requests_total", priority=ticket.priority)
+        if tokens:
+            metrics.inc("llm_scheduler_tokens_total", tokens, priority=ticket.priority)
+
+    def pause(self, seconds: float):
+        """
+        Stop admitting calls for a while, after the provider rejected one.
+        """
+        with self._cond:
+            self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+            logger.warning(f"LLM provider is rate limiting, pausing the scheduler for {seconds:.1f}s")
+        metrics.inc("llm_scheduler_rate_limited_total")
+
+    def stats(self) -> dict:
+        with self._cond:
+            return {
+                "in_flight": self._in_flight,
+                "queued": {
+                    str(priority): sum(len(tickets) for tickets in queue.values())
+                    for priority, queue in self._queues.items()
+                },
+                "requests_available": None if self.requests is None else self.requests.level,
+                "tokens_available": None if self.tokens is None else self.tokens.level,
+            }
+
+    def _enqueue(self, tokens: int) -> Ticket:
+        priority, tenant = current_scope()
+        if self.tokens is not None:
+            # a call larger than the usable part of the bucket would never be admitted
+            reserve = 0.0 if priority == LLMPriority.CHAT else self.chat_reserve
+            tokens = min(tokens, int(self.tokens.capacity * (1 - reserve)))
+        return Ticket(priority, tenant, tokens)
+
+    def _submit(self, ticket: Ticket):
+        with self._cond:
+            self._queues[ticket.priority].setdefault(ticket.tenant, deque()).append(ticket)
+            self._update_gauges()
+            self._cond.notify()
+
+    def _admitted(self, ticket: Ticket):
+        metrics.observe(
+            "llm_scheduler_wait_seconds",
+            time.monotonic() - ticket.enqueued_at,
+            priority=ticket.priority,
+        )
+
+    def _remove(self, ticket: Ticket):
+        queue = self._queues[ticket.priority]
+        tickets = queue.get(ticket.tenant)
+        if tickets is not None and ticket in tickets:
+            tickets.remove(ticket)
+            if not tickets:
+                del queue[ticket.tenant]
+
+    def _update_gauges(self):
+        for priority, queue in self._queues.items():
+            metrics.set(
+                "llm_scheduler_queue_depth",
+                sum(len(tickets) for tickets in queue.values()),
+                priority=priority,
+            )
+        metrics.set("llm_scheduler_in_flight", self._in_flight)
+
+    def _dispatch_loop(self):
+        with self._cond:
+            while True:
+                timeout = self._dispatch()
+                self._cond.wait(timeout)
+
+    def _dispatch(self) -> Optional[float]:
+        """
+        Admit queued calls while the limits allow it. Return the seconds
+        until the next call could be admitted, None to wait for a change.
+        """
+        granted = False
+        timeout = None
+        while True:
+            ticket = self._peek()
+            if ticket is None:
+                break
+
+            now = time.monotonic()
+            if now < self._paused_until:
+                timeout = self._paused_until - now
+                break
+
+            wait = self._wait_time(ticket, now)
+            if wait is None:
+                # concurrency limit reached, wait for a release
+                break
+            if wait > 0:
+                timeout = wait
+                break
+
+            self._pop(ticket)
+            if self.requests is not None:
+                self.requests.level -= 1
+            if self.tokens is not None:
+                self.tokens.level -= ticket.tokens
+            self._in_flight += 1
+            ticket._grant()
+            granted = True
+
+        if granted:
+            self._update_gauges()
+        return timeout
+
+    def _wait_time(self, ticket: Ticket, now: float) -> Optional[float]:
+        reserve = 0.0 if ticket.priority == LLMPriority.CHAT else self.chat_reserve
+
+        if self.max_concurrency > 0:
+            if self._in_flight >= max(1, int(self.max_concurrency * (1 - reserve))):
+                return None
+
+        wait = 0.0
+        for bucket, amount in ((self.requests, 1), (self.tokens, ticket.tokens)):
+            if bucket is None:
+                continue
+            bucket.refill(now)
+            floor = bucket.capacity * reserve
+            # a full bucket always admits the call, whatever its size
+            wait = max(wait, bucket.wait_time(min(amount, bucket.capacity - floor), floor))
+        return wait
+
+    def _peek(self) -> Optional[Ticket]:
+        # LLMPriority is declared in scheduling order
+        for priority in LLMPriority:
+            queue = self._queues[priority]
+            if queue:
+                return next(iter(queue.values()))[0]
+        return None
+
+    def _pop(self, ticket: Ticket):
+        queue = self._queues[ticket.priority]
+        tickets = queue[ticket.tenant]
+        tickets.popleft()
+        # the tenant goes to the back of the round robin
+        del queue[ticket.tenant]
+        if tickets:
+            queue[ticket.tenant] = tickets
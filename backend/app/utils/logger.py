@@ -1,15 +1,20 @@
 import logging
 import sys
 from pathlib import Path
+from typing import TYPE_CHECKING
 
-from fastapi import Request
 from utils.config import get_config
 
+# only annotated here, the utilities logging through this module do not
+# need the web framework
+if TYPE_CHECKING:
+    from fastapi import Request
+
 config = get_config()
 
 def get_logger(
     name: str = "app",
-    logdir: Path = Path(config["logdir"]),
+    logdir: Path = Path(config.get("logdir", "./logs")),
     log_level: int = logging.INFO,
 ) -> logging.Logger:
     """Setup a logger with file and stream handlers.
@@ -57,7 +62,7 @@ def get_logger(
     return logger
 
 
-def log_request(request: Request, logger: logging.Logger) -> None:
+def log_request(request: "Request", logger: logging.Logger) -> None:
     s = "Request validation error:\n"
     s += "ULR: %s\n"
     s += "Path params: %s\n"
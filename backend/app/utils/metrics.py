@@ -0,0 +1,108 @@
+import bisect
+import threading
+
+from typing import Dict, Tuple
+
+DEFAULT_BUCKETS = (
+    0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0,
+)
+
+
+class MetricsRegistry:
+    def __init__(self):
+        """
+        In-process counters, gauges and histograms, rendered in the
+        Prometheus text format.
+        """
+        self._lock = threading.Lock()
+        self._counters: Dict[Tuple, float] = {}
+        self._gauges: Dict[Tuple, float] = {}
+        self._histograms: Dict[Tuple, dict] = {}
+        self._buckets: Dict[str, tuple] = {}
+
+    @staticmethod
+    def _key(name: str, labels: dict) -> Tuple:
+        return (name, tuple(sorted((k, str(v)) for k, v in labels.items())))
+
+    def inc(self, name: str, value: float = 1, **labels):
+        """
+        Increase a counter.
+        """
+        key = self._key(name, labels)
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def set(self, name: str, value: float, **labels):
+        """
+        Set a gauge.
+        """
+        key = self._key(name, labels)
+        with self._lock:
+            self._gauges[key] = value
+
+    def observe(self, name: str, value: float, buckets: tuple = None, **labels):
+        """
+        Record a value in a histogram.
+        """
+        key = self._key(name, labels)
+        with self._lock:
+            bounds = self._buckets.setdefault(name, tuple(buckets or DEFAULT_BUCKETS))
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = {"counts": [0] * (len(bounds) + 1), "sum": 0.0, "count": 0}
+                self._histograms[key] = histogram
+            histogram["counts"][bisect.bisect_left(bounds, value)] += 1
+            histogram["sum"] += value
+            histogram["count"] += 1
+
+    def get(self, name: str, **labels) -> float:
+        """
+        Return the value of a counter or gauge, 0 if it was never recorded.
+        """
+        key = self._key(name, labels)
+        with self._lock:
+            return self._counters.get(key, self._gauges.get(key, 0))
+
+    def render(self) -> str:
+        """
+        Return all metrics in the Prometheus text format.
+        """
+        def _labels(labels, extra=()):
+            items = list(labels) + list(extra)
+            if not items:
+                return ""
+            return "{" + ",".join(f'{k}="{v}"' for k, v in items) + "}"
+
+        lines = []
+        with self._lock:
+            for kind, values in (("counter", self._counters), ("gauge", self._gauges)):
+                seen = set()
+                for (name, labels), value in sorted(values.items()):
+                    if name not in seen:
+                        lines.append(f"# TYPE {name} {kind}")
+                        seen.add(name)
+                    lines.append(f"{name}{_labels(labels)} {value}")
+
+            seen = set()
+            for (name, labels), histogram in sorted(self._histograms.items()):
+                if name not in seen:
+                    lines.append(f"# TYPE {name} histogram")
+                    seen.add(name)
+                cumulative = 0
+                for bound, count in zip(self._buckets[name] + ("+Inf",), histogram["counts"]):
+                    cumulative += count
+                    lines.append(f"{name}_bucket{_labels(labels, [('le', bound)])} {cumulative}")
+                lines.append(f"{name}_sum{_labels(labels)} {histogram['sum']}")
+                lines.append(f"{name}_count{_labels(labels)} {histogram['count']}")
+
+        return "\n".join(lines) + "\n"
+
+
+_registry = MetricsRegistry()
+
+
+def get_metrics() -> MetricsRegistry:
+    """
+    Return the process-wide metrics registry.
+    """
+    return _registry
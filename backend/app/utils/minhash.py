@@ -0,0 +1,152 @@
+import re
+import zlib
+import numpy as np
+
+from typing import Dict, Hashable, List, Optional, Tuple
+
+MAX_HASH = np.uint64((1 << 32) - 1)
+# Mersenne prime larger than every hash, a * x + b stays below 2**64
+PRIME = np.uint64((1 << 61) - 1)
+
+_TOKEN_RE = re.compile(r"\w+", re.UNICODE)
+
+
+class MinHasher:
+    def __init__(
+        self,
+        num_perm: int = 64,
+        shingle_words: int = 3,
+        seed: int = 1,
+    ):
+        """
+        MinHash signatures of texts over their word shingles. The Jaccard
+        similarity of two shingle sets is estimated by the share of equal
+        signature values.
+
+        Args:
+            num_perm (int): The number of hash permutations, i.e. the signature length.
+            shingle_words (int): The number of words in a shingle.
+            seed (int): The seed of the permutations, signatures are only comparable with the same seed.
+        """
+        self.num_perm = num_perm
+        self.shingle_words = max(1, shingle_words)
+
+        rng = np.random.RandomState(seed)
+        self._a = rng.randint(1, 1 << 31, size=num_perm).astype(np.uint64)
+        self._b = rng.randint(0, 1 << 31, size=num_perm).astype(np.uint64)
+
+    def _shingles(self, text: str) -> np.ndarray:
+        words = _TOKEN_RE.findall(text.lower())
+        k = self.shingle_words
+        if len(words) <= k:
+            shingles = {" ".join(words)}
+        else:
+            shingles = {" ".join(words[i:i + k]) for i in range(len(words) - k + 1)}
+        return np.fromiter(
+            (zlib.crc32(shingle.encode("utf-8")) for shingle in shingles),
+            dtype=np.uint64,
+            count=len(shingles),
+        )
+
+    def signature(self, text: str) -> np.ndarray:
+        """
+        Return the signature of a text, an array of `num_perm` uint32.
+        """
+        hashes = self._shingles(text)
+        # (num_shingles, num_perm) permuted hashes, minimum per permutation
+        permuted = ((np.outer(hashes, self._a) + self._b) % PRIME) & MAX_HASH
+        return permuted.min(axis=0).astype(np.uint32)
+
+    @staticmethod
+    def similarity(a: np.ndarray, b: np.ndarray) -> float:
+        """
+        Return the estimated Jaccard similarity of two signatures.
+        """
+        return float(np.mean(a == b))
+
+    @staticmethod
+    def encode(signature: np.ndarray) -> str:
+        return signature.astype("<u4").tobytes().hex()
+
+    @staticmethod
+    def decode(value: str) -> np.ndarray:
+        return np.frombuffer(bytes.fromhex(value), dtype="<u4").astype(np.uint32)
+
+
+def _lsh_bands(num_perm: int, threshold: float) -> Tuple[int, int]:
+    """
+    Return (bands, rows) for which pairs at `threshold` similarity collide
+    with high probability, preferring recall since candidates are verified.
+    """
+    best = (num_perm, 1)
+    best_error = None
+    for rows in range(1, num_perm + 1):
+        if num_perm % rows:
+            continue
+        bands = num_perm // rows
+        # similarity at which the collision probability is about one half
+        knee = (1.0 / bands) ** (1.0 / rows)
+        if knee > threshold:
+            continue
+        error = threshold - knee
+        if best_error is None or error < best_error:
+            best, best_error = (bands, rows), error
+    return best
+
+
+class NearDuplicateIndex:
+    def __init__(
+        self,
+        threshold: float = 0.9,
+        num_perm: int = 64,
+    ):
+        """
+        LSH index of MinHash signatures. Candidates sharing a band with the
+        query are verified against `threshold`.
+
+        Args:
+            threshold (float): The estimated Jaccard similarity from which texts are near-duplicates.
+            num_perm (int): The signature length, must match the MinHasher.
+        """
+        self.threshold = threshold
+        self.bands, self.rows = _lsh_bands(num_perm, threshold)
+        self._buckets: List[Dict[bytes, List[Hashable]]] = [{} for _ in range(self.bands)]
+        self._signatures: Dict[Hashable, np.ndarray] = {}
+
+    def __len__(self) -> int:
+        return len(self._signatures)
+
+    def _band_keys(self, signature: np.ndarray) -> List[bytes]:
+        return [
+            signature[band * self.rows:(band + 1) * self.rows].tobytes()
+            for band in range(self.bands)
+        ]
+
+    def add(self, key: Hashable, signature: np.ndarray):
+        self._signatures[key] = signature
+        for buckets, band_key in zip(self._buckets, self._band_keys(signature)):
+            buckets.setdefault(band_key, []).append(key)
+
+    def find(self, signature: np.ndarray) -> Optional[Hashable]:
+        """
+        Return the key of the most similar indexed signature at or above the
+        threshold, None if there is none.
+        """
+        candidates = []
+        seen = set()
+        for buckets, band_key in zip(self._buckets, self._band_keys(signature)):
+            for key in buckets.get(band_key, ()):
+                if key not in seen:
+                    seen.add(key)
+                    candidates.append(key)
+        if not candidates:
+            return None
+
+        similarities = np.mean(
+            np.stack([self._signatures[key] for key in candidates]) == signature,
+            axis=1,
+        )
+        best = int(np.argmax(similarities))
+        if similarities[best] < self.threshold:
+            return None
+        return candidates[best]
@@ -0,0 +1,107 @@
+import re
+import threading
+import unicodedata
+import numpy as np
+
+from typing import Callable, List
+
+from cachetools import TTLCache
+
+from utils.metrics import get_metrics
+
+metrics = get_metrics()
+
+_WHITESPACE_RE = re.compile(r"\s+")
+_TRAILING_PUNCTUATION = " ?!.;:,"
+
+
+def normalize_query(query: str) -> str:
+    """
+    Return the cache key form of a query: NFKC normalized, case folded,
+    whitespace collapsed and trailing punctuation removed.
+    """
+    query = unicodedata.normalize("NFKC", query).casefold()
+    query = _WHITESPACE_RE.sub(" ", query).strip()
+    return query.rstrip(_TRAILING_PUNCTUATION) or query
+
+
+class QueryEmbeddingCache:
+    def __init__(
+        self,
+        name: str = "query_embedding",
+        max_bytes: int = 64 * 1024 * 1024,
+        ttl: float = 3600,
+    ):
+        """
+        In-memory LRU cache of query embeddings, keyed by normalized query.
+
+        Args:
+            name (str): The name used for the hit/miss metrics.
+            max_bytes (int): The maximum size of the stored vectors.
+            ttl (float): The lifetime of an entry in seconds.
+        """
+        self.name = name
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+
+        self._lock = threading.Lock()
+        self._cache = TTLCache(
+            maxsize=max_bytes,
+            ttl=ttl,
+            getsizeof=lambda value: value.nbytes,
+        )
+
+    def get_or_embed(
+        self,
+        query: str,
+        embed: Callable[[str], List[float]],
+    ) -> List[float]:
+        """
+        Return the cached embedding of the query, computing it with `embed`
+        on a miss. The normalized query is only the lookup key, the query
+        itself is embedded, so queries differing in case or punctuation
+        share the embedding of whichever came first.
+        """
+        key = normalize_query(query)
+        with self._lock:
+            value = self._cache.get(key)
+            if value is not None:
+                self.hits += 1
+            else:
+                self.misses += 1
+
+        if value is not None:
+            metrics.inc("cache_hits_total", cache=self.name)
+            return value.tolist()
+
+        metrics.inc("cache_misses_total", cache=self.name)
+        # concurrent misses on the same query both embed it, which is harmless
+        embedding = embed(query)
+        value = np.asarray(embedding, dtype=np.float32)
+        if value.nbytes <= self.max_bytes:
+            with self._lock:
+                self._cache[key] = value
+                size = self._cache.currsize
+            metrics.set("cache_size_bytes", size, cache=self.name)
+        return value.tolist()
+
+    def clear(self):
+        with self._lock:
+            self._cache.clear()
+
+    def stats(self) -> dict:
+        """
+        Return hit/miss counters and the stored size.
+        """
+        with self._lock:
+            size = self._cache.currsize
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0,
+            "size_bytes": size,
+            "max_bytes": self.max_bytes,
+        }
@@ -0,0 +1,187 @@
+import time
+import threading
+
+from collections import deque
+from typing import Callable, List, Sequence, Tuple
+
+from utils.logger import get_logger
+from utils.metrics import get_metrics
+
+logger = get_logger()
+metrics = get_metrics()
+
+BATCH_BUCKETS = (1, 2, 4, 8, 16, 32, 64, 128, 256, 512)
+
+Pair = Tuple[str, str]
+
+
+class FlagRerankerScorer:
+    def __init__(self, reranker):
+        """
+        Score pairs with the cross-encoder of a llama_index
+        FlagEmbeddingReranker, which only exposes it as the private `_model`.
+
+        Args:
+            reranker (FlagEmbeddingReranker): The reranker whose model scores the pairs.
+
+        Raises:
+            TypeError: The reranker has no model with a compute_score method.
+        """
+        model = getattr(reranker, "_model", None)
+        if not callable(getattr(model, "compute_score", None)):
+            raise TypeError(
+                f"{type(reranker).__name__} has no FlagEmbedding model with compute_score"
+            )
+        self.reranker = reranker
+
+    def __call__(self, pairs: List[Pair]) -> Sequence[float]:
+        # looked up on every call, the reranker may replace its model
+        return self.reranker._model.compute_score(pairs)
+
+
+class _RerankRequest:
+    __slots__ = ("pairs", "enqueued_at", "scores", "error", "_event")
+
+    def __init__(self, pairs: List[Pair]):
+        self.pairs = pairs
+        self.enqueued_at = time.monotonic()
+        self.scores = None
+        self.error = None
+        self._event = threading.Event()
+
+
+class RerankBatcher:
+    def __init__(
+        self,
+        compute_score: Callable[[List[Pair]], Sequence[float]],
+        max_batch_size: int = 64,
+        max_wait: float = 0.01,
+    ):
+        """
+        Score (query, passage) pairs of concurrent requests in shared batches.
+
+        Callers block in `score()` while a worker thread gathers the queued
+        requests until they hold `max_batch_size` pairs or the oldest one
+        waited `max_wait` seconds, then scores all their pairs with a single
+        `compute_score` call. Requests are never split, a request larger
+        than `max_batch_size` is scored alone. Requests arriving while a
+        batch runs are gathered for the next one.
+
+        Args:
+            compute_score (Callable): The cross-encoder scoring function, e.g. FlagReranker.compute_score.
+            max_batch_size (int): The number of pairs from which a batch is run without waiting.
+            max_wait (float): The longest a request waits for other requests, in seconds.
+        """
+        self.compute_score = compute_score
+        self.max_batch_size = max(1, max_batch_size)
+        self.max_wait = max(0.0, max_wait)
+
+        self._cond = threading.Condition()
+        self._queue: deque = deque()
+        self._queued_pairs = 0
+        self._batches = 0
+        self._batched_pairs = 0
+
+        self._worker = threading.Thread(target=self._worker_loop, daemon=True)
+        self._worker.start()
+
+    def score(self, pairs: List[Pair]) -> List[float]:
+        """
+        Return the relevance score of every pair, in order.
+        """
+        if not pairs:
+            return []
+
+        request = _RerankRequest(list(pairs))
+        with self._cond:
+            self._queue.append(request)
+            self._queued_pairs += len(request.pairs)
+            self._update_gauges()
+            self._cond.notify()
+
+        request._event.wait()
+        if request.error is not None:
+            raise request.error
+        return request.scores
+
+    def stats(self) -> dict:
+        """
+        Return the queue depth and the average batch size.
+        """
+        with self._cond:
+            return {
+                "queued_requests": len(self._queue),
+                "queued_pairs": self._queued_pairs,
+                "batches": self._batches,
+                "avg_batch_pairs": self._batched_pairs / self._batches if self._batches else 0.0,
+            }
+
+    def _update_gauges(self):
+        metrics.set("rerank_queue_requests", len(self._queue))
+        metrics.set("rerank_queue_pairs", self._queued_pairs)
+
+    def _worker_loop(self):
+        while True:
+            batch = self._collect()
+            try:
+                self._run(batch)
+            except Exception as e:
+                # never leave a caller waiting
+                logger.error(f"Rerank batch failed: {e}")
+                for request in batch:
+                    if not request._event.is_set():
+                        request.error = e
+                        request._event.set()
+
+    def _collect(self) -> List[_RerankRequest]:
+        with self._cond:
+            while not self._queue:
+                self._cond.wait()
+
+            deadline = self._queue[0].enqueued_at + self.max_wait
+            while self._queued_pairs < self.max_batch_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                self._cond.wait(remaining)
+
+            batch = []
+            size = 0
+            while self._queue and (not batch or size + len(self._queue[0].pairs) <= self.max_batch_size):
+                request = self._queue.popleft()
+                batch.append(request)
+                size += len(request.pairs)
+            self._queued_pairs -= size
+            self._batches += 1
+            self._batched_pairs += size
+            self._update_gauges()
+        return batch
+
+    def _run(self, batch: List[_RerankRequest]):
+        pairs = [pair for request in batch for pair in request.pairs]
+        start = time.monotonic()
+        for request in batch:
+            metrics.observe("rerank_wait_seconds", start - request.enqueued_at)
+
+        scores, error = None, None
+        try:
+            scores = self.compute_score(pairs)
+            # FlagReranker returns a bare float for a single pair
+            scores = [float(score) for score in scores] if hasattr(scores, "__iter__") else [float(scores)]
+            if len(scores) != len(pairs):
+                raise ValueError(f"Reranker returned {len(scores)} scores for {len(pairs)} pairs")
+        except Exception as e:
+            logger.error(f"Error reranking a batch of {len(pairs)} pairs: {e}")
+            error = e
+
+        metrics.observe("rerank_batch_seconds", time.monotonic() - start)
+        metrics.observe("rerank_batch_pairs", len(pairs), buckets=BATCH_BUCKETS)
+        metrics.observe("rerank_batch_requests", len(batch), buckets=BATCH_BUCKETS)
+
+        offset = 0
+        for request in batch:
+            if error is None:
+                request.scores = scores[offset:offset + len(request.pairs)]
+            request.error = error
+            offset += len(request.pairs)
+            request._event.set()
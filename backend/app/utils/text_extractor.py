@@ -0,0 +1,121 @@
+import os
+import json
+import textract
+import docx2txt
+
+from typing import Iterator
+from pypdf import PdfReader
+
+from utils.logger import get_logger
+
+logger = get_logger()
+
+
+def iter_sections(
+    file_path: str,
+    section_chars: int = 20000,
+) -> Iterator[str]:
+    """
+    Yield the text of a file piece by piece: pages for PDFs, groups of
+    paragraphs of about `section_chars` characters for DOCX and text files.
+    Other formats, and files the dedicated readers cannot handle, go through
+    textract.
+    """
+    extension = os.path.splitext(file_path)[1].lower()
+
+    if extension == ".pdf":
+        reader = _iter_pdf
+    elif extension == ".docx":
+        reader = _iter_docx
+    elif extension == ".txt":
+        reader = _iter_text
+    else:
+        reader = None
+
+    if reader is not None:
+        yielded = False
+        try:
+            for section in reader(file_path, section_chars):
+                if section.strip():
+                    yielded = True
+                    yield section
+        except Exception as e:
+            # sections already handed out cannot be taken back
+            if yielded:
+                raise
+            logger.warning(f"Falling back to textract for {file_path}: {e}")
+        if yielded:
+            return
+        logger.info(f"No text read from {file_path}, falling back to textract")
+
+    text = textract.process(file_path).decode("utf-8")
+    for start in range(0, len(text), section_chars):
+        yield text[start:start + section_chars]
+
+
+def _iter_pdf(file_path: str, section_chars: int) -> Iterator[str]:
+    reader = PdfReader(file_path)
+    for page in reader.pages:
+        yield page.extract_text() or ""
+
+
+def _iter_docx(file_path: str, section_chars: int) -> Iterator[str]:
+    # docx2txt reads the whole document.xml, only the sections are streamed
+    text = docx2txt.process(file_path)
+    yield from _group_paragraphs(text.split("\n"), section_chars)
+
+
+def _iter_text(file_path: str, section_chars: int) -> Iterator[str]:
+    with open(file_path, "r", encoding="utf-8", errors="replace") as f:
+        yield from _group_paragraphs(f, section_chars)
+
+
+def _group_paragraphs(lines, section_chars: int) -> Iterator[str]:
+    """
+    Join lines into sections, cutting on blank lines once a section is
+    long enough.
+    """
+    buffer = []
+    size = 0
+    for line in lines:
+        line = line.rstrip("\n")
+        buffer.append(line)
+        size += len(line) + 1
+        if size >= section_chars and not line.strip():
+            yield "\n".join(buffer)
+            buffer = []
+            size = 0
+        elif size >= section_chars * 2:
+            # no paragraph break in sight
+            yield "\n".join(buffer)
+            buffer = []
+            size = 0
+    if buffer:
+        yield "\n".join(buffer)
+
+
+def write_sections(
+    file_path: str,
+    output_path: str,
+    section_chars: int = 20000,
+) -> int:
+    """
+    Write the sections of a file to output_path, one JSON string per line,
+    return the number of sections.
+    """
+    count = 0
+    with open(output_path, "w", encoding="utf-8") as f:
+        for section in iter_sections(file_path, section_chars=section_chars):
+            f.write(json.dumps(section))
+            f.write("\n")
+            count += 1
+    return count
+
+
+def read_sections(output_path: str) -> Iterator[str]:
+    """
+    Yield the sections written by write_sections.
+    """
+    with open(output_path, "r", encoding="utf-8") as f:
+        for line in f:
+            yield json.loads(line)
@@ -0,0 +1,111 @@
+import pytest
+
+# the agentic package pulls in the llama_index, Milvus and Elasticsearch clients
+bulk_writer = pytest.importorskip("src.agentic.bulk_writer")
+
+from llama_index.core import Document
+
+BulkWriter = bulk_writer.BulkWriter
+BulkWriteError = bulk_writer.BulkWriteError
+
+
+class _Milvus:
+    def __init__(self, reject=()):
+        self.rows = {}
+        self.reject = set(reject)
+
+    def insert(self, collection_name, data):
+        ids = [row["id"] for row in data if row["id"] not in self.reject]
+        for row in data:
+            if row["id"] in ids:
+                self.rows[row["id"]] = row
+        return {"ids": ids, "insert_count": len(ids)}
+
+    def delete(self, collection_name, ids):
+        for id in ids:
+            self.rows.pop(id, None)
+
+
+class _Indices:
+    def __init__(self):
+        self.refreshes = 0
+
+    def refresh(self, index):
+        self.refreshes += 1
+
+
+class _Elasticsearch:
+    def __init__(self, reject=()):
+        self.docs = {}
+        self.reject = set(reject)
+        self.indices = _Indices()
+
+
+def _streaming_bulk(client, actions, **kwargs):
+    for action in actions:
+        op, id = action["_op_type"], action["_id"]
+        if op == "delete":
+            client.docs.pop(id, None)
+            yield True, {"delete": {"_id": id}}
+        elif id in client.reject:
+            yield False, {"index": {"_id": id, "error": "rejected"}}
+        else:
+            client.docs[id] = action["_source"]
+            yield True, {"index": {"_id": id}}
+
+
+@pytest.fixture(autouse=True)
+def _bulk_helper(monkeypatch):
+    monkeypatch.setattr(bulk_writer, "streaming_bulk", _streaming_bulk)
+
+
+def _writer(vectordb, es):
+    return BulkWriter(vectordb, es, es_index="chunks", max_retries=0, retry_backoff=0)
+
+
+def _chunks(count):
+    chunks = [Document(id_=f"chunk-{i}", text=f"Chunk {i}.") for i in range(count)]
+    return chunks, [[float(i), 1.0] for i in range(count)]
+
+
+def test_writes_both_stores():
+    vectordb, es = _Milvus(), _Elasticsearch()
+    chunks, embeddings = _chunks(3)
+
+    assert _writer(vectordb, es).write("doc", chunks, embeddings) == 3
+    assert set(vectordb.rows) == set(es.docs) == {"chunk-0", "chunk-1", "chunk-2"}
+    assert es.docs["chunk-1"]["text"] == "Chunk 1."
+    assert es.indices.refreshes == 1
+
+
+def test_elasticsearch_failure_removes_the_milvus_rows():
+    vectordb, es = _Milvus(), _Elasticsearch(reject={"chunk-1"})
+    chunks, embeddings = _chunks(3)
+
+    with pytest.raises(BulkWriteError):
+        _writer(vectordb, es).write("doc", chunks, embeddings)
+    assert vectordb.rows == {}
+    assert es.docs == {}
+
+
+def test_milvus_failure_removes_the_inserted_rows():
+    vectordb, es = _Milvus(reject={"chunk-2"}), _Elasticsearch()
+    chunks, embeddings = _chunks(3)
+
+    with pytest.raises(BulkWriteError):
+        _writer(vectordb, es).write("doc", chunks, embeddings)
+    assert vectordb.rows == {}
+    assert es.docs == {}
+
+
+def test_rollback_keeps_the_other_documents():
+    vectordb, es = _Milvus(), _Elasticsearch()
+    writer = _writer(vectordb, es)
+    chunks, embeddings = _chunks(2)
+    writer.write("doc", chunks, embeddings)
+
+    es.reject = {"other-1"}
+    other = [Document(id_=f"other-{i}", text=f"Other {i}.") for i in range(2)]
+    with pytest.raises(BulkWriteError):
+        writer.write("other", other, embeddings)
+    assert set(vectordb.rows) == set(es.docs) == {"chunk-0", "chunk-1"}
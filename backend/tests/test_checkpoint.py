@@ -0,0 +1,101 @@
+import json
+import os
+
+import pytest
+
+# the agentic package pulls in the llama_index, Milvus and Elasticsearch clients
+checkpoint = pytest.importorskip("src.agentic.checkpoint")
+
+from llama_index.core import Document
+
+from const import CheckpointStage
+
+IngestionCheckpoint = checkpoint.IngestionCheckpoint
+
+WINDOW = "First window of the document."
+
+
+def _chunks():
+    return [
+        Document(text="First chunk.", metadata={"doc_id": "doc"}, embedding=[0.1, 0.2]),
+        Document(text="Second chunk.", metadata={"doc_id": "doc"}, embedding=[0.3, 0.4]),
+    ]
+
+
+def _context(chunk_id, text):
+    return Document(id_=chunk_id, text=text, metadata={"doc_id": "doc"})
+
+
+def test_resumes_a_window_split_before_the_crash(tmp_path):
+    progress = IngestionCheckpoint(str(tmp_path), "doc")
+    progress.save_chunks(0, WINDOW, _chunks())
+    progress.save_context(0, 1, _context("chunk-1", "Context. Second chunk."))
+
+    # a new process reads the manifest back
+    resumed = IngestionCheckpoint(str(tmp_path), "doc")
+    assert resumed.stage(0) == CheckpointStage.SPLIT
+    assert resumed.stage(1) is None
+    assert resumed.validate(0, WINDOW) == []
+
+    chunks = resumed.load_chunks(0)
+    assert [chunk.text for chunk in chunks] == ["First chunk.", "Second chunk."]
+    assert chunks[1].embedding == [0.3, 0.4]
+
+    contexts = resumed.load_contexts(0, {"doc_id": "doc"})
+    assert list(contexts) == [1]
+    assert contexts[1].doc_id == "chunk-1"
+    assert contexts[1].text == "Context. Second chunk."
+    assert resumed.load_embeddings(0) is None
+
+
+def test_resumes_after_the_last_completed_stage(tmp_path):
+    progress = IngestionCheckpoint(str(tmp_path), "doc")
+    progress.save_chunks(0, WINDOW, _chunks())
+    progress.mark_contextualized(0)
+    progress.save_embeddings(0, [[1.0, 0.0], [0.0, 1.0]])
+    progress.mark_indexed(0, ["chunk-0", "chunk-1"])
+    progress.save_chunks(1, "Second window.", _chunks()[:1])
+    progress.mark_contextualized(1)
+    progress.save_embeddings(1, [[0.5, 0.5]])
+
+    resumed = IngestionCheckpoint(str(tmp_path), "doc")
+    assert resumed.reached(0, CheckpointStage.INDEXED)
+    assert resumed.stage(1) == CheckpointStage.EMBEDDED
+    assert not resumed.reached(1, CheckpointStage.INDEXED)
+    assert resumed.load_embeddings(1) == [[0.5, 0.5]]
+    assert resumed.indexed_chunk_ids() == ["chunk-0", "chunk-1"]
+
+
+def test_changed_window_drops_it_and_the_later_ones(tmp_path):
+    progress = IngestionCheckpoint(str(tmp_path), "doc")
+    for window in range(3):
+        progress.save_chunks(window, f"Window {window}.", _chunks())
+        progress.mark_indexed(window, [f"chunk-{window}"])
+
+    resumed = IngestionCheckpoint(str(tmp_path), "doc")
+    assert resumed.validate(1, "Window 1, edited.") == ["chunk-1", "chunk-2"]
+    assert resumed.indexed_chunk_ids() == ["chunk-0"]
+    assert IngestionCheckpoint(str(tmp_path), "doc").stage(2) is None
+    assert not os.path.exists(os.path.join(str(tmp_path), "doc", "window_2.chunks.json"))
+
+
+def test_skips_a_context_cut_short_by_a_crash(tmp_path):
+    progress = IngestionCheckpoint(str(tmp_path), "doc")
+    progress.save_chunks(0, WINDOW, _chunks())
+    progress.save_context(0, 0, _context("chunk-0", "Context. First chunk."))
+    with open(os.path.join(progress.path, "window_0.contexts.jsonl"), "a", encoding="utf-8") as f:
+        f.write(json.dumps({"position": 1, "id": "chunk-1", "text": "Context."})[:20])
+
+    contexts = IngestionCheckpoint(str(tmp_path), "doc").load_contexts(0, {})
+    assert list(contexts) == [0]
+
+
+def test_ignores_an_unreadable_manifest(tmp_path):
+    progress = IngestionCheckpoint(str(tmp_path), "doc")
+    progress.save_chunks(0, WINDOW, _chunks())
+    with open(os.path.join(progress.path, "manifest.json"), "w", encoding="utf-8") as f:
+        f.write("{\"windows\": ")
+
+    resumed = IngestionCheckpoint(str(tmp_path), "doc")
+    assert resumed.stage(0) is None
+    assert resumed.load_chunks(0) is None
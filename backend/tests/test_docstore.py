@@ -0,0 +1,83 @@
+import os
+
+from utils.docstore import MmapDocstore
+
+
+def test_round_trip(tmp_path):
+    docstore = MmapDocstore(str(tmp_path / "docstore"))
+    docstore.put_many({
+        "chunk-0": {"doc_id": "doc", "text": "First chunk."},
+        "chunk-1": {"doc_id": "doc", "text": "Deuxième morceau."},
+    })
+    docstore.put_many({"chunk-0": {"doc_id": "doc", "text": "First chunk, edited."}})
+
+    assert len(docstore) == 2
+    assert docstore.get_many(["chunk-0", "chunk-1", "missing"]) == {
+        "chunk-0": {"doc_id": "doc", "text": "First chunk, edited."},
+        "chunk-1": {"doc_id": "doc", "text": "Deuxième morceau."},
+    }
+
+    docstore.delete(["chunk-0", "missing"])
+    assert docstore.get_many(["chunk-0", "chunk-1"]) == {
+        "chunk-1": {"doc_id": "doc", "text": "Deuxième morceau."},
+    }
+
+
+def test_reopen_after_restart(tmp_path):
+    path = str(tmp_path / "docstore")
+    docstore = MmapDocstore(path)
+    docstore.put_many({f"chunk-{i}": {"doc_id": "doc", "text": f"Chunk {i}."} for i in range(3)})
+    docstore.put_many({"chunk-1": {"doc_id": "doc", "text": "Chunk 1, edited."}})
+    docstore.delete(["chunk-2"])
+
+    reopened = MmapDocstore(path)
+    assert len(reopened) == 2
+    assert reopened.get_many(["chunk-0", "chunk-1", "chunk-2"]) == {
+        "chunk-0": {"doc_id": "doc", "text": "Chunk 0."},
+        "chunk-1": {"doc_id": "doc", "text": "Chunk 1, edited."},
+    }
+
+
+def test_empty_store(tmp_path):
+    docstore = MmapDocstore(str(tmp_path / "nested" / "docstore"))
+
+    assert len(docstore) == 0
+    assert docstore.get_many(["chunk-0"]) == {}
+    assert len(MmapDocstore(str(tmp_path / "nested" / "docstore"))) == 0
+
+
+def test_truncated_tail_is_dropped(tmp_path):
+    path = str(tmp_path / "docstore")
+    docstore = MmapDocstore(path)
+    docstore.put_many({"chunk-0": {"doc_id": "doc", "text": "Chunk 0."}})
+    # crash while writing the next record: a torn index line and data past
+    # the end of a complete line
+    with open(f"{path}.index", "a", encoding="utf-8") as f:
+        f.write("chunk-1\t9")
+    with open(f"{path}.data", "ab") as f:
+        f.write(b'{"doc_id": "doc", "te')
+
+    reopened = MmapDocstore(path)
+    assert len(reopened) == 1
+    assert reopened.get_many(["chunk-0", "chunk-1"]) == {"chunk-0": {"doc_id": "doc", "text": "Chunk 0."}}
+
+    # records appended after the crash survive the next restart
+    reopened.put_many({"chunk-2": {"doc_id": "doc", "text": "Chunk 2."}})
+    assert MmapDocstore(path).get_many(["chunk-0", "chunk-2"]) == {
+        "chunk-0": {"doc_id": "doc", "text": "Chunk 0."},
+        "chunk-2": {"doc_id": "doc", "text": "Chunk 2."},
+    }
+
+
+def test_index_past_the_data_is_ignored(tmp_path):
+    path = str(tmp_path / "docstore")
+    MmapDocstore(path).put_many({
+        "chunk-0": {"doc_id": "doc", "text": "Chunk 0."},
+        "chunk-1": {"doc_id": "doc", "text": "Chunk 1."},
+    })
+    # the data file lost its last record
+    with open(f"{path}.data", "r+b") as f:
+        f.truncate(os.path.getsize(f"{path}.data") - 5)
+
+    reopened = MmapDocstore(path)
+    assert reopened.get_many(["chunk-0", "chunk-1"]) == {"chunk-0": {"doc_id": "doc", "text": "Chunk 0."}}
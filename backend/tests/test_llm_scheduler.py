@@ -0,0 +1,85 @@
+import time
+import threading
+
+from const import LLMPriority
+from utils.llm_scheduler import LLMScheduler, llm_scope
+
+
+def _submit(scheduler, priority, tenant, tokens=1):
+    # queue a ticket without blocking, as acquire() does
+    with llm_scope(priority, tenant):
+        ticket = scheduler._enqueue(tokens)
+    ticket._event = threading.Event()
+    scheduler._submit(ticket)
+    return ticket
+
+
+def _grant_order(scheduler, tickets):
+    # with a concurrency of one, each release admits the next ticket
+    order = []
+    pending = list(tickets)
+    deadline = time.monotonic() + 5
+    while pending:
+        assert time.monotonic() < deadline, "tickets were never admitted"
+        granted = [ticket for ticket in pending if ticket._event.wait(0.01)]
+        for ticket in granted:
+            order.append(ticket)
+            pending.remove(ticket)
+            scheduler.release(ticket)
+    return order
+
+
+def _blocked(scheduler):
+    with llm_scope(LLMPriority.CHAT):
+        return scheduler.acquire(1)
+
+
+def test_chat_is_served_before_ingestion():
+    scheduler = LLMScheduler(max_concurrency=1, chat_reserve=0.0)
+    running = _blocked(scheduler)
+
+    ingestion = _submit(scheduler, LLMPriority.INGESTION, "a")
+    chat = _submit(scheduler, LLMPriority.CHAT, "b")
+    scheduler.release(running)
+
+    assert _grant_order(scheduler, [ingestion, chat]) == [chat, ingestion]
+
+
+def test_tenants_are_served_round_robin():
+    scheduler = LLMScheduler(max_concurrency=1, chat_reserve=0.0)
+    running = _blocked(scheduler)
+
+    a1 = _submit(scheduler, LLMPriority.INGESTION, "a")
+    a2 = _submit(scheduler, LLMPriority.INGESTION, "a")
+    a3 = _submit(scheduler, LLMPriority.INGESTION, "a")
+    b1 = _submit(scheduler, LLMPriority.INGESTION, "b")
+    scheduler.release(running)
+
+    assert _grant_order(scheduler, [a1, a2, a3, b1]) == [a1, b1, a2, a3]
+
+
+def test_ingestion_leaves_the_chat_reserve():
+    scheduler = LLMScheduler(tokens_per_minute=1000, chat_reserve=0.2)
+
+    # takes the bucket down to the reserve
+    first = _submit(scheduler, LLMPriority.INGESTION, "a", tokens=800)
+    assert first._event.wait(1)
+
+    second = _submit(scheduler, LLMPriority.INGESTION, "a", tokens=100)
+    chat = _submit(scheduler, LLMPriority.CHAT, "b", tokens=100)
+    assert chat._event.wait(1)
+    assert not second._event.wait(0.2)
+    assert scheduler.stats()["queued"][str(LLMPriority.INGESTION)] == 1
+
+
+def test_estimate_above_usable_capacity_is_admitted():
+    scheduler = LLMScheduler(requests_per_minute=1, tokens_per_minute=1000, chat_reserve=0.2)
+
+    ingestion = _submit(scheduler, LLMPriority.INGESTION, "a", tokens=5000)
+    assert ingestion.tokens == 800
+    assert ingestion._event.wait(1)
+
+    scheduler = LLMScheduler(tokens_per_minute=1000, chat_reserve=0.2)
+    chat = _submit(scheduler, LLMPriority.CHAT, "a", tokens=5000)
+    assert chat.tokens == 1000
+    assert chat._event.wait(1)
@@ -0,0 +1,79 @@
+import numpy as np
+
+from utils.minhash import MinHasher, NearDuplicateIndex, _lsh_bands
+
+TEXT = (
+    "The ingestion service splits every uploaded document into chunks, "
+    "adds a short context to each chunk and stores its embedding so that "
+    "the chatbot can retrieve the passages relevant to a question."
+)
+
+
+def test_shingles_ignore_case_and_punctuation():
+    hasher = MinHasher(shingle_words=3)
+
+    assert set(hasher._shingles("One two, THREE four")) == set(hasher._shingles("one two three four!"))
+    # three words or less are a single shingle
+    assert len(hasher._shingles("one two")) == 1
+    assert len(hasher._shingles("one two three four five")) == 3
+
+
+def test_signature_similarity():
+    hasher = MinHasher(num_perm=128)
+    signature = hasher.signature(TEXT)
+
+    assert signature.shape == (128,)
+    assert signature.dtype == np.uint32
+    assert MinHasher.similarity(signature, hasher.signature(TEXT.upper())) == 1.0
+
+    edited = hasher.signature(TEXT.replace("short", "brief"))
+    assert 0.6 < MinHasher.similarity(signature, edited) < 1.0
+
+    unrelated = hasher.signature("Invoices are paid within thirty days of the delivery date.")
+    assert MinHasher.similarity(signature, unrelated) < 0.2
+
+
+def test_signature_encoding_round_trip():
+    signature = MinHasher(num_perm=16).signature(TEXT)
+
+    assert np.array_equal(MinHasher.decode(MinHasher.encode(signature)), signature)
+
+
+def test_lsh_bands_split_the_signature():
+    for num_perm, threshold in ((64, 0.9), (64, 0.5), (128, 0.8), (10, 0.7)):
+        bands, rows = _lsh_bands(num_perm, threshold)
+        assert bands * rows == num_perm
+        # pairs at the threshold collide with at least even odds
+        assert (1.0 / bands) ** (1.0 / rows) <= threshold
+
+    # a higher threshold allows longer, more selective bands
+    assert _lsh_bands(64, 0.9)[1] >= _lsh_bands(64, 0.5)[1]
+
+
+def test_index_finds_near_duplicates_by_band():
+    hasher = MinHasher(num_perm=64)
+    index = NearDuplicateIndex(threshold=0.7, num_perm=64)
+    index.add("original", hasher.signature(TEXT))
+    index.add("other", hasher.signature("Invoices are paid within thirty days of the delivery date."))
+
+    assert len(index) == 2
+    assert index.find(hasher.signature(TEXT)) == "original"
+    assert index.find(hasher.signature(TEXT.replace("short", "brief"))) == "original"
+    assert index.find(hasher.signature("A completely different sentence about the weather today.")) is None
+
+
+def test_index_verifies_candidates_against_the_threshold():
+    hasher = MinHasher(num_perm=64)
+    signature = hasher.signature(TEXT)
+    # shares its first band with the original but little else
+    candidate = signature.copy()
+    candidate[8:] = signature[8:] + 1
+
+    strict = NearDuplicateIndex(threshold=0.9, num_perm=64)
+    strict.add("original", signature)
+    assert strict._band_keys(candidate)[0] == strict._band_keys(signature)[0]
+    assert strict.find(candidate) is None
+
+    loose = NearDuplicateIndex(threshold=0.1, num_perm=64)
+    loose.add("original", signature)
+    assert loose.find(candidate) == "original"
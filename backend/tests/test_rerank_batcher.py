@@ -0,0 +1,100 @@
+import threading
+
+import pytest
+
+from utils.rerank_batcher import FlagRerankerScorer, RerankBatcher
+
+
+class _Model:
+    def __init__(self):
+        self.calls = []
+
+    def compute_score(self, pairs):
+        self.calls.append(list(pairs))
+        if len(pairs) == 1:
+            return float(len(pairs[0][1]))
+        return [float(len(passage)) for _, passage in pairs]
+
+
+class _Reranker:
+    def __init__(self):
+        self._model = _Model()
+
+
+def _score_concurrently(batcher, requests):
+    barrier = threading.Barrier(len(requests))
+    results = {}
+
+    def run(index, pairs):
+        barrier.wait()
+        results[index] = batcher.score(pairs)
+
+    threads = [
+        threading.Thread(target=run, args=(index, pairs))
+        for index, pairs in enumerate(requests)
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(timeout=10)
+    return results
+
+
+def test_concurrent_requests_share_one_forward_pass():
+    reranker = _Reranker()
+    batcher = RerankBatcher(FlagRerankerScorer(reranker), max_batch_size=12, max_wait=5.0)
+    requests = [[(f"query {i}", "x" * (i * 10 + j)) for j in range(3)] for i in range(4)]
+
+    results = _score_concurrently(batcher, requests)
+
+    # the batch is full with the 4 requests, it does not wait for max_wait
+    assert len(reranker._model.calls) == 1
+    assert len(reranker._model.calls[0]) == 12
+    for i, pairs in enumerate(requests):
+        assert results[i] == [float(len(passage)) for _, passage in pairs]
+    assert batcher.stats()["avg_batch_pairs"] == 12
+
+
+def test_batches_are_capped_without_splitting_requests():
+    reranker = _Reranker()
+    batcher = RerankBatcher(FlagRerankerScorer(reranker), max_batch_size=4, max_wait=0.2)
+    requests = [[("query", "x" * (i + j)) for j in range(3)] for i in range(3)]
+
+    results = _score_concurrently(batcher, requests)
+
+    assert sorted(len(call) for call in reranker._model.calls) == [3, 3, 3]
+    for i, pairs in enumerate(requests):
+        assert results[i] == [float(len(passage)) for _, passage in pairs]
+
+
+def test_single_pair_gets_a_list_of_scores():
+    batcher = RerankBatcher(FlagRerankerScorer(_Reranker()), max_wait=0.0)
+
+    assert batcher.score([("query", "abc")]) == [3.0]
+
+
+def test_errors_reach_every_caller_of_the_batch():
+    def fail(pairs):
+        raise RuntimeError("model failed")
+
+    batcher = RerankBatcher(fail, max_batch_size=2, max_wait=5.0)
+    errors = []
+
+    def run():
+        try:
+            batcher.score([("query", "passage")])
+        except RuntimeError as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=run) for _ in range(2)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(timeout=10)
+
+    assert len(errors) == 2
+
+
+def test_scorer_fails_fast_without_a_model():
+    with pytest.raises(TypeError):
+        FlagRerankerScorer(object())
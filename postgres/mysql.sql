@@ -37,21 +37,61 @@ CREATE TABLE "documents" (
   "file_name" TEXT NOT NULL,
   "file_type" TEXT NOT NULL,
   "file_size" REAL NOT NULL,
+  "content_hash" TEXT,
+  "source_document_id" TEXT, -- document whose chunks, vectors and ES entries are used
   "created_at" TEXT NOT NULL DEFAULT (datetime('now')),
   "updated_at" TEXT NOT NULL DEFAULT (datetime('now')),
   FOREIGN KEY ("user_id") REFERENCES "users" ("id")
 );
 
+CREATE INDEX "documents_content_hash_idx" ON "documents" ("content_hash");
+
+CREATE INDEX "documents_source_document_id_idx" ON "documents" ("source_document_id");
+
 CREATE TABLE "chunks" (
   "id" TEXT PRIMARY KEY DEFAULT (lower(hex(randomblob(16)))),
   "document_id" TEXT NOT NULL,
   "chunk_index" INTEGER NOT NULL,
   "vector_id" TEXT NOT NULL,
+  "content_hash" TEXT, -- sha256 of the chunk text, without its context
+  "minhash" TEXT, -- hex MinHash signature of the chunk text, for near-duplicates
   "created_at" TEXT NOT NULL DEFAULT (datetime('now')),
   "updated_at" TEXT NOT NULL DEFAULT (datetime('now')),
   FOREIGN KEY ("document_id") REFERENCES "documents" ("id")
 );
 
+CREATE TABLE "ingestion_batches" (
+  "id" TEXT PRIMARY KEY DEFAULT (lower(hex(randomblob(16)))),
+  "user_id" TEXT NOT NULL,
+  "status" TEXT NOT NULL DEFAULT 'scanning' CHECK ("status" IN ('scanning', 'scanned', 'failed')),
+  "total" INTEGER NOT NULL DEFAULT 0,
+  "error" TEXT,
+  "created_at" TEXT NOT NULL DEFAULT (datetime('now')),
+  "updated_at" TEXT NOT NULL DEFAULT (datetime('now')),
+  FOREIGN KEY ("user_id") REFERENCES "users" ("id")
+);
+
+CREATE TABLE "ingestion_jobs" (
+  "id" TEXT PRIMARY KEY DEFAULT (lower(hex(randomblob(16)))),
+  "user_id" TEXT NOT NULL,
+  "batch_id" TEXT,
+  "document_id" TEXT NOT NULL,
+  "file_name" TEXT NOT NULL,
+  "object_name" TEXT,
+  "file_type" TEXT,
+  "file_size" REAL,
+  "content_hash" TEXT,
+  "status" TEXT NOT NULL DEFAULT 'queued' CHECK ("status" IN ('queued', 'extracting', 'contextualizing', 'indexing', 'done', 'failed')),
+  "error" TEXT,
+  "report" TEXT, -- per-stage timings and counts, as json
+  "created_at" TEXT NOT NULL DEFAULT (datetime('now')),
+  "updated_at" TEXT NOT NULL DEFAULT (datetime('now')),
+  FOREIGN KEY ("user_id") REFERENCES "users" ("id"),
+  FOREIGN KEY ("batch_id") REFERENCES "ingestion_batches" ("id")
+);
+
+CREATE INDEX "ingestion_jobs_batch_id_idx" ON "ingestion_jobs" ("batch_id");
+
 CREATE TABLE "knowledges" (
   "id" TEXT PRIMARY KEY DEFAULT (lower(hex(randomblob(16)))),
   "user_id" TEXT NOT NULL,
@@ -15,6 +15,21 @@ CREATE TYPE "sender_type" AS ENUM (
   'user'
 );
 
+CREATE TYPE "ingestion_status" AS ENUM (
+  'queued',
+  'extracting',
+  'contextualizing',
+  'indexing',
+  'done',
+  'failed'
+);
+
+CREATE TYPE "batch_status" AS ENUM (
+  'scanning',
+  'scanned',
+  'failed'
+);
+
 CREATE TABLE "users" (
   "id" UUID PRIMARY KEY DEFAULT (uuid_generate_v4()),
   "username" varchar(25) UNIQUE NOT NULL,
@@ -40,19 +55,56 @@ CREATE TABLE "documents" (
   "file_name" text NOT NULL,
   "file_type" varchar(5) NOT NULL,
   "file_size" float NOT NULL,
+  "content_hash" text,
+  "source_document_id" UUID,
   "created_at" timestamp NOT NULL DEFAULT (now()),
   "updated_at" timestamp NOT NULL DEFAULT (now())
 );
 
+CREATE INDEX ON "documents" ("content_hash");
+
+CREATE INDEX ON "documents" ("source_document_id");
+
 CREATE TABLE "chunks" (
   "id" UUID PRIMARY KEY DEFAULT (uuid_generate_v4()),
   "document_id" UUID NOT NULL,
   "chunk_index" int NOT NULL,
   "vector_id" text NOT NULL,
+  "content_hash" text, -- sha256 of the chunk text, without its context
+  "minhash" text, -- hex MinHash signature of the chunk text, for near-duplicates
+  "created_at" timestamp NOT NULL DEFAULT (now()),
+  "updated_at" timestamp NOT NULL DEFAULT (now())
+);
+
+CREATE TABLE "ingestion_batches" (
+  "id" UUID PRIMARY KEY DEFAULT (uuid_generate_v4()),
+  "user_id" UUID NOT NULL,
+  "status" batch_status NOT NULL DEFAULT 'scanning',
+  "total" int NOT NULL DEFAULT 0,
+  "error" text,
   "created_at" timestamp NOT NULL DEFAULT (now()),
   "updated_at" timestamp NOT NULL DEFAULT (now())
 );
 
+CREATE TABLE "ingestion_jobs" (
+  "id" UUID PRIMARY KEY DEFAULT (uuid_generate_v4()),
+  "user_id" UUID NOT NULL,
+  "batch_id" UUID,
+  "document_id" UUID NOT NULL,
+  "file_name" text NOT NULL,
+  "object_name" text,
+  "file_type" text,
+  "file_size" float,
+  "content_hash" text,
+  "status" ingestion_status NOT NULL DEFAULT 'queued',
+  "error" text,
+  "report" text, -- per-stage timings and counts, as json
+  "created_at" timestamp NOT NULL DEFAULT (now()),
+  "updated_at" timestamp NOT NULL DEFAULT (now())
+);
+
+CREATE INDEX ON "ingestion_jobs" ("batch_id");
+
 CREATE TABLE "knowledges" (
   "id" UUID PRIMARY KEY DEFAULT (uuid_generate_v4()),
   "user_id" UUID NOT NULL,
@@ -109,6 +161,12 @@ ALTER TABLE "documents" ADD FOREIGN KEY ("user_id") REFERENCES "users" ("id");
 
 ALTER TABLE "chunks" ADD FOREIGN KEY ("id") REFERENCES "documents" ("id");
 
+ALTER TABLE "ingestion_jobs" ADD FOREIGN KEY ("user_id") REFERENCES "users" ("id");
+
+ALTER TABLE "ingestion_jobs" ADD FOREIGN KEY ("batch_id") REFERENCES "ingestion_batches" ("id");
+
+ALTER TABLE "ingestion_batches" ADD FOREIGN KEY ("user_id") REFERENCES "users" ("id");
+
 ALTER TABLE "knowledges" ADD FOREIGN KEY ("user_id") REFERENCES "users" ("id");
 
 ALTER TABLE "knowledge_documents" ADD FOREIGN KEY ("knowledge_id") REFERENCES "knowledges" ("id");